@@ -4,9 +4,100 @@ Image watermark script.
 """
 from PIL import Image, ImageDraw, ImageFont
 import argparse
+import functools
 import sys
 
-def add_watermark(input_path, output_path, text, position='bottom-right', opacity=128, font_size=36):
+try:
+    from profiling import add_profile_argument, enable_from_args, profiled, stage
+except ImportError:
+    print("Error: 'profiling.py' not found.", file=sys.stderr)
+    sys.exit(1)
+
+FONT_PATH = "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf"
+
+# Space between the watermark and the image edge, in pixels
+MARGIN = 20
+
+@functools.lru_cache(maxsize=16)
+def load_font(font_size):
+    """Load the watermark font at the given size, falling back to Pillow's built-in font."""
+    try:
+        return ImageFont.truetype(FONT_PATH, font_size)
+    except OSError:
+        return ImageFont.load_default()
+
+@functools.lru_cache(maxsize=64)
+def render_text(text, font_size, opacity):
+    """
+    Render watermark text onto a transparent layer just large enough to hold it.
+
+    The layer is cached and shared between calls, so callers must not modify it.
+
+    Returns:
+        (layer, bbox) where bbox is the text bounding box relative to the
+        drawing origin, as returned by ImageDraw.textbbox()
+    """
+    font = load_font(font_size)
+    bbox = ImageDraw.Draw(Image.new('RGBA', (1, 1))).textbbox((0, 0), text, font=font)
+
+    layer = Image.new('RGBA', (max(bbox[2] - bbox[0], 1), max(bbox[3] - bbox[1], 1)), (255, 255, 255, 0))
+    ImageDraw.Draw(layer).text((-bbox[0], -bbox[1]), text, fill=(255, 255, 255, opacity), font=font)
+    return layer, bbox
+
+def text_origin(image_size, text_size, position):
+    """Drawing origin for text of text_size placed at a named position."""
+    width, height = image_size
+    text_width, text_height = text_size
+
+    if position == 'top-left':
+        return MARGIN, MARGIN
+    elif position == 'top-right':
+        return width - text_width - MARGIN, MARGIN
+    elif position == 'bottom-left':
+        return MARGIN, height - text_height - MARGIN
+    elif position == 'bottom-right':
+        return width - text_width - MARGIN, height - text_height - MARGIN
+    elif position == 'center':
+        return (width - text_width) // 2, (height - text_height) // 2
+    else:
+        raise ValueError(f"Unknown position: {position}")
+
+def watermark(img, text, position='bottom-right', opacity=128, font_size=36):
+    """
+    Add a text watermark to an in-memory image. See add_watermark() for the arguments.
+
+    Only the region under the text is composited; the rest of the image is
+    copied unchanged.
+
+    Returns:
+        The watermarked PIL Image
+    """
+    layer, bbox = render_text(text, font_size, opacity)
+    x, y = text_origin(img.size, (bbox[2] - bbox[0], bbox[3] - bbox[1]), position)
+
+    # RGB and RGBA keep their mode; anything else becomes RGBA as before
+    if img.mode in ('RGB', 'RGBA'):
+        watermarked = img.copy()
+    else:
+        watermarked = img.convert('RGBA')
+
+    # Where the text layer lands, clipped to the image
+    left, top = x + bbox[0], y + bbox[1]
+    box = (max(left, 0), max(top, 0),
+           min(left + layer.width, watermarked.width), min(top + layer.height, watermarked.height))
+    if box[0] >= box[2] or box[1] >= box[3]:
+        return watermarked
+
+    region = watermarked.crop(box).convert('RGBA')
+    glyphs = layer.crop((box[0] - left, box[1] - top, box[2] - left, box[3] - top))
+    region = Image.alpha_composite(region, glyphs)
+
+    watermarked.paste(region.convert(watermarked.mode), box)
+    return watermarked
+
+@profiled
+def add_watermark(input_path, output_path, text, position='bottom-right', opacity=128, font_size=36,
+                  cache_dir=None):
     """
     Add a text watermark to an image.
 
@@ -17,58 +108,35 @@ def add_watermark(input_path, output_path, text, position='bottom-right', opacit
         position: Position (top-left, top-right, bottom-left, bottom-right, center)
         opacity: Text opacity (0-255, where 255 is fully opaque)
         font_size: Font size for watermark text
+        cache_dir: Result cache directory (see result_cache.py); a repeat run on the same
+                   input bytes with the same parameters reuses the stored output
     """
     try:
-        img = Image.open(input_path)
-
-        # Convert to RGBA if not already
-        if img.mode != 'RGBA':
-            img = img.convert('RGBA')
-
-        # Create transparent overlay
-        txt_layer = Image.new('RGBA', img.size, (255, 255, 255, 0))
-        draw = ImageDraw.Draw(txt_layer)
-
-        # Try to use a default font, fall back to basic if unavailable
-        try:
-            font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", font_size)
-        except:
-            font = ImageFont.load_default()
-
-        # Get text bounding box
-        bbox = draw.textbbox((0, 0), text, font=font)
-        text_width = bbox[2] - bbox[0]
-        text_height = bbox[3] - bbox[1]
-
-        # Calculate position
-        margin = 20
-        if position == 'top-left':
-            x, y = margin, margin
-        elif position == 'top-right':
-            x, y = img.width - text_width - margin, margin
-        elif position == 'bottom-left':
-            x, y = margin, img.height - text_height - margin
-        elif position == 'bottom-right':
-            x, y = img.width - text_width - margin, img.height - text_height - margin
-        elif position == 'center':
-            x, y = (img.width - text_width) // 2, (img.height - text_height) // 2
-        else:
-            raise ValueError(f"Unknown position: {position}")
-
-        # Draw text with opacity
-        draw.text((x, y), text, fill=(255, 255, 255, opacity), font=font)
-
-        # Composite the watermark onto the image
-        watermarked = Image.alpha_composite(img, txt_layer)
-
-        # Convert back to original mode if needed
-        if watermarked.mode != img.mode:
-            watermarked = watermarked.convert('RGB')
-
-        watermarked.save(output_path)
+        if cache_dir:
+            from result_cache import ResultCache
+            cache = ResultCache(cache_dir)
+            cache_key = cache.key(input_path, output_path, 'watermark', {
+                'text': text, 'position': position, 'opacity': opacity, 'font_size': font_size,
+            })
+            if cache.fetch(cache_key, output_path):
+                print("✓ Cache hit: reused a stored result")
+                print(f"✓ Saved to: {output_path}")
+                return True
+
+        with stage('open'):
+            img = Image.open(input_path)
+        with stage('decode'):
+            img.load()
+
+        with stage('watermark'):
+            watermarked = watermark(img, text, position=position, opacity=opacity, font_size=font_size)
+        with stage('save'):
+            watermarked.save(output_path)
 
         print(f"✓ Added watermark: '{text}'")
         print(f"✓ Position: {position}, Opacity: {opacity}")
+        if cache_dir:
+            cache.store(cache_key, output_path)
         print(f"✓ Saved to: {output_path}")
         return True
 
@@ -85,8 +153,11 @@ if __name__ == "__main__":
                        help="Position: top-left, top-right, bottom-left, bottom-right, center")
     parser.add_argument("--opacity", type=int, default=128, help="Text opacity (0-255)")
     parser.add_argument("--font-size", type=int, default=36, help="Font size")
+    parser.add_argument("--cache-dir", help="Reuse results from this cache directory (see result_cache.py)")
 
+    add_profile_argument(parser)
     args = parser.parse_args()
+    enable_from_args(args)
 
     success = add_watermark(
         args.input,
@@ -94,7 +165,8 @@ if __name__ == "__main__":
         args.text,
         position=args.position,
         opacity=args.opacity,
-        font_size=args.font_size
+        font_size=args.font_size,
+        cache_dir=args.cache_dir
     )
 
     sys.exit(0 if success else 1)
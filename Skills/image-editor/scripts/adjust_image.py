@@ -6,7 +6,143 @@ from PIL import Image, ImageEnhance
 import argparse
 import sys
 
-def adjust_image(input_path, output_path, brightness=1.0, contrast=1.0, saturation=1.0, sharpness=1.0):
+try:
+    from profiling import add_profile_argument, enable_from_args, profiled, stage
+except ImportError:
+    print("Error: 'profiling.py' not found.", file=sys.stderr)
+    sys.exit(1)
+
+# Applied in this order; each entry is (parameter name, enhancer class)
+ENHANCERS = [
+    ('brightness', ImageEnhance.Brightness),
+    ('contrast', ImageEnhance.Contrast),
+    ('saturation', ImageEnhance.Color),
+    ('sharpness', ImageEnhance.Sharpness),
+]
+
+ENGINES = ['fused', 'enhance']
+
+# Modes the fused engine handles; everything else goes through ImageEnhance
+FUSED_MODES = ('L', 'LA', 'RGB', 'RGBA')
+
+# ITU-R 601 luma weights, as used by Pillow's RGB -> L conversion
+LUMA = (0.299, 0.587, 0.114)
+
+def _blend_value(degenerate, value, factor):
+    """One channel value of Image.blend(degenerate, image, factor): truncated and clamped."""
+    result = degenerate + factor * (value - degenerate)
+    return 0 if result <= 0 else 255 if result >= 255 else int(result)
+
+def _tone_curve(img, brightness, contrast):
+    """
+    Build the 256-entry curve equal to Brightness followed by Contrast.
+
+    Contrast blends towards the mean luma of the brightened image, which is
+    computed from the per-channel histograms instead of a second pass.
+    """
+    brightened = [_blend_value(0, v, brightness) for v in range(256)]
+    if contrast == 1.0:
+        return brightened, None
+
+    histogram = img.histogram()
+    pixels = img.width * img.height
+    channel_means = [
+        sum(count * brightened[v] for v, count in enumerate(histogram[band * 256:(band + 1) * 256])) / pixels
+        for band in range(3 if img.mode in ('RGB', 'RGBA') else 1)
+    ]
+    if len(channel_means) == 3:
+        mean_luma = sum(w * m for w, m in zip(LUMA, channel_means))
+    else:
+        mean_luma = channel_means[0]
+    mean = int(mean_luma + 0.5)
+
+    return [_blend_value(mean, v, contrast) for v in brightened], mean
+
+def _fused_adjust(img, brightness, contrast, saturation):
+    """
+    Apply brightness, contrast and saturation in one pass where possible.
+
+    Brightness and contrast are per-channel maps and fold into one lookup
+    table; saturation blends each pixel with its luma, which is a 3x3 color
+    matrix. When the tone curve never clips it is affine, and folds into the
+    color matrix as well, so the whole adjustment is a single convert().
+    """
+    curve, mean = _tone_curve(img, brightness, contrast)
+    identity = list(range(256))
+    color = img.mode in ('RGB', 'RGBA')
+
+    if not color or saturation == 1.0:
+        if curve == identity:
+            return img
+        tone_bands = 3 if color else 1
+        return img.point(curve * tone_bands + identity * (len(img.getbands()) - tone_bands))
+
+    # Saturation matrix: out = luma + saturation * (in - luma); each row sums to 1
+    # Matrix conversion rounds where Image.blend truncates; the -0.5 offsets below compensate
+    rows = [[saturation * (i == j) + (1 - saturation) * LUMA[j] for j in range(3)] for i in range(3)]
+
+    # Unclipped brightness then contrast is v -> scale * v + offset
+    scale = brightness * contrast
+    offset = (mean or 0) * (1 - contrast)
+    ends = (offset, 255 * scale + offset)
+    affine = brightness <= 1.0 and all(0 <= v <= 255 for v in ends)
+
+    alpha = img.getchannel('A') if img.mode == 'RGBA' else None
+    rgb = img.convert('RGB') if img.mode != 'RGB' else img
+
+    if affine:
+        # Rows sum to 1, so the tone offset passes through the saturation matrix unchanged
+        matrix = tuple(v for row in rows for v in (scale * row[0], scale * row[1], scale * row[2], offset - 0.5))
+    else:
+        if curve != identity:
+            rgb = rgb.point(curve * 3)
+        matrix = tuple(v for row in rows for v in (row[0], row[1], row[2], -0.5))
+
+    rgb = rgb.convert('RGB', matrix)
+    if alpha is not None:
+        rgb.putalpha(alpha)
+    return rgb
+
+def adjust(img, brightness=1.0, contrast=1.0, saturation=1.0, sharpness=1.0, engine='fused', threads=1):
+    """
+    Adjust an in-memory image. See adjust_image() for the arguments.
+
+    Returns:
+        The adjusted PIL Image
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine: {engine}. Available: {', '.join(ENGINES)}")
+
+    factors = {
+        'brightness': brightness,
+        'contrast': contrast,
+        'saturation': saturation,
+        'sharpness': sharpness,
+    }
+
+    if engine == 'fused' and img.mode in FUSED_MODES:
+        img = _fused_adjust(img, brightness, contrast, saturation)
+        # Sharpness is a convolution and stays a separate pass
+        enhancers = ENHANCERS[3:]
+    else:
+        enhancers = ENHANCERS
+
+    for name, enhancer_class in enhancers:
+        if factors[name] == 1.0:
+            continue
+        if name == 'sharpness' and threads != 1:
+            # Sharpness blends with a 3x3 SMOOTH filter, so bands need one row of overlap.
+            # The other adjustments depend on whole-image statistics and stay unbanded
+            from parallel_filter import filter_bands
+            img = filter_bands(img, lambda band: enhancer_class(band).enhance(factors[name]), 1, threads=threads)
+        else:
+            img = enhancer_class(img).enhance(factors[name])
+
+    return img
+
+@profiled
+def adjust_image(input_path, output_path, brightness=1.0, contrast=1.0, saturation=1.0, sharpness=1.0,
+                 engine='fused', threads=1, cache_dir=None):
     """
     Adjust image properties.
 
@@ -17,39 +153,54 @@ def adjust_image(input_path, output_path, brightness=1.0, contrast=1.0, saturati
         contrast: Contrast factor (1.0 = original, <1.0 = less contrast, >1.0 = more contrast)
         saturation: Saturation factor (1.0 = original, 0.0 = grayscale, >1.0 = more saturated)
         sharpness: Sharpness factor (1.0 = original, <1.0 = blurred, >1.0 = sharper)
+        engine: 'fused' folds brightness, contrast and saturation into one lookup
+                table / color matrix pass for L, LA, RGB and RGBA images (matches
+                'enhance' to within a few levels), 'enhance' runs one
+                ImageEnhance pass per adjustment
+        threads: Sharpen overlapping horizontal bands of the image in this many
+                 threads (0 = one per CPU); the result is identical to 1 thread
+        cache_dir: Result cache directory (see result_cache.py); a repeat run on the same
+                   input bytes with the same parameters reuses the stored output
     """
     try:
-        img = Image.open(input_path)
-
-        adjustments_made = []
-
-        if brightness != 1.0:
-            enhancer = ImageEnhance.Brightness(img)
-            img = enhancer.enhance(brightness)
-            adjustments_made.append(f"brightness: {brightness}")
+        if cache_dir:
+            from result_cache import ResultCache
+            cache = ResultCache(cache_dir)
+            cache_key = cache.key(input_path, output_path, 'adjust', {
+                'brightness': brightness, 'contrast': contrast, 'saturation': saturation,
+                'sharpness': sharpness, 'engine': engine,
+            })
+            if cache.fetch(cache_key, output_path):
+                print("✓ Cache hit: reused a stored result")
+                print(f"✓ Saved to: {output_path}")
+                return True
 
-        if contrast != 1.0:
-            enhancer = ImageEnhance.Contrast(img)
-            img = enhancer.enhance(contrast)
-            adjustments_made.append(f"contrast: {contrast}")
+        with stage('open'):
+            img = Image.open(input_path)
+        with stage('decode'):
+            img.load()
 
-        if saturation != 1.0:
-            enhancer = ImageEnhance.Color(img)
-            img = enhancer.enhance(saturation)
-            adjustments_made.append(f"saturation: {saturation}")
+        with stage('adjust'):
+            img = adjust(img, brightness=brightness, contrast=contrast,
+                         saturation=saturation, sharpness=sharpness, engine=engine, threads=threads)
 
-        if sharpness != 1.0:
-            enhancer = ImageEnhance.Sharpness(img)
-            img = enhancer.enhance(sharpness)
-            adjustments_made.append(f"sharpness: {sharpness}")
+        adjustments_made = [
+            f"{name}: {value}"
+            for name, value in [('brightness', brightness), ('contrast', contrast),
+                                ('saturation', saturation), ('sharpness', sharpness)]
+            if value != 1.0
+        ]
 
-        img.save(output_path)
+        with stage('save'):
+            img.save(output_path)
 
         if adjustments_made:
             print(f"✓ Applied adjustments: {', '.join(adjustments_made)}")
         else:
             print("ℹ No adjustments applied (all values at default 1.0)")
 
+        if cache_dir:
+            cache.store(cache_key, output_path)
         print(f"✓ Saved to: {output_path}")
         return True
 
@@ -65,8 +216,16 @@ if __name__ == "__main__":
     parser.add_argument("--contrast", type=float, default=1.0, help="Contrast factor (default: 1.0)")
     parser.add_argument("--saturation", type=float, default=1.0, help="Saturation factor (default: 1.0)")
     parser.add_argument("--sharpness", type=float, default=1.0, help="Sharpness factor (default: 1.0)")
+    parser.add_argument("--engine", choices=ENGINES, default="fused",
+                       help="fused: single-pass color adjustment (default); enhance: one pass per adjustment")
+    parser.add_argument("--threads", type=int, default=1,
+                       help="Sharpen overlapping bands of the image in parallel threads, with identical results "
+                            "(0 = one per CPU; default: 1)")
+    parser.add_argument("--cache-dir", help="Reuse results from this cache directory (see result_cache.py)")
 
+    add_profile_argument(parser)
     args = parser.parse_args()
+    enable_from_args(args)
 
     success = adjust_image(
         args.input,
@@ -74,7 +233,10 @@ if __name__ == "__main__":
         brightness=args.brightness,
         contrast=args.contrast,
         saturation=args.saturation,
-        sharpness=args.sharpness
+        sharpness=args.sharpness,
+        engine=args.engine,
+        threads=args.threads,
+        cache_dir=args.cache_dir
     )
 
     sys.exit(0 if success else 1)
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+Frame-aware processing of animated GIF, WebP and APNG images.
+
+Frames are decoded in order (each one is composited onto the previous ones)
+and handed to a thread pool as they arrive, so the per-frame work of long
+animations runs on several cores while decoding continues; Pillow releases
+the GIL in its resampling, filtering and quantizing code. The result is
+encoded once, keeping every frame's duration and disposal and the loop count.
+
+GIF output uses one palette shared by every frame: the exact colors when the
+processed frames use at most 255 of them (e.g. after a crop or right-angle
+rotation), otherwise an adaptive palette built from a sample of the frames.
+"""
+from PIL import Image, ImageSequence
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+import os
+import sys
+
+try:
+    from convert_format import format_from_path, save_options
+except ImportError:
+    print("Error: 'convert_format.py' not found.", file=sys.stderr)
+    sys.exit(1)
+
+ANIMATED_FORMATS = ('GIF', 'WEBP', 'PNG')
+
+DEFAULT_DURATION = 100
+
+# Frame disposal codes of each format, and their generic names
+GIF_DISPOSAL = {0: 'none', 1: 'none', 2: 'background', 3: 'previous'}
+APNG_DISPOSAL = {0: 'none', 1: 'background', 2: 'previous'}
+GIF_DISPOSAL_CODES = {'none': 1, 'background': 2, 'previous': 3}
+APNG_DISPOSAL_CODES = {'none': 0, 'background': 1, 'previous': 2}
+
+# Frames sampled, and their size, when building an adaptive shared palette
+PALETTE_SAMPLE_FRAMES = 16
+PALETTE_SAMPLE_SIZE = (256, 256)
+
+# Palette index reserved for transparent pixels in GIF output
+TRANSPARENT_INDEX = 255
+
+def animated_output(img, output_path, output_format=None):
+    """True if img has several frames and the output format (default: from the extension) can store them all."""
+    output_format = output_format or format_from_path(output_path)
+    return bool(getattr(img, 'is_animated', False)) and output_format in ANIMATED_FORMATS
+
+def frame_timing(frame):
+    """Duration (ms) and generic disposal of the current frame of an animation."""
+    if hasattr(frame, 'disposal_method'):
+        disposal = GIF_DISPOSAL.get(frame.disposal_method, 'none')
+    else:
+        disposal = APNG_DISPOSAL.get(frame.info.get('disposal'), 'none')
+    return {'duration': frame.info.get('duration', DEFAULT_DURATION), 'disposal': disposal}
+
+def process_frames(img, frame_op, workers=None):
+    """
+    Decode every frame and apply frame_op to each in parallel threads.
+
+    Args:
+        img: Animated PIL Image
+        frame_op: Function taking and returning an RGBA PIL Image
+        workers: Threads (default: available CPUs)
+
+    Returns:
+        (processed frames, per-frame timing dicts) tuple
+    """
+    timings = []
+    futures = []
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as executor:
+        for frame in ImageSequence.Iterator(img):
+            # Some formats (WebP) only update the frame's info once it is loaded
+            frame.load()
+            timings.append(frame_timing(frame))
+            # In a copy of the caller's context, so profiling stages nest under its stage
+            futures.append(executor.submit(contextvars.copy_context().run, frame_op, frame.convert('RGBA')))
+        return [future.result() for future in futures], timings
+
+def has_transparency(frame):
+    return frame.mode == 'RGBA' and frame.getchannel('A').getextrema()[0] < 128
+
+def shared_palette(frames):
+    """
+    Colors for a palette shared by every frame (at most 255, leaving room for transparency).
+
+    Returns:
+        List of (r, g, b) tuples
+    """
+    colors = set()
+    for frame in frames:
+        found = frame.convert('RGBA').getcolors(4 * TRANSPARENT_INDEX)
+        if found is None:
+            break
+        colors.update(color[:3] for _, color in found if color[3] >= 128)
+        if len(colors) > TRANSPARENT_INDEX:
+            break
+    else:
+        # Few enough colors to keep them all exactly
+        return sorted(colors) or [(0, 0, 0)]
+
+    step = max(1, len(frames) // PALETTE_SAMPLE_FRAMES)
+    samples = []
+    for frame in frames[::step][:PALETTE_SAMPLE_FRAMES]:
+        sample = frame.convert('RGB')
+        sample.thumbnail(PALETTE_SAMPLE_SIZE)
+        samples.append(sample)
+    montage = Image.new('RGB', (max(s.width for s in samples), sum(s.height for s in samples)))
+    y = 0
+    for sample in samples:
+        montage.paste(sample, (0, y))
+        y += sample.height
+    palette = montage.quantize(colors=TRANSPARENT_INDEX, method=Image.Quantize.MEDIANCUT).getpalette()
+    return [tuple(palette[i:i + 3]) for i in range(0, len(palette), 3)][:TRANSPARENT_INDEX]
+
+def to_palette_frames(frames, workers=None):
+    """
+    Convert RGB(A) frames to P mode frames sharing one palette.
+
+    Returns:
+        (frames, transparency index or None) tuple
+    """
+    colors = shared_palette(frames)
+    transparent = any(has_transparency(frame) for frame in frames)
+
+    palette_image = Image.new('P', (1, 1))
+    palette_image.putpalette([value for color in colors for value in color])
+    # Pad to 256 entries so the transparent index always exists
+    full_palette = [value for color in colors for value in color] + [0] * (3 * (256 - len(colors)))
+
+    def convert(frame):
+        indexed = frame.convert('RGB').quantize(palette=palette_image, dither=Image.Dither.NONE)
+        indexed.putpalette(full_palette)
+        if transparent and frame.mode == 'RGBA':
+            indexed.paste(TRANSPARENT_INDEX, mask=frame.getchannel('A').point(lambda a: 255 if a < 128 else 0))
+        return indexed
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as executor:
+        return list(executor.map(convert, frames)), (TRANSPARENT_INDEX if transparent else None)
+
+def save_animation(frames, timings, output_path, loop=None, quality=None, workers=None, output_format=None):
+    """
+    Encode processed frames as one animated GIF, WebP or PNG (APNG).
+
+    Args:
+        frames: Processed frames (RGB or RGBA), all the same size
+        timings: Per-frame dicts with 'duration' (ms) and 'disposal' ('none',
+                 'background' or 'previous')
+        output_path: Output path or binary file object
+        loop: Loop count of the source (0 = forever, None = play once)
+        quality: Quality for WebP (default: Pillow's)
+        workers: Threads for GIF palette conversion
+        output_format: 'GIF', 'WEBP' or 'PNG' (default: from the extension)
+    """
+    output_format = output_format or format_from_path(output_path)
+    if output_format not in ANIMATED_FORMATS:
+        raise ValueError(f"{output_format} cannot store animations. Use one of: GIF, WEBP, PNG")
+
+    params = {'duration': [t['duration'] for t in timings]}
+    if output_format == 'GIF':
+        frames, transparency = to_palette_frames(frames, workers=workers)
+        params['disposal'] = [GIF_DISPOSAL_CODES[t['disposal']] for t in timings]
+        if transparency is not None:
+            params['transparency'] = transparency
+        if loop is not None:
+            params['loop'] = loop
+    else:
+        # WebP and APNG count plays, with 0 meaning forever; a GIF without a loop count plays once
+        params['loop'] = 1 if loop is None else loop
+        if output_format == 'PNG':
+            params['disposal'] = [APNG_DISPOSAL_CODES[t['disposal']] for t in timings]
+            # Frames are complete composites, so each replaces the canvas rather than blending onto it
+            params['blend'] = 0
+        elif quality is not None:
+            params.update(save_options(output_format, quality))
+
+    frames[0].save(output_path, format=output_format, save_all=True, append_images=frames[1:], **params)
+
+def process_animation(img, output_path, frame_op, quality=None, workers=None, output_format=None):
+    """
+    Apply frame_op to every frame of an animation and save the result once.
+
+    Args:
+        img: Animated PIL Image (GIF, WebP or APNG)
+        output_path: Output path (.gif, .webp or .png) or a binary file object
+        frame_op: Function taking and returning an RGBA PIL Image
+        quality: Quality for WebP output (default: Pillow's)
+        workers: Threads for per-frame work (default: available CPUs)
+        output_format: 'GIF', 'WEBP' or 'PNG' (default: from the extension)
+
+    Returns:
+        (frame count, output size) tuple
+    """
+    frames, timings = process_frames(img, frame_op, workers=workers)
+    if len({frame.size for frame in frames}) > 1:
+        raise ValueError("Frames came out in different sizes")
+    save_animation(frames, timings, output_path, loop=img.info.get('loop'), quality=quality, workers=workers,
+                   output_format=output_format)
+    return len(frames), frames[0].size
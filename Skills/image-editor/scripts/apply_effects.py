@@ -1,12 +1,244 @@
 #!/usr/bin/env python3
 """
-Image effects script for blur and filters.
+Image effects script for blur, filters, custom kernels and unsharp masking.
+
+Named filters can be chained in order in one run (e.g. SMOOTH,SHARPEN).
+With fuse, each run of consecutive kernel filters is combined into a single
+kernel by convolving the kernels together, so the run is one pass with one
+rounding; rank filters (MEDIAN, MIN, MAX) are not linear and end a run.
 """
 from PIL import Image, ImageFilter
 import argparse
+import math
 import sys
 
-def apply_effects(input_path, output_path, blur=None, filter_type=None):
+try:
+    from profiling import add_profile_argument, enable_from_args, profiled, stage
+except ImportError:
+    print("Error: 'profiling.py' not found.", file=sys.stderr)
+    sys.exit(1)
+
+FILTER_MAP = {
+    'CONTOUR': ImageFilter.CONTOUR,
+    'DETAIL': ImageFilter.DETAIL,
+    'EDGE_ENHANCE': ImageFilter.EDGE_ENHANCE,
+    'EDGE_ENHANCE_MORE': ImageFilter.EDGE_ENHANCE_MORE,
+    'EMBOSS': ImageFilter.EMBOSS,
+    'FIND_EDGES': ImageFilter.FIND_EDGES,
+    'SHARPEN': ImageFilter.SHARPEN,
+    'SMOOTH': ImageFilter.SMOOTH,
+    'SMOOTH_MORE': ImageFilter.SMOOTH_MORE,
+}
+
+# Non-linear 3x3 filters, which cannot be fused with kernels
+RANK_FILTERS = {
+    'MEDIAN': ImageFilter.MedianFilter(3),
+    'MIN': ImageFilter.MinFilter(3),
+    'MAX': ImageFilter.MaxFilter(3),
+}
+
+def get_filter(filter_type):
+    """Look up a named filter, raising ValueError for unknown names."""
+    name = filter_type.upper()
+    if name in RANK_FILTERS:
+        return RANK_FILTERS[name]
+    if name not in FILTER_MAP:
+        available = list(FILTER_MAP.keys()) + list(RANK_FILTERS.keys())
+        raise ValueError(f"Unknown filter type: {filter_type}. Available: {', '.join(available)}")
+    return FILTER_MAP[name]
+
+def filter_names(filter_type):
+    """
+    Split a filter name, comma-separated names or a list of names into a list
+    of validated upper-case names (empty for None).
+    """
+    if not filter_type:
+        return []
+    if isinstance(filter_type, str):
+        filter_type = filter_type.split(',')
+    names = [name.strip().upper() for name in filter_type]
+    for name in names:
+        get_filter(name)
+    return names
+
+def filter_size(name):
+    """Side length of the neighbourhood a named filter reads."""
+    if name.upper() in RANK_FILTERS:
+        return RANK_FILTERS[name.upper()].size
+    return get_filter(name).filterargs[0][1]
+
+ENGINES = ['pillow', 'numpy']
+
+# ImageFilter.UnsharpMask defaults: (radius, percent, threshold)
+UNSHARP_DEFAULTS = (2, 150, 3)
+
+def kernel_size(weights):
+    """Side length of a square kernel given as a flat list of weights."""
+    size = math.isqrt(len(weights))
+    if size * size != len(weights) or size % 2 == 0:
+        raise ValueError(f"Kernel must be an odd square (9, 25, 49, ... weights), got {len(weights)} weights")
+    return size
+
+def parse_kernel(kernel, scale=None):
+    """
+    Parse kernel weights given as a list or a comma-separated string.
+
+    Returns:
+        (weights, scale) tuple; scale defaults to the sum of the weights, or 1 if they sum to 0
+    """
+    if isinstance(kernel, str):
+        kernel = kernel.split(',')
+    try:
+        weights = [float(w) for w in kernel]
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid kernel: {kernel}. Use comma-separated numbers")
+    kernel_size(weights)
+    if scale is None:
+        scale = sum(weights) or 1
+    if scale == 0:
+        raise ValueError("Kernel scale must not be 0")
+    return weights, scale
+
+def parse_unsharp(unsharp):
+    """
+    Parse unsharp mask settings: a radius, or a 'RADIUS[,PERCENT[,THRESHOLD]]'
+    string or list, with missing values taken from UNSHARP_DEFAULTS.
+
+    Returns:
+        (radius, percent, threshold) tuple
+    """
+    if isinstance(unsharp, str):
+        unsharp = unsharp.split(',')
+    elif not isinstance(unsharp, (list, tuple)):
+        unsharp = [unsharp]
+    if not 1 <= len(unsharp) <= 3:
+        raise ValueError(f"Invalid unsharp mask: {unsharp}. Use RADIUS[,PERCENT[,THRESHOLD]]")
+    try:
+        values = [float(v) for v in unsharp]
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid unsharp mask: {unsharp}. Use RADIUS[,PERCENT[,THRESHOLD]]")
+    radius, percent, threshold = values + list(UNSHARP_DEFAULTS[len(values):])
+    return radius, int(percent), int(threshold)
+
+def fuse_kernels(first, second):
+    """
+    Combine two kernel filters into one kernel with the same result, apart from
+    the rounding and clipping between them.
+
+    The weights are convolved together, so the side of the result is the sum
+    of both sides minus 1. Kernel filters compute sum(weights * pixels) / scale
+    + offset, so the second filter's scale multiplies the first's, and the
+    first offset passes through the second kernel as offset * sum / scale.
+
+    Args:
+        first: (weights, scale, offset) of the kernel applied first
+        second: (weights, scale, offset) of the kernel applied second
+
+    Returns:
+        (weights, scale, offset) tuple
+    """
+    weights1, scale1, offset1 = first
+    weights2, scale2, offset2 = second
+    size1, size2 = kernel_size(weights1), kernel_size(weights2)
+    size = size1 + size2 - 1
+    weights = [0] * (size * size)
+    for row1 in range(size1):
+        for col1 in range(size1):
+            weight1 = weights1[row1 * size1 + col1]
+            if not weight1:
+                continue
+            for row2 in range(size2):
+                for col2 in range(size2):
+                    weights[(row1 + row2) * size + col1 + col2] += weight1 * weights2[row2 * size2 + col2]
+    return weights, scale1 * scale2, offset1 * sum(weights2) / scale2 + offset2
+
+def filter_steps(filter_type=None, kernel=None, kernel_scale=None, kernel_offset=0, fuse=False, max_size=None):
+    """
+    Plan the filter chain: the named filters in order, then the custom kernel.
+
+    Args:
+        filter_type: Filter name, comma-separated names or list of names
+        kernel, kernel_scale, kernel_offset: Custom kernel, as for apply_effects()
+        fuse: Combine runs of consecutive kernel filters into single kernels
+        max_size: Largest fused kernel side; longer runs are split (None = no limit)
+
+    Returns:
+        List of steps: a filter name, or a (weights, scale, offset) kernel
+    """
+    steps = filter_names(filter_type)
+    if kernel:
+        weights, scale = parse_kernel(kernel, kernel_scale)
+        steps.append((weights, scale, kernel_offset))
+    if not fuse:
+        return steps
+
+    def linear(step):
+        return not (isinstance(step, str) and step in RANK_FILTERS)
+
+    def kernel_args(step):
+        if isinstance(step, str):
+            (_, _), scale, offset, weights = get_filter(step).filterargs
+            return list(weights), scale, offset
+        return step
+
+    fused = []
+    for step in steps:
+        if fused and linear(step) and linear(fused[-1]):
+            previous, current = kernel_args(fused[-1]), kernel_args(step)
+            if max_size is None or kernel_size(previous[0]) + kernel_size(current[0]) - 1 <= max_size:
+                fused[-1] = fuse_kernels(previous, current)
+                continue
+        fused.append(step)
+    return fused
+
+def add_effects(img, blur=None, filter_type=None, kernel=None, kernel_scale=None, kernel_offset=0, unsharp=None,
+                engine='pillow', threads=1, fuse=False):
+    """
+    Apply effects to an in-memory image. See apply_effects() for the arguments.
+
+    Returns:
+        The processed PIL Image
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine: {engine}. Available: {', '.join(ENGINES)}")
+    if threads != 1:
+        from parallel_filter import filter_bands
+        from tiling import filter_halo
+        halo = filter_halo(blur, filter_type, kernel, unsharp)
+        return filter_bands(img, lambda band: add_effects(band, blur=blur, filter_type=filter_type, kernel=kernel,
+                                                          kernel_scale=kernel_scale, kernel_offset=kernel_offset,
+                                                          unsharp=unsharp, engine=engine, fuse=fuse),
+                            halo, threads=threads)
+    if engine == 'numpy':
+        from numpy_effects import add_effects as numpy_add_effects
+        return numpy_add_effects(img, blur=blur, filter_type=filter_type, kernel=kernel,
+                                 kernel_scale=kernel_scale, kernel_offset=kernel_offset, unsharp=unsharp, fuse=fuse)
+
+    if blur:
+        img = img.filter(ImageFilter.GaussianBlur(radius=blur))
+
+    # Pillow's kernel filters are 3x3 or 5x5, so fused runs are split to fit
+    for step in filter_steps(filter_type, kernel, kernel_scale, kernel_offset, fuse=fuse, max_size=5):
+        if isinstance(step, str):
+            img = img.filter(get_filter(step))
+            continue
+        weights, scale, offset = step
+        size = kernel_size(weights)
+        if size not in (3, 5):
+            raise ValueError(f"The pillow engine supports 3x3 and 5x5 kernels, got {size}x{size}; "
+                             "use engine='numpy' for larger kernels")
+        img = img.filter(ImageFilter.Kernel((size, size), weights, scale=scale, offset=offset))
+
+    if unsharp:
+        radius, percent, threshold = parse_unsharp(unsharp)
+        img = img.filter(ImageFilter.UnsharpMask(radius=radius, percent=percent, threshold=threshold))
+
+    return img
+
+@profiled
+def apply_effects(input_path, output_path, blur=None, filter_type=None, kernel=None, kernel_scale=None,
+                  kernel_offset=0, unsharp=None, engine='pillow', threads=1, fuse=False, tiled=False,
+                  memory_budget_mb=None, cache_dir=None):
     """
     Apply effects to an image.
 
@@ -14,43 +246,108 @@ def apply_effects(input_path, output_path, blur=None, filter_type=None):
         input_path: Path to input image
         output_path: Path to save processed image
         blur: Blur radius (higher = more blur)
-        filter_type: Type of filter to apply (CONTOUR, DETAIL, EDGE_ENHANCE, 
-                     EDGE_ENHANCE_MORE, EMBOSS, FIND_EDGES, SHARPEN, SMOOTH, SMOOTH_MORE)
+        filter_type: Filter to apply (CONTOUR, DETAIL, EDGE_ENHANCE, EDGE_ENHANCE_MORE,
+                     EMBOSS, FIND_EDGES, SHARPEN, SMOOTH, SMOOTH_MORE, or the rank
+                     filters MEDIAN, MIN, MAX), or several applied in order, as a list
+                     or comma-separated string
+        kernel: Custom square kernel as a flat list (or comma-separated string) of
+                weights, row by row; 3x3 or 5x5, or any odd size with the numpy engine
+        kernel_scale: Divisor for the kernel sum (default: sum of weights, or 1 if 0)
+        kernel_offset: Value added to the kernel result after scaling
+        unsharp: Unsharp mask as RADIUS or (RADIUS, PERCENT, THRESHOLD)
+                 (Pillow defaults: 2, 150, 3)
+        engine: 'pillow' (default) or 'numpy'; the numpy engine (see numpy_effects.py)
+                gives the same result and also accepts larger kernels
+        threads: Filter overlapping horizontal bands of the image in this many
+                 threads (0 = one per CPU); the result is identical to 1 thread
+        fuse: Combine each run of consecutive kernel filters (and the custom kernel)
+              into one kernel, so it is a single pass with no rounding or clipping
+              between the filters; results differ slightly from the separate passes
+        tiled: Process the image in overlapping strips and stream a TIFF to
+               disk, keeping memory within memory_budget_mb
+        memory_budget_mb: Peak memory budget for tiled mode in MB (default: 256)
+        cache_dir: Result cache directory (see result_cache.py); a repeat run on the same
+                   input bytes with the same parameters reuses the stored output
     """
     try:
-        img = Image.open(input_path)
+        if cache_dir:
+            from result_cache import ResultCache
+            cache = ResultCache(cache_dir)
+            cache_key = cache.key(input_path, output_path, 'effects', {
+                'blur': blur, 'filter_type': ','.join(filter_names(filter_type)) or None,
+                'kernel': list(parse_kernel(kernel, kernel_scale)) if kernel else None,
+                'kernel_offset': kernel_offset if kernel else None,
+                'unsharp': list(parse_unsharp(unsharp)) if unsharp else None,
+                'tiled': tiled, 'fuse': fuse,
+            })
+            if cache.fetch(cache_key, output_path):
+                print("✓ Cache hit: reused a stored result")
+                print(f"✓ Saved to: {output_path}")
+                return True
+
         effects_applied = []
 
+        if tiled:
+            if engine != 'pillow':
+                raise ValueError("Tiled mode uses the pillow engine")
+            from tiling import tiled_effects
+            with stage('tiled'):
+                tiled_effects(input_path, output_path, blur=blur, filter_type=filter_type, kernel=kernel,
+                              kernel_scale=kernel_scale, kernel_offset=kernel_offset, unsharp=unsharp,
+                              threads=threads, fuse=fuse, memory_budget_mb=memory_budget_mb)
+        else:
+            with stage('open'):
+                img = Image.open(input_path)
+            from animation import animated_output, process_animation
+            if animated_output(img, output_path):
+                with stage('animation'):
+                    frame_count, _ = process_animation(
+                        img, output_path, lambda frame: add_effects(
+                            frame, blur=blur, filter_type=filter_type, kernel=kernel, kernel_scale=kernel_scale,
+                            kernel_offset=kernel_offset, unsharp=unsharp, engine=engine, threads=threads,
+                            fuse=fuse))
+                print(f"✓ Processed {frame_count} animation frames")
+                img = None
+            else:
+                with stage('decode'):
+                    img.load()
+                with stage('effects'):
+                    img = add_effects(img, blur=blur, filter_type=filter_type, kernel=kernel,
+                                      kernel_scale=kernel_scale, kernel_offset=kernel_offset, unsharp=unsharp,
+                                      engine=engine, threads=threads, fuse=fuse)
+
         if blur:
-            img = img.filter(ImageFilter.GaussianBlur(radius=blur))
             effects_applied.append(f"Gaussian blur (radius: {blur})")
 
         if filter_type:
-            filter_map = {
-                'CONTOUR': ImageFilter.CONTOUR,
-                'DETAIL': ImageFilter.DETAIL,
-                'EDGE_ENHANCE': ImageFilter.EDGE_ENHANCE,
-                'EDGE_ENHANCE_MORE': ImageFilter.EDGE_ENHANCE_MORE,
-                'EMBOSS': ImageFilter.EMBOSS,
-                'FIND_EDGES': ImageFilter.FIND_EDGES,
-                'SHARPEN': ImageFilter.SHARPEN,
-                'SMOOTH': ImageFilter.SMOOTH,
-                'SMOOTH_MORE': ImageFilter.SMOOTH_MORE,
-            }
-
-            if filter_type.upper() not in filter_map:
-                raise ValueError(f"Unknown filter type: {filter_type}. Available: {', '.join(filter_map.keys())}")
-
-            img = img.filter(filter_map[filter_type.upper()])
-            effects_applied.append(f"{filter_type} filter")
-
-        img.save(output_path)
+            names = filter_names(filter_type)
+            effects_applied.append(f"{' then '.join(names)} filter{'s' if len(names) > 1 else ''}")
+
+        if kernel:
+            size = kernel_size(parse_kernel(kernel)[0])
+            effects_applied.append(f"{size}x{size} kernel")
+
+        if unsharp:
+            effects_applied.append("Unsharp mask (radius: {}, percent: {}, threshold: {})".format(
+                *parse_unsharp(unsharp)))
+
+        if not tiled and img is not None:
+            with stage('save'):
+                img.save(output_path)
 
         if effects_applied:
             print(f"✓ Applied effects: {', '.join(effects_applied)}")
+            if fuse:
+                steps = len(filter_steps(filter_type, kernel, kernel_scale, kernel_offset))
+                passes = len(filter_steps(filter_type, kernel, kernel_scale, kernel_offset, fuse=True,
+                                          max_size=None if engine == 'numpy' else 5))
+                if passes < steps:
+                    print(f"✓ Fused {steps} filter passes into {passes}")
         else:
             print("ℹ No effects applied")
 
+        if cache_dir:
+            cache.store(cache_key, output_path)
         print(f"✓ Saved to: {output_path}")
         return True
 
@@ -63,12 +360,34 @@ if __name__ == "__main__":
     parser.add_argument("input", help="Input image path")
     parser.add_argument("output", help="Output image path")
     parser.add_argument("--blur", type=float, help="Blur radius (e.g., 2.0, 5.0)")
-    parser.add_argument("--filter", dest="filter_type", 
-                       help="Filter type: CONTOUR, DETAIL, EDGE_ENHANCE, EDGE_ENHANCE_MORE, "
-                            "EMBOSS, FIND_EDGES, SHARPEN, SMOOTH, SMOOTH_MORE")
+    parser.add_argument("--filter", dest="filter_type",
+                       help="Filter type: CONTOUR, DETAIL, EDGE_ENHANCE, EDGE_ENHANCE_MORE, EMBOSS, FIND_EDGES, "
+                            "SHARPEN, SMOOTH, SMOOTH_MORE, MEDIAN, MIN, MAX; comma-separate several to apply "
+                            "them in order (e.g. SMOOTH,SHARPEN)")
+    parser.add_argument("--kernel", help="Custom square kernel weights, row by row (e.g. 0,-1,0,-1,5,-1,0,-1,0)")
+    parser.add_argument("--kernel-scale", type=float, help="Kernel divisor (default: sum of weights, or 1)")
+    parser.add_argument("--kernel-offset", type=float, default=0, help="Value added after scaling (default: 0)")
+    parser.add_argument("--unsharp", help="Unsharp mask RADIUS[,PERCENT[,THRESHOLD]] (default percent/threshold: "
+                                          f"{UNSHARP_DEFAULTS[1]}/{UNSHARP_DEFAULTS[2]})")
+    parser.add_argument("--engine", choices=ENGINES, default="pillow",
+                       help="Filter implementation: pillow, or numpy for larger kernels (default: pillow)")
+    parser.add_argument("--threads", type=int, default=1,
+                       help="Filter overlapping bands of the image in parallel threads, with identical results "
+                            "(0 = one per CPU; default: 1)")
+    parser.add_argument("--fuse", action="store_true",
+                       help="Combine consecutive kernel filters into one kernel pass, without rounding in between")
+    parser.add_argument("--tiled", action="store_true",
+                       help="Process in overlapping strips with bounded memory (for very large images; writes TIFF)")
+    parser.add_argument("--memory-budget", type=float, help="Peak memory budget for --tiled in MB (default: 256)")
+    parser.add_argument("--cache-dir", help="Reuse results from this cache directory (see result_cache.py)")
 
+    add_profile_argument(parser)
     args = parser.parse_args()
+    enable_from_args(args)
 
-    success = apply_effects(args.input, args.output, blur=args.blur, filter_type=args.filter_type)
+    success = apply_effects(args.input, args.output, blur=args.blur, filter_type=args.filter_type,
+                            kernel=args.kernel, kernel_scale=args.kernel_scale, kernel_offset=args.kernel_offset,
+                            unsharp=args.unsharp, engine=args.engine, threads=args.threads, fuse=args.fuse,
+                            tiled=args.tiled, memory_budget_mb=args.memory_budget, cache_dir=args.cache_dir)
 
     sys.exit(0 if success else 1)
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+Asynchronous batch driver for images on slow (network-mounted) storage.
+
+Each file goes through three stages with their own concurrency limits:
+read the input bytes (I/O threads), decode/process/encode them (a process
+pool), and write the output bytes (I/O threads). While some files are
+waiting on storage, others keep the CPU workers busy, so the slow reads and
+writes overlap with processing instead of serializing with it.
+"""
+from PIL import Image
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+try:
+    from pipeline import add_operation_arguments, operations_from_args, process_bytes
+    from batch_process import collect_inputs, plan_tasks, default_workers
+    from convert_format import format_from_path
+    from profiling import add_profile_argument, enable_from_args, enable_from_env
+    from quantize import inline_palettes
+except ImportError as e:
+    print(f"Error: sibling script not found ({e}). Run async_runner.py from the scripts/ directory.",
+          file=sys.stderr)
+    sys.exit(1)
+
+DEFAULT_READS = 16
+DEFAULT_WRITES = 8
+
+def _init_worker():
+    """Warm a worker: load every Pillow plugin and turn on profiling if requested."""
+    Image.init()
+    enable_from_env()
+
+def read_file(path):
+    """Read a whole file (runs in an I/O thread)."""
+    with open(path, 'rb') as f:
+        return f.read()
+
+def write_file(path, data):
+    """Write a file atomically via a temporary file in the same directory (runs in an I/O thread)."""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+async def run_async(tasks, operations, quality=95, workers=None, reads=DEFAULT_READS, writes=DEFAULT_WRITES):
+    """
+    Process (input_path, output_path) pairs with overlapped I/O and CPU work.
+
+    Args:
+        tasks: List of (input_path, output_path) pairs
+        operations: Operation dicts applied to every image (see pipeline.py)
+        quality: Quality for JPEG/WebP output (1-100)
+        workers: CPU worker processes (default: available CPUs)
+        reads: Concurrent input reads (also the prefetch depth)
+        writes: Concurrent output writes
+
+    Returns:
+        List of result dicts in input order: input, output, ok, error,
+        seconds, and read_ms/cpu_ms/write_ms for the stages that ran
+    """
+    loop = asyncio.get_running_loop()
+    workers = workers or default_workers()
+    # Palette files are read here once rather than by every worker
+    operations = inline_palettes(operations)
+
+    read_slots = asyncio.Semaphore(reads)
+    cpu_slots = asyncio.Semaphore(workers)
+    write_slots = asyncio.Semaphore(writes)
+    # Files in any stage; bounds the bytes held in memory between stages
+    file_slots = asyncio.Semaphore(reads + workers + writes)
+
+    async def process(input_path, output_path):
+        start = time.perf_counter()
+        result = {'input': input_path, 'output': output_path}
+        try:
+            async with read_slots:
+                stage = time.perf_counter()
+                data = await loop.run_in_executor(io_pool, read_file, input_path)
+                result['read_ms'] = round((time.perf_counter() - stage) * 1000, 3)
+
+            async with cpu_slots:
+                stage = time.perf_counter()
+                data, _, _ = await loop.run_in_executor(cpu_pool, process_bytes, data,
+                                                        format_from_path(output_path), operations, quality)
+                result['cpu_ms'] = round((time.perf_counter() - stage) * 1000, 3)
+
+            async with write_slots:
+                stage = time.perf_counter()
+                await loop.run_in_executor(io_pool, write_file, output_path, data)
+                result['write_ms'] = round((time.perf_counter() - stage) * 1000, 3)
+
+            result.update({'ok': True, 'error': None})
+        except Exception as e:
+            result.update({'ok': False, 'error': f"{type(e).__name__}: {e}"})
+        finally:
+            file_slots.release()
+        result['seconds'] = round(time.perf_counter() - start, 6)
+        return result
+
+    with ThreadPoolExecutor(max_workers=reads + writes) as io_pool, \
+            ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as cpu_pool:
+        pending = []
+        for input_path, output_path in tasks:
+            # Start files only as fast as they drain, rather than queueing every coroutine up front
+            await file_slots.acquire()
+            pending.append(asyncio.ensure_future(process(input_path, output_path)))
+        return list(await asyncio.gather(*pending))
+
+def async_batch(source, output_dir, operations, quality=95, output_format=None, recursive=False, workers=None,
+                reads=DEFAULT_READS, writes=DEFAULT_WRITES, report_path=None):
+    """
+    Process every image matched by a directory or glob, overlapping storage I/O with CPU work.
+
+    Args:
+        source: Input directory or glob pattern (e.g. 'photos/**/*.jpg')
+        output_dir: Directory to write results to, mirroring the input layout
+        operations: Operation dicts applied to every image (see pipeline.py)
+        quality: Quality for JPEG/WebP output (1-100)
+        output_format: Output extension (e.g. 'webp'); defaults to the input's
+        recursive: Descend into subdirectories when source is a directory
+        workers: CPU worker processes (default: available CPUs)
+        reads: Concurrent input reads (prefetch depth)
+        writes: Concurrent output writes
+        report_path: Optional path for a JSON report of every result
+    """
+    try:
+        base_dir, inputs = collect_inputs(source, recursive=recursive)
+        if not inputs:
+            raise ValueError(f"No images found for: {source}")
+
+        tasks = plan_tasks(inputs, base_dir, output_dir, output_format)
+        workers = workers or default_workers()
+        print(f"ℹ Processing {len(tasks)} images: {reads} reads, {workers} CPU workers, {writes} writes in flight")
+
+        start = time.perf_counter()
+        results = asyncio.run(run_async(tasks, operations, quality=quality, workers=workers,
+                                        reads=reads, writes=writes))
+        elapsed = time.perf_counter() - start
+
+        failures = [r for r in results if not r['ok']]
+        for result in failures:
+            print(f"✗ {result['input']}: {result['error']}", file=sys.stderr)
+        succeeded = len(results) - len(failures)
+
+        if report_path:
+            with open(report_path, 'w', encoding='utf-8') as f:
+                json.dump({
+                    'processed': succeeded,
+                    'failed': len(failures),
+                    'seconds': round(elapsed, 3),
+                    'results': results,
+                }, f, indent=2)
+
+        print(f"✓ Processed {succeeded}/{len(results)} images in {elapsed:.2f}s "
+              f"({len(results) / elapsed if elapsed else 0:.1f} images/s)")
+        if failures:
+            print(f"✗ {len(failures)} failed", file=sys.stderr)
+        print(f"✓ Saved to: {output_dir}")
+        if report_path:
+            print(f"✓ Report: {report_path}")
+        return not failures
+
+    except Exception as e:
+        print(f"✗ Error running batch: {e}", file=sys.stderr)
+        return False
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Apply a pipeline of operations to many images on slow storage, overlapping I/O and CPU work")
+    parser.add_argument("input", help="Input directory, glob pattern (quote globs, e.g. 'photos/*.jpg') or @LIST "
+                                      "file of paths (e.g. from inspect_images.py --query)")
+    parser.add_argument("output_dir", help="Output directory")
+    add_operation_arguments(parser)
+    parser.add_argument("--format", dest="output_format", help="Output format extension (e.g. webp, jpg)")
+    parser.add_argument("--recursive", action="store_true", help="Include subdirectories of an input directory")
+    parser.add_argument("--workers", type=int, help="CPU worker processes (default: available CPUs)")
+    parser.add_argument("--reads", type=int, default=DEFAULT_READS,
+                       help=f"Concurrent input reads / prefetch depth (default: {DEFAULT_READS})")
+    parser.add_argument("--writes", type=int, default=DEFAULT_WRITES,
+                       help=f"Concurrent output writes (default: {DEFAULT_WRITES})")
+    parser.add_argument("--report", help="Write a JSON report of every result to this path")
+
+    add_profile_argument(parser)
+    args = parser.parse_args()
+    enable_from_args(args)
+
+    try:
+        operations, quality = operations_from_args(args)
+    except (OSError, ValueError) as e:
+        print(f"✗ Error reading operations: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    success = async_batch(
+        args.input,
+        args.output_dir,
+        operations,
+        quality=quality,
+        output_format=args.output_format,
+        recursive=args.recursive,
+        workers=args.workers,
+        reads=args.reads,
+        writes=args.writes,
+        report_path=args.report
+    )
+
+    sys.exit(0 if success else 1)
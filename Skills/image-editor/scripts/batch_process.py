@@ -0,0 +1,409 @@
+#!/usr/bin/env python3
+"""
+Parallel batch processing of many images with a pool of warm worker processes.
+"""
+from PIL import Image
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import argparse
+import glob
+import json
+import os
+import shutil
+import sys
+import time
+
+try:
+    from pipeline import add_operation_arguments, operations_from_args, process_image
+    from profiling import add_profile_argument, enable_from_args, enable_from_env
+    from quantize import inline_palettes
+except ImportError:
+    print("Error: 'pipeline.py', 'profiling.py' or 'quantize.py' not found.", file=sys.stderr)
+    sys.exit(1)
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp', '.gif', '.bmp', '.tif', '.tiff'}
+
+# Per-worker state, set once by _init_worker instead of being pickled with every task
+_worker_operations = []
+_worker_quality = 95
+_worker_cache = None
+
+def default_workers():
+    """Return the number of CPUs this process may run on."""
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+def collect_inputs(source, recursive=False):
+    """
+    Expand a directory, glob pattern or @LIST file into a sorted list of image files.
+
+    An @LIST source names a text file with one image path per line, such as
+    the output of inspect_images.py --query.
+
+    Returns:
+        (base_dir, paths) tuple; output paths mirror each path relative to base_dir
+    """
+    if os.path.isdir(source):
+        base_dir = source
+        pattern = os.path.join(source, '**', '*') if recursive else os.path.join(source, '*')
+        paths = glob.glob(pattern, recursive=recursive)
+    else:
+        if source.startswith('@') and os.path.isfile(source[1:]):
+            with open(source[1:], 'r', encoding='utf-8') as f:
+                paths = [line.rstrip('\r\n') for line in f if line.strip()]
+        else:
+            paths = glob.glob(source, recursive=True)
+        base_dir = os.path.commonpath([os.path.dirname(os.path.abspath(p)) for p in paths]) if paths else '.'
+
+    paths = sorted(p for p in paths
+                   if os.path.isfile(p) and os.path.splitext(p)[1].lower() in IMAGE_EXTENSIONS)
+    return base_dir, paths
+
+def output_path_for(input_path, base_dir, output_dir, output_format=None):
+    """Map an input file to its path under output_dir, optionally changing the extension."""
+    relative = os.path.relpath(os.path.abspath(input_path), os.path.abspath(base_dir))
+    if output_format:
+        relative = os.path.splitext(relative)[0] + '.' + output_format.lower().lstrip('.')
+    return os.path.join(output_dir, relative)
+
+def plan_tasks(inputs, base_dir, output_dir, output_format=None):
+    """
+    Pair each input with its output path.
+
+    Returns:
+        List of (input_path, output_path) pairs
+
+    Raises:
+        ValueError: If two inputs map to the same output (e.g. a.jpg and a.png with output_format='webp')
+    """
+    tasks = [(p, output_path_for(p, base_dir, output_dir, output_format)) for p in inputs]
+    claimed = {}
+    for input_path, output_path in tasks:
+        other = claimed.setdefault(os.path.normcase(os.path.abspath(output_path)), input_path)
+        if other != input_path:
+            raise ValueError(f"{other} and {input_path} would both be written to {output_path}; "
+                             "rename one or leave out the output format")
+    return tasks
+
+def _init_worker(operations, quality, cache_dir=None):
+    """Warm a worker: load every Pillow plugin and keep the job settings."""
+    global _worker_operations, _worker_quality, _worker_cache
+    Image.init()
+    enable_from_env()
+    _worker_operations = operations
+    _worker_quality = quality
+    if cache_dir:
+        from result_cache import ResultCache
+        _worker_cache = ResultCache(cache_dir)
+
+def _process_chunk(tasks):
+    """Process a chunk of (input_path, output_path) pairs inside a worker."""
+    results = []
+    for input_path, output_path in tasks:
+        start = time.perf_counter()
+        cached = False
+        try:
+            os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+            if _worker_cache:
+                # Same key as pipeline.py --cache-dir, so the two share entries
+                cache_key = _worker_cache.key(input_path, output_path, 'pipeline', {
+                    'operations': _worker_operations, 'quality': _worker_quality,
+                })
+                cached = _worker_cache.fetch(cache_key, output_path)
+            if not cached:
+                process_image(input_path, output_path, _worker_operations, quality=_worker_quality)
+                if _worker_cache:
+                    _worker_cache.store(cache_key, output_path)
+            error = None
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        results.append({
+            'input': input_path,
+            'output': output_path,
+            'ok': error is None,
+            'cached': cached,
+            'error': error,
+            'seconds': round(time.perf_counter() - start, 6),
+        })
+    return results
+
+def run_scheduled(executor, tasks, costs, workers, memory_budget, ordered=True):
+    """
+    Submit tasks one file at a time, only while their estimated memory fits the budget.
+
+    Args:
+        executor: Process pool whose workers were set up by _init_worker
+        tasks: List of (input_path, output_path) pairs
+        costs: Estimated peak bytes of each task (see scheduler.py)
+        workers: Number of worker processes
+        memory_budget: Budget in bytes for all jobs running at once
+        ordered: Yield results in input order instead of completion order
+
+    Yields:
+        One result dict per file
+    """
+    from scheduler import MemoryScheduler
+
+    scheduler = MemoryScheduler(memory_budget, workers)
+    scheduler.add_all(enumerate(costs))
+
+    running = {}
+    finished = {}
+    next_result = 0
+    while scheduler:
+        index = scheduler.take()
+        while index is not None:
+            running[executor.submit(_process_chunk, [tasks[index]])] = index
+            index = scheduler.take()
+
+        done, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+            index = running.pop(future)
+            scheduler.release(index)
+            if ordered:
+                finished[index] = future.result()
+            else:
+                yield from future.result()
+
+        while next_result in finished:
+            yield from finished.pop(next_result)
+            next_result += 1
+
+def run_batch(tasks, operations, quality=95, workers=None, chunksize=16, ordered=True, cache_dir=None,
+              memory_budget_mb=None):
+    """
+    Run the pipeline over many files in a process pool.
+
+    Args:
+        tasks: List of (input_path, output_path) pairs
+        operations: Operation dicts applied to every image (see pipeline.py)
+        quality: Quality for JPEG/WebP output (1-100)
+        workers: Number of worker processes (default: available CPUs)
+        chunksize: Number of files sent to a worker per task
+        ordered: Yield results in input order instead of completion order
+        cache_dir: Result cache directory shared by all workers (see result_cache.py)
+        memory_budget_mb: RAM budget in megabytes for the images being processed at once;
+                          each file's peak is estimated from its header and files are
+                          started only while the total fits (see scheduler.py)
+
+    Yields:
+        One result dict per file: input, output, ok, cached, error, seconds
+    """
+    workers = workers or default_workers()
+    # Palette files are read here once rather than by every worker
+    operations = inline_palettes(operations)
+    if memory_budget_mb:
+        from scheduler import estimate_jobs
+        costs = estimate_jobs(tasks, operations)
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(operations, quality, cache_dir)) as executor:
+            yield from run_scheduled(executor, tasks, costs, workers, int(memory_budget_mb * 2**20), ordered=ordered)
+        return
+
+    chunks = [tasks[i:i + chunksize] for i in range(0, len(tasks), chunksize)]
+    # Keep a bounded number of chunks in flight so huge batches don't queue every future up front
+    max_in_flight = workers * 2
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(operations, quality, cache_dir)) as executor:
+        pending = []
+        next_chunk = 0
+        while next_chunk < len(chunks) or pending:
+            while next_chunk < len(chunks) and len(pending) < max_in_flight:
+                pending.append(executor.submit(_process_chunk, chunks[next_chunk]))
+                next_chunk += 1
+
+            if ordered:
+                done = [pending.pop(0)]
+            else:
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                done = [f for f in pending if f in finished]
+                pending = [f for f in pending if f not in finished]
+
+            for future in done:
+                yield from future.result()
+
+def copy_duplicates(results, duplicates):
+    """
+    Pass results through, copying each successful output to the duplicates of its input.
+
+    Args:
+        results: Iterable of result dicts (see run_batch)
+        duplicates: Dict of representative input to a list of (input_path, output_path)
+                    pairs of its duplicates
+
+    Yields:
+        Every result with a duplicate_of key, followed by one result per copied duplicate;
+        the duplicates of failed representatives are collected in the failed list instead
+    """
+    for result in results:
+        result['duplicate_of'] = None
+        yield result
+        for input_path, output_path in duplicates.get(result['input'], []):
+            start = time.perf_counter()
+            error = None
+            try:
+                if not result['ok']:
+                    raise RuntimeError(f"{result['input']} failed")
+                os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+                shutil.copyfile(result['output'], output_path)
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+            yield {
+                'input': input_path,
+                'output': output_path,
+                'ok': error is None,
+                'cached': False,
+                'error': error,
+                'seconds': round(time.perf_counter() - start, 6),
+                'duplicate_of': result['input'],
+            }
+
+def batch_process(source, output_dir, operations, quality=95, output_format=None, recursive=False,
+                  workers=None, chunksize=16, ordered=True, report_path=None, cache_dir=None,
+                  memory_budget_mb=None, dedupe_threshold=None):
+    """
+    Process every image matched by a directory or glob into output_dir.
+
+    Args:
+        source: Input directory or glob pattern (e.g. 'photos/**/*.jpg')
+        output_dir: Directory to write results to, mirroring the input layout
+        operations: Operation dicts applied to every image (see pipeline.py)
+        quality: Quality for JPEG/WebP output (1-100)
+        output_format: Output extension (e.g. 'webp'); defaults to the input's
+        recursive: Descend into subdirectories when source is a directory
+        workers: Number of worker processes (default: available CPUs)
+        chunksize: Number of files sent to a worker per task
+        ordered: Report results in input order instead of completion order
+        report_path: Optional path for a JSON report of every result
+        cache_dir: Result cache directory; files whose bytes and operations were
+                   processed before are copied from the cache instead
+        memory_budget_mb: RAM budget in megabytes; large files are kept from running
+                          at the same time (chunksize is ignored)
+        dedupe_threshold: Find near-duplicate inputs by perceptual hash (see dedupe.py)
+                          within this Hamming distance; only one image of each group
+                          is processed and its output is copied for the others
+    """
+    try:
+        base_dir, inputs = collect_inputs(source, recursive=recursive)
+        if not inputs:
+            raise ValueError(f"No images found for: {source}")
+
+        tasks = plan_tasks(inputs, base_dir, output_dir, output_format)
+        workers = workers or default_workers()
+
+        start = time.perf_counter()
+        duplicates = {}
+        if dedupe_threshold is not None:
+            from dedupe import find_duplicates
+            outputs = dict(tasks)
+            # Only images with the same output format can share an output file
+            found = find_duplicates(inputs, threshold=dedupe_threshold,
+                                    group_key=lambda path: os.path.splitext(outputs[path])[1].lower())
+            for duplicate, representative in found.items():
+                duplicates.setdefault(representative, []).append((duplicate, outputs[duplicate]))
+            tasks = [task for task in tasks if task[0] not in found]
+            print(f"ℹ {len(found)} near-duplicate images will reuse the output of another")
+
+        budget = f" within {memory_budget_mb:g}MB" if memory_budget_mb else ""
+        print(f"ℹ Processing {len(tasks)} images with {workers} workers{budget}")
+
+        batch_options = dict(quality=quality, workers=workers, chunksize=chunksize, ordered=ordered,
+                             cache_dir=cache_dir, memory_budget_mb=memory_budget_mb)
+        results = []
+        for result in copy_duplicates(run_batch(tasks, operations, **batch_options), duplicates):
+            results.append(result)
+            # Duplicates of failed images are retried below
+            if not result['ok'] and not result['duplicate_of']:
+                print(f"✗ {result['input']}: {result['error']}", file=sys.stderr)
+
+        # A representative can fail where its duplicates would not (e.g. a truncated file)
+        retry = [(r['input'], r['output']) for r in results if r['duplicate_of'] and not r['ok']]
+        if retry:
+            results = [r for r in results if not (r['duplicate_of'] and not r['ok'])]
+            print(f"ℹ Processing {len(retry)} duplicates of failed images themselves")
+            for result in copy_duplicates(run_batch(retry, operations, **batch_options), {}):
+                results.append(result)
+                if not result['ok']:
+                    print(f"✗ {result['input']}: {result['error']}", file=sys.stderr)
+        elapsed = time.perf_counter() - start
+
+        failures = [r for r in results if not r['ok']]
+        succeeded = len(results) - len(failures)
+        cache_hits = sum(1 for r in results if r['cached'])
+        duplicate_count = sum(1 for r in results if r['duplicate_of'])
+
+        if report_path:
+            with open(report_path, 'w', encoding='utf-8') as f:
+                json.dump({
+                    'processed': succeeded,
+                    'failed': len(failures),
+                    'cache_hits': cache_hits,
+                    'duplicates': duplicate_count,
+                    'seconds': round(elapsed, 3),
+                    'results': results,
+                }, f, indent=2)
+
+        print(f"✓ Processed {succeeded}/{len(results)} images in {elapsed:.2f}s "
+              f"({len(results) / elapsed if elapsed else 0:.1f} images/s)")
+        if cache_dir:
+            print(f"✓ Cache hits: {cache_hits}/{len(results)}")
+        if dedupe_threshold is not None:
+            print(f"✓ Duplicates reused: {duplicate_count}/{len(results)}")
+        if failures:
+            print(f"✗ {len(failures)} failed", file=sys.stderr)
+        print(f"✓ Saved to: {output_dir}")
+        if report_path:
+            print(f"✓ Report: {report_path}")
+        return not failures
+
+    except Exception as e:
+        print(f"✗ Error running batch: {e}", file=sys.stderr)
+        return False
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply a pipeline of operations to many images in parallel")
+    parser.add_argument("input", help="Input directory, glob pattern (quote globs, e.g. 'photos/*.jpg') or @LIST "
+                                      "file of paths (e.g. from inspect_images.py --query)")
+    parser.add_argument("output_dir", help="Output directory")
+    add_operation_arguments(parser)
+    parser.add_argument("--format", dest="output_format", help="Output format extension (e.g. webp, jpg)")
+    parser.add_argument("--recursive", action="store_true", help="Include subdirectories of an input directory")
+    parser.add_argument("--workers", type=int, help="Worker processes (default: available CPUs)")
+    parser.add_argument("--chunksize", type=int, default=16, help="Images per worker task (default: 16)")
+    parser.add_argument("--unordered", action="store_true", help="Report results as they complete")
+    parser.add_argument("--report", help="Write a JSON report of every result to this path")
+    parser.add_argument("--cache-dir", help="Reuse results from this cache directory (see result_cache.py)")
+    parser.add_argument("--memory-budget", type=float, metavar="MB",
+                        help="Only run files together while their estimated decoded size fits this many MB")
+    parser.add_argument("--dedupe", type=int, nargs="?", const=3, metavar="THRESHOLD",
+                        help="Process one image of each group of near-duplicates (perceptual hashes within "
+                             "THRESHOLD bits, default: 3) and copy its output to the others")
+
+    add_profile_argument(parser)
+    args = parser.parse_args()
+    enable_from_args(args)
+
+    try:
+        operations, quality = operations_from_args(args)
+    except (OSError, ValueError) as e:
+        print(f"✗ Error reading operations: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    success = batch_process(
+        args.input,
+        args.output_dir,
+        operations,
+        quality=quality,
+        output_format=args.output_format,
+        recursive=args.recursive,
+        workers=args.workers,
+        chunksize=args.chunksize,
+        ordered=not args.unordered,
+        report_path=args.report,
+        cache_dir=args.cache_dir,
+        memory_budget_mb=args.memory_budget,
+        dedupe_threshold=args.dedupe
+    )
+
+    sys.exit(0 if success else 1)
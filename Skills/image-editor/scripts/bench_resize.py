@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Benchmark the resize_image speed modes against the exact LANCZOS path.
+"""
+from PIL import Image, ImageChops, ImageStat
+import argparse
+import json
+import math
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+try:
+    from resize_image import resize, SPEED_MODES
+except ImportError:
+    print("Error: 'resize_image.py' not found.", file=sys.stderr)
+    sys.exit(1)
+
+def make_test_jpeg(path, width, height, quality=90):
+    """Write a deterministic, detailed synthetic photo-like JPEG."""
+    detail = Image.effect_mandelbrot((width, height), (-2.0, -1.2, 1.0, 1.2), 100)
+    horizontal = Image.linear_gradient('L').resize((width, height))
+    radial = Image.radial_gradient('L').resize((width, height))
+    Image.merge('RGB', (detail, horizontal, radial)).save(path, quality=quality)
+
+def psnr(a, b):
+    """Peak signal-to-noise ratio between two same-sized RGB images, in dB."""
+    diff = ImageChops.difference(a.convert('RGB'), b.convert('RGB'))
+    mse = sum(v * v for v in ImageStat.Stat(diff).rms) / 3
+    return float('inf') if mse == 0 else 10 * math.log10(255 ** 2 / mse)
+
+def time_mode(path, width, speed, repeats):
+    """Time open + resize for one speed mode; returns (median seconds, result image)."""
+    timings = []
+    result = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        img = Image.open(path)
+        result = resize(img, width=width, speed=speed)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings), result
+
+def run_benchmark(source_size=(6000, 4000), width=400, repeats=5, input_path=None):
+    """
+    Benchmark every speed mode on one JPEG.
+
+    Returns:
+        List of result dicts: speed, seconds, speedup, psnr_vs_exact (None for exact)
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        if input_path is None:
+            input_path = os.path.join(tmp, 'source.jpg')
+            make_test_jpeg(input_path, *source_size)
+
+        exact_seconds, exact_img = time_mode(input_path, width, 'exact', repeats)
+        results = [{'speed': 'exact', 'seconds': exact_seconds, 'speedup': 1.0, 'psnr_vs_exact': None}]
+
+        for speed in SPEED_MODES:
+            if speed == 'exact':
+                continue
+            seconds, img = time_mode(input_path, width, speed, repeats)
+            results.append({
+                'speed': speed,
+                'seconds': seconds,
+                'speedup': exact_seconds / seconds,
+                'psnr_vs_exact': psnr(exact_img, img),
+            })
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark resize_image speed modes")
+    parser.add_argument("--input", help="JPEG to benchmark (default: synthetic 6000x4000 image)")
+    parser.add_argument("--width", type=int, default=400, help="Target width in pixels (default: 400)")
+    parser.add_argument("--repeats", type=int, default=5, help="Runs per mode; the median is reported (default: 5)")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+
+    args = parser.parse_args()
+
+    results = run_benchmark(width=args.width, repeats=args.repeats, input_path=args.input)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{'speed':<10} {'median':>10} {'speedup':>8} {'PSNR vs exact':>14}")
+        for r in results:
+            quality = '-' if r['psnr_vs_exact'] is None else f"{r['psnr_vs_exact']:.1f} dB"
+            print(f"{r['speed']:<10} {r['seconds'] * 1000:>8.1f}ms {r['speedup']:>7.2f}x {quality:>14}")
@@ -0,0 +1,445 @@
+#!/usr/bin/env python3
+"""
+Benchmark and regression suite for the image-editor scripts.
+
+Generates deterministic synthetic images over a grid of sizes, modes and
+formats, and times every operation split into decode, operation and encode,
+recording the peak memory each case adds. Results are written as JSON; a
+stored result file can be used as a baseline to flag regressions.
+
+Each case runs in a forked child process so that its peak memory is measured
+on its own (where fork is unavailable, cases run in-process and peak memory
+is not recorded).
+"""
+from PIL import Image, __version__ as PILLOW_VERSION
+import argparse
+import datetime
+import io
+import json
+import multiprocessing
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    # Windows: no getrusage, so no peak memory
+    resource = None
+
+try:
+    from pipeline import apply_operations
+    from convert_format import save_image
+except ImportError as e:
+    print(f"Error: sibling script not found ({e}). Run benchmark.py from the scripts/ directory.",
+          file=sys.stderr)
+    sys.exit(1)
+
+RESULTS_VERSION = 1
+
+SIZES = {
+    'thumb': (160, 120),
+    'small': (640, 480),
+    'hd': (1920, 1080),
+    '12mp': (4000, 3000),
+    '50mp': (8660, 5774),
+}
+DEFAULT_SIZES = ['thumb', 'small', 'hd']
+
+MODES = ['RGB', 'RGBA', 'L', 'P']
+
+# Modes each format stores natively; other combinations are skipped
+FORMAT_MODES = {
+    'jpg': ('RGB', 'L'),
+    'png': ('RGB', 'RGBA', 'L', 'P'),
+    'webp': ('RGB', 'RGBA'),
+    'gif': ('L', 'P'),
+    'bmp': ('RGB', 'L', 'P'),
+    'tiff': ('RGB', 'RGBA', 'L', 'P'),
+}
+DEFAULT_FORMATS = ['jpg', 'png', 'webp']
+
+STAGES = ('decode_ms', 'op_ms', 'encode_ms', 'total_ms')
+
+# Compared metrics and the smallest absolute change that counts, so noise on fast cases is not flagged
+METRIC_FLOORS = {'decode_ms': 1.0, 'op_ms': 1.0, 'encode_ms': 1.0, 'total_ms': 2.0, 'peak_mb': 2.0}
+
+DEFAULT_THRESHOLD = 0.10
+
+def benchmark_operations(width, height):
+    """
+    Operations benchmarked on an image of the given size, as pipeline operation lists.
+
+    'reencode' has no operation, so it measures decode and encode alone.
+    """
+    return {
+        'reencode': [],
+        'resize': [{'op': 'resize', 'width': max(1, width // 4)}],
+        'rotate90': [{'op': 'rotate', 'angle': 90}],
+        'rotate15': [{'op': 'rotate', 'angle': 15}],
+        'crop': [{'op': 'crop', 'left': width // 4, 'top': height // 4,
+                  'right': width * 3 // 4, 'bottom': height * 3 // 4}],
+        'adjust': [{'op': 'adjust', 'brightness': 1.1, 'contrast': 1.2, 'saturation': 1.3}],
+        'blur': [{'op': 'effects', 'blur': 2}],
+        'sharpen': [{'op': 'effects', 'filter_type': 'SHARPEN'}],
+        'watermark': [{'op': 'watermark', 'text': '© Benchmark'}],
+    }
+
+OPERATION_NAMES = list(benchmark_operations(2, 2))
+
+def synthetic_image(size, mode, seed=0):
+    """
+    Deterministic photo-like test image: smooth gradients, fractal detail and noise.
+
+    The same size, mode and seed always give the same pixels, so results stay
+    comparable between runs and machines.
+    """
+    width, height = size
+    rng = random.Random(f"{seed}:{width}x{height}")
+    resample = Image.Resampling.BILINEAR
+
+    red = Image.linear_gradient('L').resize(size, resample)
+    green = Image.radial_gradient('L').resize(size, resample)
+    # Fractal detail is rendered at up to 1024px and scaled, to keep 50MP generation quick
+    detail_size = (min(width, 1024), min(height, 1024))
+    blue = Image.effect_mandelbrot(detail_size, (-2.0, -1.25, 0.75, 1.25), 100).resize(size, resample)
+    noise_size = (max(1, width // 2), max(1, height // 2))
+    noise = Image.frombytes('L', noise_size, rng.randbytes(noise_size[0] * noise_size[1])).resize(size, resample)
+
+    img = Image.merge('RGB', [Image.blend(band, noise, 0.2) for band in (red, green, blue)])
+    if mode == 'RGBA':
+        img.putalpha(Image.radial_gradient('L').resize(size, resample).point(lambda v: 255 - v // 2))
+    elif mode == 'L':
+        img = img.convert('L')
+    elif mode == 'P':
+        img = img.convert('P', palette=Image.Palette.ADAPTIVE, colors=256)
+    return img
+
+def encode_input(img, ext, quality=95):
+    """Encode a synthetic image in a benchmark format, returning the bytes."""
+    buffer = io.BytesIO()
+    save_image(img, buffer, quality=quality, output_format=pillow_format(ext))
+    return buffer.getvalue()
+
+def pillow_format(ext):
+    """Pillow format name for a benchmark format extension."""
+    return 'JPEG' if ext == 'jpg' else ext.upper()
+
+def peak_rss_mb():
+    """Peak resident memory of this process so far, in MB (None where unsupported)."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def measure_case(data, output_format, operations, repeat=3, quality=95):
+    """
+    Time decode, operations and encode of one input, after one untimed warm-up run.
+
+    Returns:
+        Dict with the median decode_ms, op_ms, encode_ms and total_ms, peak_mb
+        (memory added on top of what the process held before), output_width,
+        output_height and output_bytes
+    """
+    baseline = peak_rss_mb()
+    timings = {stage: [] for stage in STAGES}
+
+    for run in range(repeat + 1):
+        start = time.perf_counter()
+        img = Image.open(io.BytesIO(data))
+        img.load()
+        decoded = time.perf_counter()
+        img = apply_operations(img, operations)
+        img.load()
+        processed = time.perf_counter()
+        buffer = io.BytesIO()
+        save_image(img, buffer, quality=quality, output_format=output_format)
+        encoded = time.perf_counter()
+
+        if run:
+            timings['decode_ms'].append((decoded - start) * 1000)
+            timings['op_ms'].append((processed - decoded) * 1000)
+            timings['encode_ms'].append((encoded - processed) * 1000)
+            timings['total_ms'].append((encoded - start) * 1000)
+
+    result = {stage: round(statistics.median(values), 3) for stage, values in timings.items()}
+    peak = peak_rss_mb()
+    result['peak_mb'] = round(peak - baseline, 1) if peak is not None else None
+    result.update({'output_width': img.width, 'output_height': img.height, 'output_bytes': len(buffer.getvalue())})
+    return result
+
+def _measure_in_child(connection, *args):
+    try:
+        connection.send((True, measure_case(*args)))
+    except Exception as e:
+        connection.send((False, f"{type(e).__name__}: {e}"))
+    finally:
+        connection.close()
+
+def run_case(data, output_format, operations, repeat=3, quality=95):
+    """
+    Measure one case in a forked child process where possible.
+
+    Returns:
+        measure_case() dict
+
+    Raises:
+        RuntimeError: If the case failed or its process died (e.g. out of memory)
+    """
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        result = measure_case(data, output_format, operations, repeat, quality)
+        result['peak_mb'] = None
+        return result
+
+    context = multiprocessing.get_context('fork')
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=_measure_in_child,
+                              args=(sender, data, output_format, operations, repeat, quality))
+    process.start()
+    sender.close()
+    try:
+        ok, result = receiver.recv()
+    except EOFError:
+        process.join()
+        raise RuntimeError(f"benchmark process exited with code {process.exitcode}")
+    process.join()
+    if not ok:
+        raise RuntimeError(result)
+    return result
+
+def run_benchmark(sizes=None, modes=None, formats=None, operations=None, repeat=3, quality=95, seed=0):
+    """
+    Run every combination of size, mode, format and operation.
+
+    Args:
+        sizes: Size names from SIZES (default: DEFAULT_SIZES)
+        modes: Image modes (default: all of MODES)
+        formats: Format extensions from FORMAT_MODES (default: DEFAULT_FORMATS);
+                 modes a format does not store are skipped
+        operations: Operation names from benchmark_operations() (default: all)
+        repeat: Timed runs per case; the median is reported
+        quality: Quality for JPEG/WebP encoding (1-100)
+        seed: Seed for the synthetic images
+
+    Returns:
+        Results dict: environment details plus one entry per case
+    """
+    sizes = sizes or DEFAULT_SIZES
+    modes = modes or MODES
+    formats = formats or DEFAULT_FORMATS
+    operations = operations or OPERATION_NAMES
+    for name, known, options in (('size', sizes, SIZES), ('mode', modes, MODES), ('format', formats, FORMAT_MODES),
+                                 ('operation', operations, OPERATION_NAMES)):
+        unknown = [value for value in known if value not in options]
+        if unknown:
+            raise ValueError(f"Unknown {name}: {', '.join(unknown)}. Available: {', '.join(options)}")
+
+    results = []
+    for size_name in sizes:
+        width, height = SIZES[size_name]
+        case_operations = benchmark_operations(width, height)
+        for mode in modes:
+            img = synthetic_image((width, height), mode, seed=seed)
+            for ext in formats:
+                if mode not in FORMAT_MODES[ext]:
+                    continue
+                data = encode_input(img, ext, quality=quality)
+                for operation in operations:
+                    result = {
+                        'id': f"{size_name}/{mode}/{ext}/{operation}",
+                        'size': size_name,
+                        'width': width,
+                        'height': height,
+                        'mode': mode,
+                        'format': ext,
+                        'operation': operation,
+                        'input_bytes': len(data),
+                    }
+                    try:
+                        result.update(run_case(data, pillow_format(ext), case_operations[operation],
+                                               repeat=repeat, quality=quality))
+                        result.update({'ok': True, 'error': None})
+                        peak = f", peak +{result['peak_mb']}MB" if result['peak_mb'] is not None else ""
+                        print(f"✓ {result['id']}: decode {result['decode_ms']:.1f}ms, op {result['op_ms']:.1f}ms, "
+                              f"encode {result['encode_ms']:.1f}ms{peak}")
+                    except Exception as e:
+                        result.update({'ok': False, 'error': str(e)})
+                        print(f"✗ {result['id']}: {e}", file=sys.stderr)
+                    results.append(result)
+            img.close()
+
+    return {
+        'version': RESULTS_VERSION,
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'environment': environment(),
+        'repeat': repeat,
+        'quality': quality,
+        'seed': seed,
+        'results': results,
+    }
+
+def environment():
+    """Details of the machine and libraries that affect timings."""
+    return {
+        'python': platform.python_version(),
+        'pillow': PILLOW_VERSION,
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+    }
+
+def compare_results(baseline, current, threshold=DEFAULT_THRESHOLD):
+    """
+    Compare two result dicts case by case.
+
+    A metric changes when it moves by more than threshold (a fraction of the
+    baseline value) and by more than its METRIC_FLOORS entry. A case that
+    succeeded in the baseline and fails now is a regression.
+
+    Returns:
+        (regressions, improvements) lists of (case id, metric, before, after)
+    """
+    before_cases = {r['id']: r for r in baseline['results']}
+    regressions, improvements = [], []
+
+    for case in current['results']:
+        before = before_cases.get(case['id'])
+        if before is None or not before['ok']:
+            continue
+        if not case['ok']:
+            regressions.append((case['id'], 'ok', True, False))
+            continue
+        for metric, floor in METRIC_FLOORS.items():
+            old, new = before.get(metric), case.get(metric)
+            if old is None or new is None:
+                continue
+            margin = max(old * threshold, floor)
+            if new - old > margin:
+                regressions.append((case['id'], metric, old, new))
+            elif old - new > margin:
+                improvements.append((case['id'], metric, old, new))
+
+    return regressions, improvements
+
+def format_change(case_id, metric, before, after):
+    """One line describing a metric change."""
+    if metric == 'ok':
+        return f"{case_id}: now fails"
+    change = f" ({(after - before) / before:+.1%})" if before else ""
+    unit = 'MB' if metric == 'peak_mb' else 'ms'
+    return f"{case_id} {metric}: {before:.1f}{unit} → {after:.1f}{unit}{change}"
+
+def report_comparison(baseline, current, threshold=DEFAULT_THRESHOLD):
+    """
+    Print regressions and improvements of current against baseline.
+
+    Returns:
+        True if there are no regressions
+    """
+    if baseline.get('environment') != current.get('environment'):
+        print("ℹ Baseline was recorded in a different environment; timings may not be comparable")
+
+    regressions, improvements = compare_results(baseline, current, threshold=threshold)
+    for change in improvements:
+        print(f"✓ Faster: {format_change(*change)}")
+    for change in regressions:
+        print(f"✗ Regression: {format_change(*change)}", file=sys.stderr)
+
+    compared = len({r['id'] for r in baseline['results']} & {r['id'] for r in current['results']})
+    print(f"✓ Compared {compared} cases at a {threshold:.0%} threshold: "
+          f"{len(regressions)} regressions, {len(improvements)} improvements")
+    return not regressions
+
+def load_results(path):
+    """Load a results file written by benchmark.py."""
+    with open(path, 'r', encoding='utf-8') as f:
+        results = json.load(f)
+    if results.get('version') != RESULTS_VERSION or not isinstance(results.get('results'), list):
+        raise ValueError(f"{path} is not a benchmark results file (version {RESULTS_VERSION})")
+    return results
+
+def benchmark(output_path=None, baseline_path=None, threshold=DEFAULT_THRESHOLD, **options):
+    """
+    Run the benchmark, save the results and optionally compare them with a baseline.
+
+    Args:
+        output_path: Where to write the JSON results
+        baseline_path: Results file to compare against
+        threshold: Relative change that counts as a regression (e.g. 0.1 = 10%)
+        **options: Passed to run_benchmark()
+
+    Returns:
+        True unless the comparison with the baseline found regressions
+    """
+    try:
+        baseline = load_results(baseline_path) if baseline_path else None
+
+        start = time.perf_counter()
+        current = run_benchmark(**options)
+        elapsed = time.perf_counter() - start
+
+        if output_path:
+            with open(output_path, 'w', encoding='utf-8') as f:
+                json.dump(current, f, indent=2)
+
+        failures = [r for r in current['results'] if not r['ok']]
+        print(f"✓ Ran {len(current['results'])} cases in {elapsed:.1f}s")
+        if failures:
+            # Some combinations are unsupported by design (e.g. filters on palette images)
+            print(f"ℹ {len(failures)} cases raised errors (see 'error' in the results)")
+        if output_path:
+            print(f"✓ Results: {output_path}")
+
+        if baseline:
+            return report_comparison(baseline, current, threshold=threshold)
+        return True
+
+    except Exception as e:
+        print(f"✗ Error running benchmark: {e}", file=sys.stderr)
+        return False
+
+def compare_files(baseline_path, current_path, threshold=DEFAULT_THRESHOLD):
+    """Compare two saved results files without running anything."""
+    try:
+        return report_comparison(load_results(baseline_path), load_results(current_path), threshold=threshold)
+    except Exception as e:
+        print(f"✗ Error comparing results: {e}", file=sys.stderr)
+        return False
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the image-editor operations and flag regressions against a baseline",
+        epilog="Example: benchmark.py --output before.json; (change code); benchmark.py --baseline before.json")
+    parser.add_argument("--sizes", nargs="+", metavar="SIZE",
+                       help=f"Image sizes: {', '.join(f'{k} ({w}x{h})' for k, (w, h) in SIZES.items())} "
+                            f"(default: {' '.join(DEFAULT_SIZES)})")
+    parser.add_argument("--modes", nargs="+", metavar="MODE", help=f"Image modes (default: {' '.join(MODES)})")
+    parser.add_argument("--formats", nargs="+", metavar="EXT",
+                       help=f"Formats: {', '.join(FORMAT_MODES)} (default: {' '.join(DEFAULT_FORMATS)})")
+    parser.add_argument("--ops", nargs="+", metavar="NAME",
+                       help=f"Operations: {', '.join(OPERATION_NAMES)} (default: all)")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per case; the median is kept (default: 3)")
+    parser.add_argument("--quality", type=int, default=95, help="Quality for JPEG/WebP (1-100)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the synthetic images (default: 0)")
+    parser.add_argument("--output", default="benchmark.json", help="Results file (default: benchmark.json)")
+    parser.add_argument("--baseline", help="Compare the new results with this results file")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CURRENT"),
+                       help="Compare two results files instead of running the benchmark")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD * 100,
+                       help=f"Percent change that counts as a regression (default: {DEFAULT_THRESHOLD * 100:.0f})")
+
+    args = parser.parse_args()
+    threshold = args.threshold / 100
+
+    if args.compare:
+        success = compare_files(args.compare[0], args.compare[1], threshold=threshold)
+    else:
+        success = benchmark(output_path=args.output, baseline_path=args.baseline, threshold=threshold,
+                            sizes=args.sizes, modes=args.modes, formats=args.formats, operations=args.ops,
+                            repeat=args.repeat, quality=args.quality, seed=args.seed)
+
+    sys.exit(0 if success else 1)
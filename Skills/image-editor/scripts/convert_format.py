@@ -3,47 +3,372 @@
 Image format conversion script.
 """
 from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
 import argparse
+import contextvars
+import io
 import sys
 import os
 
-def convert_format(input_path, output_path, quality=95):
+try:
+    from profiling import add_profile_argument, enable_from_args, profiled, stage
+except ImportError:
+    print("Error: 'profiling.py' not found.", file=sys.stderr)
+    sys.exit(1)
+
+# Concurrent probe encodes when searching for a quality that fits a byte budget
+MAX_PROBE_WORKERS = 4
+
+# Modes these formats store directly; other modes are converted before encoding
+ENCODER_MODES = {
+    'JPEG': ('L', 'RGB', 'CMYK'),
+    'WEBP': ('RGB', 'RGBA'),
+    'AVIF': ('RGB', 'RGBA'),
+}
+
+# Formats encoded with a quality setting
+QUALITY_FORMATS = ('JPEG', 'WEBP', 'AVIF')
+
+def format_from_path(path):
+    """Return the Pillow format name implied by a file extension."""
+    output_format = os.path.splitext(path)[1][1:].upper()
+    if output_format == 'JPG':
+        output_format = 'JPEG'
+    return output_format
+
+def has_alpha(img):
+    """True if the image has an alpha channel or a transparent palette/color entry."""
+    return img.mode in ('RGBA', 'LA', 'PA', 'RGBa', 'La') or 'transparency' in img.info
+
+def target_mode(img, output_format):
+    """
+    Mode to encode an image in for a format.
+
+    Returns:
+        img.mode when the format stores it, 'RGB' or 'RGBA', or 'flatten' for
+        transparent images going to a format without alpha (composited onto white)
+    """
+    modes = ENCODER_MODES.get('JPEG' if output_format == 'JPG' else output_format)
+    if modes is None or img.mode in modes:
+        return img.mode
+    if has_alpha(img):
+        return 'RGBA' if 'RGBA' in modes else 'flatten'
+    return 'RGB'
+
+def prepare_for_format(img, output_format, conversions=None):
+    """
+    Convert an in-memory image to a mode the output format can store.
+
+    Args:
+        img: PIL Image
+        output_format: Pillow format name (e.g. 'JPEG', 'PNG')
+        conversions: Dict shared by calls for the same image and several formats,
+                     so each conversion (e.g. palette to RGBA, alpha flattening)
+                     is computed once
+
+    Returns:
+        The (possibly converted) PIL Image
+    """
+    mode = target_mode(img, output_format)
+    if mode == img.mode:
+        return img
+    if conversions is None:
+        conversions = {}
+    if mode not in conversions:
+        if mode == 'flatten':
+            # Create white background for transparent images
+            if 'RGBA' not in conversions:
+                conversions['RGBA'] = img if img.mode == 'RGBA' else img.convert('RGBA')
+            rgba = conversions['RGBA']
+            rgb_img = Image.new('RGB', img.size, (255, 255, 255))
+            rgb_img.paste(rgba, mask=rgba.getchannel('A'))
+            conversions[mode] = rgb_img
+        else:
+            conversions[mode] = img.convert(mode)
+    return conversions[mode]
+
+def save_options(output_format, quality=95):
+    """Return the keyword arguments to pass to Image.save for a format."""
+    save_kwargs = {}
+    if output_format in QUALITY_FORMATS or output_format == 'JPG':
+        save_kwargs['quality'] = quality
+    return save_kwargs
+
+def save_image(img, output_path, quality=95, output_format=None):
+    """
+    Encode an in-memory image, picking the format from the extension.
+
+    Args:
+        img: PIL Image
+        output_path: Path to save the image, or a binary file object
+                     when output_format is given
+        quality: Quality for JPEG/WebP (1-100, higher = better quality)
+        output_format: Pillow format name (default: from output_path's extension)
+
+    Returns:
+        The output format name
+    """
+    output_format = output_format or format_from_path(output_path)
+    img = prepare_for_format(img, output_format)
+    img.save(output_path, format=output_format, **save_options(output_format, quality))
+    return output_format
+
+def probe_qualities(low, high, count):
+    """Up to count distinct qualities spread evenly inside [low, high], splitting it into count + 1 parts."""
+    count = min(count, high - low + 1)
+    return sorted({low + (high - low) * (i + 1) // (count + 1) for i in range(count)})
+
+def encode_to_budget(img, output_format, max_bytes, max_quality=95, min_quality=1, workers=None):
+    """
+    Encode an image at the highest quality whose output fits a byte budget.
+
+    Tries max_quality first, then searches the range below it. Each round
+    encodes several qualities in parallel threads (Pillow releases the GIL
+    while encoding) into memory and narrows the range around the largest
+    quality that fit; with one worker this is a binary search.
+
+    Args:
+        img: PIL Image
+        output_format: Pillow format name with a quality setting ('JPEG' or 'WEBP')
+        max_bytes: Largest acceptable output size in bytes
+        max_quality: Highest quality to consider (1-100)
+        min_quality: Lowest quality to accept (1-100)
+        workers: Concurrent probe encodes (default: available CPUs, up to MAX_PROBE_WORKERS)
+
+    Returns:
+        (encoded_bytes, quality, attempts) tuple
+
+    Raises:
+        ValueError: If the format has no quality setting or even min_quality does not fit
+    """
+    if 'quality' not in save_options(output_format):
+        raise ValueError(f"{output_format} has no quality setting, so its size cannot be targeted")
+    if not 1 <= min_quality <= max_quality <= 100:
+        raise ValueError("Qualities must satisfy 1 <= min_quality <= max_quality <= 100")
+    workers = workers or min(os.cpu_count() or 1, MAX_PROBE_WORKERS)
+
+    img = prepare_for_format(img, output_format)
+    img.load()
+    encodes = {}
+
+    def encode(quality):
+        # Image.save keeps per-call settings on the image object, so each probe saves its own copy
+        buffer = io.BytesIO()
+        img.copy().save(buffer, format=output_format, **save_options(output_format, quality))
+        return buffer.getvalue()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        def probe(qualities):
+            for quality, data in zip(qualities, executor.map(encode, qualities)):
+                encodes[quality] = data
+            return [q for q in qualities if len(encodes[q]) <= max_bytes]
+
+        if probe([max_quality]):
+            return encodes[max_quality], max_quality, len(encodes)
+
+        best = None
+        low, high = min_quality, max_quality - 1
+        while low <= high:
+            qualities = probe_qualities(low, high, workers)
+            fitting = probe(qualities)
+            if fitting:
+                best = max(fitting)
+                low = best + 1
+            too_large = [q for q in qualities if q not in fitting and q >= low]
+            if too_large:
+                high = min(too_large) - 1
+
+    if best is None:
+        smallest = len(encodes[min(encodes)])
+        raise ValueError(f"Output does not fit in {max_bytes} bytes even at quality {min(encodes)} "
+                         f"({smallest} bytes); resize the image first")
+    return encodes[best], best, len(encodes)
+
+def encode_outputs(img, outputs, workers=None):
+    """
+    Encode one decoded image to several files concurrently.
+
+    Mode conversions are computed once on the calling thread and shared
+    between outputs that need the same one (e.g. JPEG and WebP both wanting
+    RGB from a palette image); the encoders then run in parallel threads,
+    since Pillow releases the GIL while encoding.
+
+    Args:
+        img: PIL Image
+        outputs: List of (output_path, quality) pairs; the format of each comes
+                 from its extension
+        workers: Encoder threads (default: one per output)
+
+    Returns:
+        List of (output_path, output_format, bytes written) tuples, in input order
+    """
+    img.load()
+    conversions = {}
+    jobs = []
+    used = set()
+    with stage('convert'):
+        for output_path, quality in outputs:
+            output_format = format_from_path(output_path)
+            prepared = prepare_for_format(img, output_format, conversions)
+            if id(prepared) in used:
+                # Image.save keeps per-call settings on the image object, so concurrent saves need their own
+                prepared = prepared.copy()
+            used.add(id(prepared))
+            jobs.append((output_path, output_format, prepared, quality))
+
+    def encode(output_path, output_format, prepared, quality):
+        with stage('save', output=output_path):
+            prepared.save(output_path, format=output_format, **save_options(output_format, quality))
+        return output_path, output_format, os.path.getsize(output_path)
+
+    with ThreadPoolExecutor(max_workers=workers or len(jobs) or 1) as executor:
+        # Run each encode in a copy of this context so profiling stages nest under the caller's
+        futures = [executor.submit(contextvars.copy_context().run, encode, *job) for job in jobs]
+        return [future.result() for future in futures]
+
+@profiled
+def convert_format(input_path, output_path, quality=95, max_bytes=None, min_quality=1, workers=None,
+                   cache_dir=None, colors=None, quantize_method='auto', dither=False, palette=None):
     """
     Convert image to a different format.
 
     Args:
         input_path: Path to input image
         output_path: Path to save converted image
-        quality: Quality for JPEG/WebP (1-100, higher = better quality)
+        quality: Quality for JPEG/WebP (1-100, higher = better quality); with
+                 max_bytes, the highest quality tried
+        max_bytes: Byte budget for the output (JPEG/WebP); the highest quality
+                   whose output fits is chosen and only that encode is written
+        min_quality: Lowest quality to accept when fitting max_bytes
+        workers: Concurrent probe encodes when fitting max_bytes
+        cache_dir: Result cache directory (see result_cache.py); a repeat run on the same
+                   input bytes with the same parameters reuses the stored output
+        colors: Quantize GIF/PNG output to a palette of this many colors (2-256; see quantize.py)
+        quantize_method: 'auto', 'mediancut', 'octree' or 'libimagequant'
+        dither: Floyd-Steinberg dithering when quantizing
+        palette: Palette file to map GIF/PNG output onto (see quantize.py), e.g.
+                 one shared by a set of icons
     """
     try:
-        img = Image.open(input_path)
+        quantizing = bool(colors or palette)
+        if quantizing:
+            from quantize import PALETTE_FORMATS, load_palette, quantize, resolve_method
+            if format_from_path(output_path) not in PALETTE_FORMATS:
+                raise ValueError(f"Palette quantization applies to {' and '.join(PALETTE_FORMATS)} output")
+            if palette:
+                palette = load_palette(palette)
+
+        if cache_dir:
+            from result_cache import ResultCache
+            cache = ResultCache(cache_dir)
+            params = {
+                'quality': quality, 'max_bytes': max_bytes, 'min_quality': min_quality if max_bytes else None,
+            }
+            if quantizing:
+                params['quantize'] = {'colors': colors or 256, 'method': quantize_method, 'dither': dither,
+                                      'palette': palette}
+            cache_key = cache.key(input_path, output_path, 'convert', params)
+            if cache.fetch(cache_key, output_path):
+                print("✓ Cache hit: reused a stored result")
+                print(f"✓ Saved to: {output_path}")
+                return True
+
+        with stage('open'):
+            img = Image.open(input_path)
+        with stage('decode'):
+            img.load()
 
         # Get input and output formats
         input_format = img.format or os.path.splitext(input_path)[1][1:].upper()
-        output_format = os.path.splitext(output_path)[1][1:].upper()
+        if quantizing:
+            with stage('quantize'):
+                img = quantize(img, colors=colors or 256, method=quantize_method, dither=dither, palette=palette)
+        if max_bytes:
+            output_format = format_from_path(output_path)
+            with stage('encode_to_budget'):
+                data, quality, attempts = encode_to_budget(img, output_format, max_bytes, max_quality=quality,
+                                                           min_quality=min_quality, workers=workers)
+            with stage('save'):
+                with open(output_path, 'wb') as f:
+                    f.write(data)
+        else:
+            with stage('save'):
+                output_format = save_image(img, output_path, quality=quality)
+
+        print(f"✓ Converted from {input_format} to {output_format}")
+        if quantizing:
+            source = "shared palette" if palette else resolve_method(quantize_method)
+            print(f"✓ Quantized to {len(img.getpalette()) // 3} colors ({source}{', dithered' if dither else ''})")
+        if max_bytes:
+            print(f"✓ Quality: {quality} (highest that fits {max_bytes} bytes, {attempts} encode attempts)")
+            print(f"✓ Size: {len(data)} bytes")
+        elif save_options(output_format, quality):
+            print(f"✓ Quality: {quality}")
+        if cache_dir:
+            cache.store(cache_key, output_path)
+        print(f"✓ Saved to: {output_path}")
+        return True
 
-        # Handle RGBA to RGB conversion for JPEG
-        if output_format == 'JPG':
-            output_format = 'JPEG'
+    except Exception as e:
+        print(f"✗ Error converting image: {e}", file=sys.stderr)
+        return False
 
-        if img.mode == 'RGBA' and output_format in ['JPEG', 'JPG']:
-            # Create white background for transparent images
-            rgb_img = Image.new('RGB', img.size, (255, 255, 255))
-            rgb_img.paste(img, mask=img.split()[3] if len(img.split()) == 4 else None)
-            img = rgb_img
+@profiled
+def convert_to_formats(input_path, output_paths, qualities=None, workers=None, cache_dir=None):
+    """
+    Convert one image to several formats with a single decode.
 
-        # Save with appropriate options
-        save_kwargs = {}
-        if output_format in ['JPEG', 'JPG', 'WEBP']:
-            save_kwargs['quality'] = quality
+    Args:
+        input_path: Path to input image
+        output_paths: Output paths; each format is determined by its extension
+        qualities: Quality for each output (JPEG/WebP/AVIF), or a single quality
+                   for all (default: 95)
+        workers: Encoder threads (default: one per output)
+        cache_dir: Result cache directory (see result_cache.py); shares entries
+                   with single-output convert_format.py runs
+    """
+    try:
+        qualities = list(qualities or [95])
+        if len(qualities) == 1:
+            qualities *= len(output_paths)
+        if len(qualities) != len(output_paths):
+            raise ValueError(f"Got {len(qualities)} qualities for {len(output_paths)} outputs")
+        outputs = list(zip(output_paths, qualities))
 
-        img.save(output_path, format=output_format, **save_kwargs)
+        cached = []
+        if cache_dir:
+            from result_cache import ResultCache
+            cache = ResultCache(cache_dir)
+            cache_keys = {}
+            for output_path, quality in outputs:
+                # Same key as a single-output conversion of this file
+                cache_keys[output_path] = cache.key(input_path, output_path, 'convert', {
+                    'quality': quality, 'max_bytes': None, 'min_quality': None,
+                })
+                if cache.fetch(cache_keys[output_path], output_path):
+                    cached.append(output_path)
+            outputs = [(path, quality) for path, quality in outputs if path not in cached]
 
-        print(f"✓ Converted from {input_format} to {output_format}")
-        if 'quality' in save_kwargs:
-            print(f"✓ Quality: {quality}")
-        print(f"✓ Saved to: {output_path}")
+        if outputs:
+            with stage('open'):
+                img = Image.open(input_path)
+            with stage('decode'):
+                img.load()
+            input_format = img.format or os.path.splitext(input_path)[1][1:].upper()
+            results = encode_outputs(img, outputs, workers=workers)
+            print(f"✓ Decoded {input_format} once ({img.width}x{img.height})")
+        else:
+            results = []
+
+        qualities_by_path = dict(outputs)
+        for output_path, output_format, size in results:
+            quality = qualities_by_path[output_path]
+            quality_note = f", quality {quality}" if save_options(output_format, quality) else ""
+            print(f"✓ {output_format}{quality_note}: {output_path} ({size} bytes)")
+            if cache_dir:
+                cache.store(cache_keys[output_path], output_path)
+        for output_path in cached:
+            print(f"✓ Cache hit: {output_path}")
         return True
 
     except Exception as e:
@@ -51,13 +376,51 @@ def convert_format(input_path, output_path, quality=95):
         return False
 
 if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description="Convert image format")
+    parser = argparse.ArgumentParser(
+        description="Convert image format",
+        epilog="Example: convert_format.py logo.png logo.jpg logo.webp logo.avif --qualities 90 80 60")
     parser.add_argument("input", help="Input image path")
-    parser.add_argument("output", help="Output image path (format determined by extension)")
-    parser.add_argument("--quality", type=int, default=95, help="Quality for JPEG/WebP (1-100)")
+    parser.add_argument("outputs", nargs="+", metavar="output",
+                       help="Output image path (format determined by extension); give several to decode "
+                            "once and encode them all concurrently")
+    parser.add_argument("--quality", type=int, default=95,
+                       help="Quality for JPEG/WebP/AVIF (1-100, default: 95), for every output; "
+                            "with --max-bytes, the highest quality tried")
+    parser.add_argument("--qualities", type=int, nargs="+", metavar="Q",
+                       help="One quality per output, in the order of the outputs")
+    parser.add_argument("--max-bytes", type=int,
+                       help="Byte budget (JPEG/WebP): write the highest quality whose output fits")
+    parser.add_argument("--min-quality", type=int, default=1, help="Lowest quality --max-bytes may pick (default: 1)")
+    parser.add_argument("--workers", type=int,
+                       help=f"Parallel probe encodes for --max-bytes (default: CPUs, up to {MAX_PROBE_WORKERS}), "
+                            "or encoder threads with several outputs (default: one per output)")
+    parser.add_argument("--cache-dir", help="Reuse results from this cache directory (see result_cache.py)")
+    parser.add_argument("--colors", type=int,
+                       help="Quantize GIF/PNG output to this many palette colors (2-256), e.g. for 8-bit PNG")
+    parser.add_argument("--palette",
+                       help="Map GIF/PNG output onto a shared palette file built by quantize.py")
+    parser.add_argument("--quantize-method", default="auto",
+                       choices=['auto', 'mediancut', 'octree', 'libimagequant'],
+                       help="Quantization algorithm (default: libimagequant if available, else mediancut)")
+    parser.add_argument("--dither", action="store_true", help="Floyd-Steinberg dithering when quantizing")
 
+    add_profile_argument(parser)
     args = parser.parse_args()
+    enable_from_args(args)
 
-    success = convert_format(args.input, args.output, quality=args.quality)
+    if len(args.outputs) > 1:
+        if args.max_bytes:
+            parser.error("--max-bytes takes a single output")
+        if args.colors or args.palette:
+            parser.error("--colors and --palette take a single output")
+        success = convert_to_formats(args.input, args.outputs, qualities=args.qualities or [args.quality],
+                                     workers=args.workers, cache_dir=args.cache_dir)
+    else:
+        if args.qualities:
+            parser.error("--qualities takes several outputs; use --quality for a single output")
+        success = convert_format(args.input, args.outputs[0], quality=args.quality, max_bytes=args.max_bytes,
+                                 min_quality=args.min_quality, workers=args.workers, cache_dir=args.cache_dir,
+                                 colors=args.colors, quantize_method=args.quantize_method, dither=args.dither,
+                                 palette=args.palette)
 
     sys.exit(0 if success else 1)
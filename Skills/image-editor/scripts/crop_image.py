@@ -6,7 +6,27 @@ from PIL import Image
 import argparse
 import sys
 
-def crop_image(input_path, output_path, left, top, right, bottom):
+try:
+    from profiling import add_profile_argument, enable_from_args, profiled, stage
+except ImportError:
+    print("Error: 'profiling.py' not found.", file=sys.stderr)
+    sys.exit(1)
+
+def crop(img, left, top, right, bottom):
+    """
+    Crop an in-memory image. See crop_image() for the arguments.
+
+    Returns:
+        The cropped PIL Image
+    """
+    if left >= right or top >= bottom:
+        raise ValueError("Invalid crop coordinates: left must be < right and top must be < bottom")
+
+    return img.crop((left, top, right, bottom))
+
+@profiled
+def crop_image(input_path, output_path, left, top, right, bottom, tiled=False, memory_budget_mb=None,
+               lossless=True, cache_dir=None):
     """
     Crop an image to specified coordinates.
 
@@ -17,25 +37,72 @@ def crop_image(input_path, output_path, left, top, right, bottom):
         top: Top coordinate (y1)
         right: Right coordinate (x2)
         bottom: Bottom coordinate (y2)
+        tiled: Process the image in strips and stream a TIFF to disk, keeping
+               memory within memory_budget_mb regardless of the image size
+        memory_budget_mb: Peak memory budget for tiled mode in MB (default: 256)
+        lossless: For JPEG to JPEG crops whose left/top edges lie on the MCU
+                  grid, cut the DCT data with jpegtran instead of re-encoding
+                  (falls back to the pixel path otherwise)
+        cache_dir: Result cache directory (see result_cache.py); a repeat run on the same
+                   input bytes with the same parameters reuses the stored output
     """
     try:
-        img = Image.open(input_path)
+        if cache_dir:
+            from result_cache import ResultCache
+            cache = ResultCache(cache_dir)
+            cache_key = cache.key(input_path, output_path, 'crop', {
+                'box': [left, top, right, bottom], 'tiled': tiled, 'lossless': lossless,
+            })
+            if cache.fetch(cache_key, output_path):
+                print("✓ Cache hit: reused a stored result")
+                print(f"✓ Saved to: {output_path}")
+                return True
+
+        with stage('open'):
+            if tiled:
+                from tiling import open_unbounded, tiled_crop
+                img = open_unbounded(input_path)
+            else:
+                img = Image.open(input_path)
         width, height = img.size
 
         # Validate coordinates
         if left < 0 or top < 0 or right > width or bottom > height:
             print(f"Warning: Coordinates may be out of bounds. Image size: {width}x{height}")
 
-        if left >= right or top >= bottom:
-            raise ValueError("Invalid crop coordinates: left must be < right and top must be < bottom")
+        lossless_done = False
+        if tiled:
+            with stage('tiled'):
+                tiled_crop(input_path, output_path, (left, top, right, bottom), memory_budget_mb=memory_budget_mb)
+        else:
+            if lossless:
+                from lossless_jpeg import lossless_crop
+                with stage('lossless'):
+                    lossless_done = lossless_crop(input_path, output_path, (left, top, right, bottom))
 
-        cropped_img = img.crop((left, top, right, bottom))
-        cropped_img.save(output_path)
+            if not lossless_done:
+                from animation import animated_output, process_animation
+                if animated_output(img, output_path):
+                    with stage('animation'):
+                        frame_count, _ = process_animation(img, output_path,
+                                                           lambda frame: crop(frame, left, top, right, bottom))
+                    print(f"✓ Processed {frame_count} animation frames")
+                else:
+                    with stage('decode'):
+                        img.load()
+                    with stage('crop'):
+                        cropped_img = crop(img, left, top, right, bottom)
+                    with stage('save'):
+                        cropped_img.save(output_path)
 
         crop_width = right - left
         crop_height = bottom - top
         print(f"✓ Image cropped from {width}x{height} to {crop_width}x{crop_height}")
         print(f"✓ Coordinates: ({left}, {top}) to ({right}, {bottom})")
+        if lossless_done:
+            print("✓ Lossless JPEG crop (no re-encode)")
+        if cache_dir:
+            cache.store(cache_key, output_path)
         print(f"✓ Saved to: {output_path}")
         return True
 
@@ -51,9 +118,19 @@ if __name__ == "__main__":
     parser.add_argument("top", type=int, help="Top coordinate (y1)")
     parser.add_argument("right", type=int, help="Right coordinate (x2)")
     parser.add_argument("bottom", type=int, help="Bottom coordinate (y2)")
+    parser.add_argument("--tiled", action="store_true",
+                       help="Process in strips with bounded memory (for very large images; writes TIFF)")
+    parser.add_argument("--memory-budget", type=float, help="Peak memory budget for --tiled in MB (default: 256)")
+    parser.add_argument("--no-lossless", action="store_true",
+                       help="Always re-encode, even when a lossless JPEG crop is possible")
+    parser.add_argument("--cache-dir", help="Reuse results from this cache directory (see result_cache.py)")
 
+    add_profile_argument(parser)
     args = parser.parse_args()
+    enable_from_args(args)
 
-    success = crop_image(args.input, args.output, args.left, args.top, args.right, args.bottom)
+    success = crop_image(args.input, args.output, args.left, args.top, args.right, args.bottom,
+                         tiled=args.tiled, memory_budget_mb=args.memory_budget, lossless=not args.no_lossless,
+                         cache_dir=args.cache_dir)
 
     sys.exit(0 if success else 1)
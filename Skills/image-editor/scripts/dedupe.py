@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+Perceptual-hash deduplication of images.
+
+Re-saved JPEGs, copies with stripped metadata and other byte-different files
+that look the same get the same, or nearly the same, difference hash:
+the image is decoded at a reduced resolution (JPEG DCT scaling keeps this to
+a fraction of a full decode), shrunk to 9x8 grey pixels, and each bit records
+whether a pixel is brighter than its right-hand neighbour. Hashes within a
+Hamming distance threshold of each other are near-duplicates, provided
+their colors also match: the hash only sees brightness, so a red and a green
+object of the same shape hash alike. Each file also keeps the mean color of
+every cell of an 8x8 grid, and a representative is only reused when no cell
+differs by more than COLOR_TOLERANCE in any channel.
+
+Hashes are kept in a BK-tree per image size, so finding the files near a hash
+does not compare it against every other file. The first file of each group
+(in path order) is its canonical representative; batch_process.py --dedupe
+processes only the representatives and copies their outputs to the others.
+
+    python dedupe.py uploads/ --recursive --threshold 4
+"""
+from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import json
+import sys
+
+# Bits per hash row; the hash has HASH_SIZE x HASH_SIZE bits
+HASH_SIZE = 8
+
+# Largest Hamming distance (of 64 bits) between duplicates by default
+DEFAULT_THRESHOLD = 3
+
+# Largest difference (0-255) in a channel of any grid cell's mean color between duplicates
+COLOR_TOLERANCE = 32
+
+# Threads used to hash files
+DEFAULT_WORKERS = 16
+
+def dhash(path, hash_size=HASH_SIZE):
+    """
+    Difference hash and color grid of an image file, from a reduced-resolution decode.
+
+    Returns:
+        (hash as an int of hash_size**2 bits, (width, height) of the full image,
+        RGB bytes of the mean colors of a hash_size x hash_size grid) tuple
+    """
+    with Image.open(path) as img:
+        size = img.size
+        # No-op for formats without draft support
+        img.draft('RGB', (hash_size + 1, hash_size))
+        rgb = img.convert('RGBA').convert('RGB') if 'transparency' in img.info else img.convert('RGB')
+    grey = rgb.convert('L').resize((hash_size + 1, hash_size), Image.Resampling.BOX)
+    colors = rgb.resize((hash_size, hash_size), Image.Resampling.BOX).tobytes()
+
+    pixels = grey.tobytes()
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value, size, colors
+
+def hamming(a, b):
+    """Number of bits in which two hashes differ."""
+    return bin(a ^ b).count('1')
+
+def colors_match(a, b, tolerance=COLOR_TOLERANCE):
+    """True if no channel of any cell of two color grids differs by more than tolerance."""
+    return all(abs(x - y) <= tolerance for x, y in zip(a, b))
+
+class BKTree:
+    """
+    Burkhard-Keller tree of hashes under the Hamming distance.
+
+    Each node's children are keyed by their distance to it, so by the
+    triangle inequality a search within a threshold only descends into
+    children whose key is within the threshold of the query's distance.
+    """
+
+    def __init__(self):
+        self.root = None
+
+    def add(self, value, item):
+        """Insert a hash with an associated item."""
+        if self.root is None:
+            self.root = (value, item, {})
+            return
+        node = self.root
+        while True:
+            distance = hamming(value, node[0])
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = (value, item, {})
+                return
+            node = child
+
+    def search(self, value, threshold):
+        """
+        Find the hashes within threshold of a value.
+
+        Returns:
+            List of (distance, item) tuples, nearest first
+        """
+        found = []
+        nodes = [self.root] if self.root else []
+        while nodes:
+            node = nodes.pop()
+            distance = hamming(value, node[0])
+            if distance <= threshold:
+                found.append((distance, node[1]))
+            for key, child in node[2].items():
+                if distance - threshold <= key <= distance + threshold:
+                    nodes.append(child)
+        return sorted(found, key=lambda match: match[0])
+
+def hash_files(paths, workers=DEFAULT_WORKERS):
+    """
+    Hash many files in parallel threads (decoding releases the GIL).
+
+    Returns:
+        Dict of path to (hash, size, colors); unreadable files are left out
+    """
+    def safe_hash(path):
+        try:
+            return path, dhash(path)
+        except Exception:
+            return path, None
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return {path: result for path, result in executor.map(safe_hash, paths) if result}
+
+def find_duplicates(paths, threshold=DEFAULT_THRESHOLD, group_key=None, workers=DEFAULT_WORKERS):
+    """
+    Map each near-duplicate file to its canonical representative.
+
+    Only images of the same size are compared, so operations with pixel
+    coordinates (crop, watermark position) give the same result on both, and
+    only images whose color grids match (see colors_match), so images that
+    differ only in color stay distinct.
+
+    Args:
+        paths: Image paths; earlier paths become representatives
+        threshold: Largest Hamming distance between duplicates (0 = identical hashes)
+        group_key: Optional function of a path; only paths with equal keys are
+                   compared (e.g. the output extension)
+        workers: Threads used to hash files
+
+    Returns:
+        Dict of duplicate path to representative path
+    """
+    hashes = hash_files(paths, workers=workers)
+    trees = {}
+    duplicates = {}
+    for path in paths:
+        if path not in hashes:
+            continue
+        value, size, colors = hashes[path]
+        tree = trees.setdefault((size, group_key(path) if group_key else None), BKTree())
+        matches = [match for _, match in tree.search(value, threshold) if colors_match(colors, hashes[match][2])]
+        if matches:
+            duplicates[path] = matches[0]
+        else:
+            tree.add(value, path)
+    return duplicates
+
+def list_duplicates(source, threshold=DEFAULT_THRESHOLD, recursive=False, as_json=False):
+    """
+    Print groups of near-duplicate images matched by a directory or glob.
+
+    Args:
+        source: Input directory, glob pattern or @LIST file
+        threshold: Largest Hamming distance between duplicates
+        recursive: Descend into subdirectories when source is a directory
+        as_json: Print one JSON object of representative to duplicates instead of text
+    """
+    try:
+        from batch_process import collect_inputs
+
+        _, paths = collect_inputs(source, recursive=recursive)
+        if not paths:
+            raise ValueError(f"No images found for: {source}")
+
+        groups = {}
+        for duplicate, representative in find_duplicates(paths, threshold=threshold).items():
+            groups.setdefault(representative, []).append(duplicate)
+
+        if as_json:
+            print(json.dumps(groups, indent=2))
+        else:
+            for representative, duplicates in groups.items():
+                print(representative)
+                for duplicate in duplicates:
+                    print(f"  = {duplicate}")
+            duplicate_count = sum(len(d) for d in groups.values())
+            print(f"✓ {duplicate_count} of {len(paths)} images are near-duplicates of {len(groups)} representatives")
+        return True
+
+    except Exception as e:
+        print(f"✗ Error finding duplicates: {e}", file=sys.stderr)
+        return False
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find visually identical images by perceptual hash")
+    parser.add_argument("input", help="Input directory, glob pattern or @LIST file")
+    parser.add_argument("--threshold", type=int, default=DEFAULT_THRESHOLD,
+                        help=f"Largest Hamming distance (of {HASH_SIZE * HASH_SIZE} bits) between duplicates "
+                             f"(default: {DEFAULT_THRESHOLD})")
+    parser.add_argument("--recursive", action="store_true", help="Include subdirectories of an input directory")
+    parser.add_argument("--json", action="store_true", help="Print JSON instead of text")
+
+    args = parser.parse_args()
+
+    success = list_duplicates(args.input, threshold=args.threshold, recursive=args.recursive, as_json=args.json)
+
+    sys.exit(0 if success else 1)
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+In-memory image I/O: decode from and encode to bytes-like buffers.
+
+Together with the pure operations of the other scripts (resize, rotate,
+crop, adjust, add_effects, watermark, each taking and returning a PIL Image)
+this lets a service chain edits without temporary files:
+
+    from image_io import decode, encode
+    from resize_image import resize
+    from add_watermark import watermark
+
+    img = decode(request_body, 'jpeg')
+    img = watermark(resize(img, width=800), '© Example')
+    response_body = encode(img, 'webp', quality=80)
+
+Input buffers (bytes, bytearray, memoryview, mmap, ...) are read in place
+rather than copied, and images are passed between operations as PIL objects,
+so a chain touches the disk nowhere.
+"""
+from PIL import Image
+import argparse
+import io
+import sys
+
+try:
+    from convert_format import save_image
+    from profiling import add_profile_argument, enable_from_args, profiled, stage
+except ImportError as e:
+    print(f"Error: sibling script not found ({e}). Run image_io.py from the scripts/ directory.", file=sys.stderr)
+    sys.exit(1)
+
+class BufferReader(io.RawIOBase):
+    """Seekable read-only file over any bytes-like object, without copying it."""
+
+    def __init__(self, data):
+        self._view = memoryview(data).cast('B')
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        end = min(self._position + len(buffer), len(self._view))
+        count = max(end - self._position, 0)
+        buffer[:count] = self._view[self._position:end]
+        self._position += count
+        return count
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._position + offset
+        elif whence == io.SEEK_END:
+            position = len(self._view) + offset
+        else:
+            raise ValueError(f"Invalid whence: {whence}")
+        if position < 0:
+            raise ValueError(f"Negative seek position: {position}")
+        self._position = position
+        return position
+
+    def tell(self):
+        return self._position
+
+    def close(self):
+        self._view.release()
+        super().close()
+
+def pillow_format(name):
+    """Normalize a format name or extension ('jpg', '.webp', 'PNG') to Pillow's name ('JPEG', 'WEBP', 'PNG')."""
+    name = name.lstrip('.').upper()
+    return {'JPG': 'JPEG', 'TIF': 'TIFF'}.get(name, name)
+
+def decode(data, input_format=None):
+    """
+    Open an encoded image held in memory.
+
+    The image is opened lazily like Image.open, so operations such as
+    resize() can still use reduced-size JPEG decoding. The buffer must not
+    be modified until the image has been loaded.
+
+    Args:
+        data: Encoded image as bytes, bytearray, memoryview or another buffer
+        input_format: Expected format (e.g. 'jpeg', 'png'); only that decoder
+                      is tried. Default: detect the format from the data
+
+    Returns:
+        PIL Image
+    """
+    if isinstance(data, bytes):
+        # BytesIO shares an immutable bytes object instead of copying it
+        stream = io.BytesIO(data)
+    else:
+        stream = io.BufferedReader(BufferReader(data))
+    formats = [pillow_format(input_format)] if input_format else None
+    return Image.open(stream, formats=formats)
+
+def encode(img, output_format, quality=95):
+    """
+    Encode an image into bytes.
+
+    Args:
+        img: PIL Image
+        output_format: Format name or extension (e.g. 'jpeg', 'webp', '.png')
+        quality: Quality for JPEG/WebP (1-100)
+
+    Returns:
+        Encoded bytes
+    """
+    buffer = io.BytesIO()
+    save_image(img, buffer, quality=quality, output_format=pillow_format(output_format))
+    return buffer.getvalue()
+
+@profiled
+def transcode(data, output_format, operations=(), quality=95, input_format=None):
+    """
+    Decode a buffer, apply pipeline operations and encode the result.
+
+    Animated GIF/WebP/APNG inputs encoded to one of those formats keep all
+    their frames, as in pipeline.process_image().
+
+    Args:
+        data: Encoded input image (any bytes-like buffer)
+        output_format: Format name or extension for the result
+        operations: Operation dicts ({'op': name, **params}, see pipeline.py)
+        quality: Quality for JPEG/WebP (1-100)
+        input_format: Expected input format (default: detect)
+
+    Returns:
+        (encoded_bytes, original_size, final_size) tuple
+    """
+    from pipeline import apply_operations
+    from animation import animated_output, process_animation
+
+    with stage('open'):
+        img = decode(data, input_format)
+    original_size = img.size
+
+    output_format = pillow_format(output_format)
+    if animated_output(img, None, output_format=output_format):
+        buffer = io.BytesIO()
+        with stage('animation'):
+            _, final_size = process_animation(img, buffer, lambda frame: apply_operations(frame, list(operations)),
+                                              quality=quality, output_format=output_format)
+        return buffer.getvalue(), original_size, final_size
+    img = apply_operations(img, list(operations))
+    with stage('encode'):
+        encoded = encode(img, output_format, quality=quality)
+    return encoded, original_size, img.size
+
+def transcode_stream(input_stream, output_stream, output_format, operations=(), quality=95, input_format=None):
+    """
+    Read an encoded image from one binary stream and write the result to another.
+
+    Returns:
+        (original_size, final_size) tuple
+    """
+    data, original_size, final_size = transcode(input_stream.read(), output_format, operations,
+                                                quality=quality, input_format=input_format)
+    output_stream.write(data)
+    output_stream.flush()
+    return original_size, final_size
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Transform an image from stdin to stdout, with no files involved",
+        epilog="Example: image_io.py --from jpeg --to webp --op resize width=400 < in.jpg > out.webp")
+    parser.add_argument("--from", dest="input_format", help="Input format (default: detect)")
+    parser.add_argument("--to", dest="output_format", required=True, help="Output format (e.g. jpeg, png, webp)")
+
+    try:
+        from pipeline import add_operation_arguments, operations_from_args
+    except ImportError:
+        print("Error: 'pipeline.py' not found.", file=sys.stderr)
+        sys.exit(1)
+    add_operation_arguments(parser)
+
+    add_profile_argument(parser)
+    args = parser.parse_args()
+    enable_from_args(args)
+
+    try:
+        operations, quality = operations_from_args(args)
+        original_size, final_size = transcode_stream(sys.stdin.buffer, sys.stdout.buffer, args.output_format,
+                                                     operations, quality=quality, input_format=args.input_format)
+        print(f"✓ Image processed from {original_size[0]}x{original_size[1]} to {final_size[0]}x{final_size[1]}",
+              file=sys.stderr)
+        success = True
+    except Exception as e:
+        print(f"✗ Error processing image: {e}", file=sys.stderr)
+        success = False
+
+    sys.exit(0 if success else 1)
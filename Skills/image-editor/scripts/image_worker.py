@@ -0,0 +1,388 @@
+#!/usr/bin/env python3
+"""
+Resident image worker: a pool of warm processes serving JSON-lines requests.
+
+Each request is one JSON object per line, read from stdin (default) or from a
+local socket, and each response is one JSON object per line written back as
+soon as the request completes (so responses may arrive out of order; match
+them up by "id").
+
+Requests:
+    {"id": 1, "op": "resize", "input": "a.jpg", "output": "a_small.jpg", "width": 400}
+    {"id": 2, "op": "convert", "input": "a.png", "output": "a.webp", "quality": 80}
+    {"id": 3, "op": "pipeline", "input": "a.jpg", "output": "b.jpg",
+     "operations": [{"op": "crop", "left": 0, "top": 0, "right": 800, "bottom": 600},
+                    {"op": "resize", "width": 400}]}
+    {"id": 4, "op": "stats"}
+
+"op" is any pipeline operation (resize, rotate, crop, adjust, effects,
+watermark) with its parameters alongside, "convert" (re-encode only) or
+"pipeline" with an "operations" list. "quality" applies to JPEG/WebP output.
+
+Responses:
+    {"id": 1, "ok": true, "output": "a_small.jpg", "width": 400, "height": 266,
+     "cached": false, "worker_ms": 12.1, "latency_ms": 13.0}
+    {"id": 5, "ok": false, "error": "ValueError: Unknown operation: blur"}
+"""
+from PIL import Image
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+import argparse
+import json
+import os
+import signal
+import socketserver
+import sys
+import threading
+import time
+
+try:
+    from pipeline import OPERATIONS, validate_operations, process_image
+    from batch_process import default_workers
+    from profiling import add_profile_argument, enable_from_args, enable_from_env
+    from quantize import inline_palettes
+except ImportError:
+    print("Error: 'pipeline.py', 'batch_process.py', 'profiling.py' or 'quantize.py' not found.", file=sys.stderr)
+    sys.exit(1)
+
+# Request keys that are not operation parameters
+RESERVED_KEYS = {'id', 'op', 'input', 'output', 'quality', 'operations'}
+
+# Number of recent latencies kept for the percentiles in stats
+LATENCY_WINDOW = 10000
+
+# Per-worker state, set once by _init_worker
+_worker_cache = None
+
+def build_operations(request):
+    """
+    Translate a request into pipeline operations, validating it up front.
+
+    Palette files of quantize operations are read here, so workers receive
+    the colors and cache keys match pipeline.py's (see quantize.inline_palettes).
+
+    Returns:
+        (operations, quality) tuple
+    """
+    name = request.get('op')
+    if not isinstance(name, str):
+        raise ValueError("Request needs an 'op' string")
+    if not request.get('input') or not request.get('output'):
+        raise ValueError("Request needs 'input' and 'output' paths")
+
+    if name == 'pipeline':
+        operations = request.get('operations')
+        if not isinstance(operations, list):
+            raise ValueError("'pipeline' requests need an 'operations' list")
+    elif name == 'convert':
+        operations = []
+    elif name in OPERATIONS:
+        operations = [{'op': name, **{k: v for k, v in request.items() if k not in RESERVED_KEYS}}]
+    else:
+        available = [*OPERATIONS, 'convert', 'pipeline']
+        raise ValueError(f"Unknown operation: {name}. Available: {', '.join(available)}")
+
+    validate_operations(operations)
+    return inline_palettes(operations), request.get('quality', 95)
+
+def _init_worker(cache_dir=None):
+    """Warm a worker: load every Pillow plugin and open the result cache."""
+    global _worker_cache
+    Image.init()
+    enable_from_env()
+    if cache_dir:
+        from result_cache import ResultCache
+        _worker_cache = ResultCache(cache_dir)
+
+def _run_request(input_path, output_path, operations, quality):
+    """Process one request inside a worker process."""
+    start = time.perf_counter()
+    size = None
+    cached = False
+    if _worker_cache:
+        # Same key as pipeline.py --cache-dir
+        cache_key = _worker_cache.key(input_path, output_path, 'pipeline',
+                                      {'operations': operations, 'quality': quality})
+        cached = _worker_cache.fetch(cache_key, output_path)
+    if not cached:
+        _, size = process_image(input_path, output_path, operations, quality=quality)
+        if _worker_cache:
+            _worker_cache.store(cache_key, output_path)
+    return {'size': size, 'cached': cached, 'seconds': time.perf_counter() - start}
+
+class ResponseStream:
+    """Serializes responses onto one output stream and tracks requests still pending on it."""
+
+    def __init__(self, write):
+        self._write = write
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._pending = 0
+
+    def opened(self):
+        with self._lock:
+            self._pending += 1
+
+    def send(self, response, completes=True):
+        line = json.dumps(response) + '\n'
+        with self._lock:
+            try:
+                self._write(line)
+            except (OSError, ValueError):
+                pass  # Client went away; the result is still on disk
+            if completes:
+                self._pending -= 1
+                self._idle.notify_all()
+
+    def wait(self):
+        """Block until every request dispatched on this stream has been answered."""
+        with self._lock:
+            while self._pending:
+                self._idle.wait()
+
+class WorkerService:
+    """
+    A pool of warm worker processes with bounded in-flight work.
+
+    Args:
+        workers: Number of worker processes (default: available CPUs)
+        max_pending: Requests allowed in flight before reading stops
+                     (default: 4 per worker); this is the backpressure point
+        cache_dir: Optional result cache directory (see result_cache.py)
+    """
+
+    def __init__(self, workers=None, max_pending=None, cache_dir=None):
+        self.workers = workers or default_workers()
+        self.max_pending = max_pending or self.workers * 4
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                            initargs=(cache_dir,))
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._completed = 0
+        self._failed = 0
+        self._in_flight = 0
+        self._started = time.perf_counter()
+
+        # Start every worker now so the first requests don't pay for process startup
+        for future in [self.executor.submit(time.sleep, 0) for _ in range(self.workers)]:
+            future.result()
+
+    def submit(self, line, stream):
+        """
+        Dispatch one request line; the response is sent on stream when it completes.
+
+        Blocks while max_pending requests are in flight, so a caller reading
+        from a pipe or socket stops reading and the producer is slowed down.
+        """
+        received = time.perf_counter()
+        request_id = None
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("Request must be a JSON object")
+            request_id = request.get('id')
+            if request.get('op') == 'stats':
+                stream.send({'id': request_id, 'ok': True, 'stats': self.stats()}, completes=False)
+                return
+            operations, quality = build_operations(request)
+        except Exception as e:
+            # A malformed request gets an error response; the service keeps serving
+            with self._lock:
+                self._failed += 1
+            stream.send({'id': request_id, 'ok': False, 'error': f"{type(e).__name__}: {e}"}, completes=False)
+            return
+
+        self._slots.acquire()
+        with self._lock:
+            self._in_flight += 1
+        stream.opened()
+        try:
+            future = self.executor.submit(_run_request, request['input'], request['output'], operations, quality)
+        except Exception as e:
+            # Pool is broken or shutting down
+            self._slots.release()
+            with self._lock:
+                self._in_flight -= 1
+                self._failed += 1
+            stream.send({'id': request_id, 'ok': False, 'error': f"{type(e).__name__}: {e}"})
+            return
+        future.add_done_callback(lambda f: self._finish(f, request, received, stream))
+
+    def _finish(self, future, request, received, stream):
+        self._slots.release()
+        latency = time.perf_counter() - received
+
+        response = {'id': request.get('id')}
+        try:
+            result = future.result()
+            response.update({'ok': True, 'output': request['output']})
+            if result['size']:
+                response.update({'width': result['size'][0], 'height': result['size'][1]})
+            response.update({'cached': result['cached'], 'worker_ms': round(result['seconds'] * 1000, 3)})
+        except Exception as e:
+            response.update({'ok': False, 'error': f"{type(e).__name__}: {e}"})
+        response['latency_ms'] = round(latency * 1000, 3)
+
+        with self._lock:
+            self._in_flight -= 1
+            self._completed += 1
+            self._failed += not response['ok']
+            self._latencies.append(latency)
+        stream.send(response)
+
+    def stats(self):
+        """
+        Service counters and latency percentiles over the recent window.
+
+        Returns:
+            Dict with requests, failed, in_flight, workers, requests_per_second
+            and latency_ms (p50, p95, p99, max)
+        """
+        with self._lock:
+            latencies = sorted(self._latencies)
+            completed, failed, in_flight = self._completed, self._failed, self._in_flight
+        elapsed = time.perf_counter() - self._started
+
+        def percentile(p):
+            return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000, 3)
+
+        return {
+            'requests': completed,
+            'failed': failed,
+            'in_flight': in_flight,
+            'workers': self.workers,
+            'requests_per_second': round(completed / elapsed, 1) if elapsed else None,
+            'latency_ms': {
+                'p50': percentile(0.50),
+                'p95': percentile(0.95),
+                'p99': percentile(0.99),
+                'max': round(latencies[-1] * 1000, 3),
+            } if latencies else None,
+        }
+
+    def close(self):
+        """Wait for outstanding requests and stop the workers."""
+        self.executor.shutdown(wait=True)
+
+def serve_stdio(service):
+    """Serve requests from stdin until EOF, writing responses to stdout."""
+    def write(line):
+        sys.stdout.write(line)
+        sys.stdout.flush()
+
+    stream = ResponseStream(write)
+    for line in sys.stdin:
+        if line.strip():
+            service.submit(line, stream)
+    stream.wait()
+
+def serve_socket(service, socket_path=None, port=None):
+    """
+    Serve requests on a Unix socket or a localhost TCP port until interrupted.
+
+    Every connection is its own JSON-lines session; all connections share the
+    worker pool and its in-flight limit.
+    """
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            def write(line):
+                self.wfile.write(line.encode('utf-8'))
+                self.wfile.flush()
+
+            stream = ResponseStream(write)
+            for raw in self.rfile:
+                line = raw.decode('utf-8')
+                if line.strip():
+                    service.submit(line, stream)
+            stream.wait()
+
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server_class = type('Server', (socketserver.ThreadingMixIn, socketserver.UnixStreamServer),
+                            {'daemon_threads': True})
+        server = server_class(socket_path, Handler)
+        address = socket_path
+    else:
+        server_class = type('Server', (socketserver.ThreadingMixIn, socketserver.TCPServer),
+                            {'daemon_threads': True, 'allow_reuse_address': True})
+        server = server_class(('127.0.0.1', port), Handler)
+        address = f"127.0.0.1:{server.server_address[1]}"
+
+    def interrupt(signum, frame):
+        raise KeyboardInterrupt
+
+    # Service managers stop us with SIGTERM; treat it like Ctrl+C
+    signal.signal(signal.SIGTERM, interrupt)
+
+    print(f"✓ Listening on {address}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if socket_path and os.path.exists(socket_path):
+            os.remove(socket_path)
+
+def run_worker(workers=None, max_pending=None, cache_dir=None, socket_path=None, port=None):
+    """
+    Run the worker service until stdin closes (or until interrupted, for sockets).
+
+    Progress and the final statistics go to stderr; stdout carries only
+    protocol responses.
+
+    Args:
+        workers: Number of worker processes (default: available CPUs)
+        max_pending: Requests in flight before input is no longer read (default: 4 per worker)
+        cache_dir: Optional result cache directory (see result_cache.py)
+        socket_path: Serve on this Unix socket instead of stdin/stdout
+        port: Serve on this localhost TCP port instead of stdin/stdout
+    """
+    try:
+        service = WorkerService(workers=workers, max_pending=max_pending, cache_dir=cache_dir)
+        print(f"✓ {service.workers} warm workers ready (max {service.max_pending} requests in flight)",
+              file=sys.stderr)
+
+        try:
+            if socket_path or port is not None:
+                serve_socket(service, socket_path=socket_path, port=port)
+            else:
+                serve_stdio(service)
+        finally:
+            service.close()
+
+        stats = service.stats()
+        print(f"✓ Served {stats['requests']} requests ({stats['failed']} failed, "
+              f"{stats['requests_per_second']} requests/s)", file=sys.stderr)
+        if stats['latency_ms']:
+            latency = stats['latency_ms']
+            print(f"✓ Latency p50 {latency['p50']}ms, p95 {latency['p95']}ms, p99 {latency['p99']}ms, "
+                  f"max {latency['max']}ms", file=sys.stderr)
+        return stats['failed'] == 0
+
+    except Exception as e:
+        print(f"✗ Error running worker: {e}", file=sys.stderr)
+        return False
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Serve image operations from a pool of warm worker processes over JSON lines",
+        epilog='Example: echo \'{"id": 1, "op": "resize", "input": "a.jpg", "output": "b.jpg", '
+               '"width": 400}\' | image_worker.py')
+    parser.add_argument("--workers", type=int, help="Worker processes (default: available CPUs)")
+    parser.add_argument("--max-pending", type=int, help="Requests in flight before input is paused "
+                                                        "(default: 4 per worker)")
+    parser.add_argument("--socket", help="Serve on this Unix socket instead of stdin/stdout")
+    parser.add_argument("--port", type=int, help="Serve on this localhost TCP port instead of stdin/stdout")
+    parser.add_argument("--cache-dir", help="Reuse results from this cache directory (see result_cache.py)")
+
+    add_profile_argument(parser)
+    args = parser.parse_args()
+    enable_from_args(args)
+
+    success = run_worker(workers=args.workers, max_pending=args.max_pending, cache_dir=args.cache_dir,
+                         socket_path=args.socket, port=args.port)
+
+    sys.exit(0 if success else 1)
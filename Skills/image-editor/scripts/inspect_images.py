@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+"""
+Header-only image inspection and indexing.
+
+Reads dimensions, mode, format, EXIF orientation, transparency and animation
+from image headers with Pillow's lazy Image.open, without decoding any pixel
+data, for whole directories in parallel. The results are written to a compact
+index (CSV, JSON lines or SQLite) that batch jobs can query, e.g. to skip
+files that are already smaller than a target width:
+
+    python inspect_images.py photos/ --index photos.db --recursive
+    python inspect_images.py --query photos.db --min-width 1201 > todo.txt
+    python batch_process.py @todo.txt out/ --op resize width=1200
+
+Re-running a scan reuses the entries of files whose size and modification
+time have not changed.
+"""
+from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import csv
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+try:
+    from batch_process import collect_inputs
+except ImportError:
+    print("Error: 'batch_process.py' not found.", file=sys.stderr)
+    sys.exit(1)
+
+# Index columns and their types
+FIELDS = {
+    'path': str,
+    'bytes': int,
+    'mtime_ns': int,
+    'format': str,
+    'mode': str,
+    'width': int,
+    'height': int,
+    'orientation': int,
+    'has_alpha': bool,
+    'animated': bool,
+    'error': str,
+}
+
+INDEX_FORMATS = {
+    '.csv': 'csv',
+    '.jsonl': 'jsonl',
+    '.db': 'sqlite',
+    '.sqlite': 'sqlite',
+    '.sqlite3': 'sqlite',
+}
+
+DEFAULT_WORKERS = 16
+
+EXIF_ORIENTATION = 0x0112
+
+ALPHA_MODES = {'RGBA', 'LA', 'PA', 'RGBa', 'La'}
+
+def read_orientation(img):
+    """
+    EXIF orientation (1-8) of a lazily opened image, without loading it.
+
+    Image.getexif() is avoided: for PNGs without an early eXIf chunk it
+    decodes the whole image to look for one after the pixel data.
+    """
+    if hasattr(img, 'tag_v2'):
+        return int(img.tag_v2.get(EXIF_ORIENTATION, 1))
+    exif_data = img.info.get('exif')
+    if not exif_data:
+        return 1
+    exif = Image.Exif()
+    exif.load(exif_data)
+    return int(exif.get(EXIF_ORIENTATION, 1))
+
+def inspect_image(path):
+    """
+    Read an image's header fields without decoding its pixels.
+
+    Returns:
+        Index record dict with the FIELDS keys; unreadable files get an error
+        and no image fields
+    """
+    stat = os.stat(path)
+    record = dict.fromkeys(FIELDS)
+    record.update({'path': path, 'bytes': stat.st_size, 'mtime_ns': stat.st_mtime_ns})
+    try:
+        with Image.open(path) as img:
+            record.update({
+                'format': img.format,
+                'mode': img.mode,
+                'width': img.width,
+                'height': img.height,
+                'orientation': read_orientation(img),
+                'has_alpha': img.mode in ALPHA_MODES or 'transparency' in img.info,
+                # Reads the next frame header at most (GIF), never frame data
+                'animated': bool(getattr(img, 'is_animated', False)),
+            })
+    except Exception as e:
+        record['error'] = f"{type(e).__name__}: {e}"
+    return record
+
+def index_format(index_path):
+    """Index storage format implied by the file extension."""
+    ext = os.path.splitext(index_path)[1].lower()
+    if ext not in INDEX_FORMATS:
+        raise ValueError(f"Unknown index extension: {ext or index_path}. Use {', '.join(INDEX_FORMATS)}")
+    return INDEX_FORMATS[ext]
+
+def typed(record):
+    """Convert values read back from CSV or SQLite to their FIELDS types; empty values become None."""
+    converted = {}
+    for field, kind in FIELDS.items():
+        value = record.get(field)
+        if value is None or value == '':
+            converted[field] = None
+        elif kind is bool:
+            converted[field] = value in (True, 1, '1', 'True', 'true')
+        else:
+            converted[field] = kind(value)
+    return converted
+
+def write_index(index_path, records):
+    """Write records to an index file, replacing it atomically."""
+    storage = index_format(index_path)
+    directory = os.path.dirname(os.path.abspath(index_path))
+    fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=directory)
+    os.close(fd)
+    try:
+        if storage == 'csv':
+            with open(tmp_path, 'w', encoding='utf-8', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=list(FIELDS))
+                writer.writeheader()
+                for record in records:
+                    writer.writerow({k: int(v) if isinstance(v, bool) else v for k, v in record.items()})
+        elif storage == 'jsonl':
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for record in records:
+                    f.write(json.dumps(record) + '\n')
+        else:
+            os.remove(tmp_path)
+            columns = ', '.join(f"{field} {'TEXT' if kind is str else 'INTEGER'}" for field, kind in FIELDS.items())
+            with sqlite3.connect(tmp_path) as db:
+                db.execute(f"CREATE TABLE images ({columns}, PRIMARY KEY (path))")
+                db.execute("CREATE INDEX images_size ON images (width, height)")
+                db.executemany(f"INSERT INTO images VALUES ({', '.join('?' * len(FIELDS))})",
+                               [tuple(record[field] for field in FIELDS) for record in records])
+            db.close()
+        os.replace(tmp_path, index_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def read_index(index_path):
+    """Load every record of an index file."""
+    storage = index_format(index_path)
+    if storage == 'csv':
+        with open(index_path, 'r', encoding='utf-8', newline='') as f:
+            return [typed(row) for row in csv.DictReader(f)]
+    if storage == 'jsonl':
+        with open(index_path, 'r', encoding='utf-8') as f:
+            return [typed(json.loads(line)) for line in f if line.strip()]
+    if not os.path.exists(index_path):
+        raise FileNotFoundError(f"No such index: {index_path}")
+    db = sqlite3.connect(index_path)
+    try:
+        db.row_factory = sqlite3.Row
+        return [typed(dict(row)) for row in db.execute(f"SELECT {', '.join(FIELDS)} FROM images ORDER BY path")]
+    finally:
+        db.close()
+
+def scan(paths, previous=None, workers=DEFAULT_WORKERS):
+    """
+    Inspect files in parallel threads, reusing unchanged entries of a previous index.
+
+    Returns:
+        (records in path order, number of reused records) tuple
+    """
+    previous = {r['path']: r for r in previous or []}
+    records = {}
+    todo = []
+    for path in paths:
+        old = previous.get(path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        if old and old['bytes'] == stat.st_size and old['mtime_ns'] == stat.st_mtime_ns:
+            records[path] = old
+        else:
+            todo.append(path)
+
+    reused = len(records)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for record in executor.map(inspect_image, todo):
+            records[record['path']] = record
+    return [records[p] for p in paths if p in records], reused
+
+def index_images(source, index_path, recursive=False, workers=DEFAULT_WORKERS, refresh=False):
+    """
+    Inspect every image matched by a directory or glob and write an index.
+
+    Args:
+        source: Input directory or glob pattern
+        index_path: Index file; .csv, .jsonl, or .db/.sqlite/.sqlite3 for SQLite
+        recursive: Descend into subdirectories when source is a directory
+        workers: Files inspected concurrently
+        refresh: Re-inspect every file instead of reusing unchanged index entries
+    """
+    try:
+        index_format(index_path)
+        _, paths = collect_inputs(source, recursive=recursive)
+        if not paths:
+            raise ValueError(f"No images found for: {source}")
+
+        previous = None
+        if not refresh and os.path.exists(index_path):
+            previous = read_index(index_path)
+
+        start = time.perf_counter()
+        records, reused = scan(paths, previous=previous, workers=workers)
+        elapsed = time.perf_counter() - start
+        write_index(index_path, records)
+
+        errors = [r for r in records if r['error']]
+        print(f"✓ Inspected {len(records)} files in {elapsed:.2f}s ({reused} unchanged since the last scan)")
+        if errors:
+            print(f"ℹ {len(errors)} files could not be read as images (see 'error' in the index)")
+        print(f"✓ Index: {index_path}")
+        return True
+
+    except Exception as e:
+        print(f"✗ Error indexing images: {e}", file=sys.stderr)
+        return False
+
+def filter_records(records, min_width=None, max_width=None, min_height=None, max_height=None, formats=None,
+                   modes=None, rotated=None):
+    """
+    Select readable index records matching every given condition.
+
+    Args:
+        records: Index records
+        min_width, max_width, min_height, max_height: Inclusive bounds on the stored size
+        formats: Pillow format names or extensions to keep (e.g. ['JPEG', 'png'])
+        modes: Image modes to keep
+        rotated: Keep only images whose EXIF orientation is (True) or is not (False) 1
+
+    Returns:
+        List of matching records
+    """
+    if formats:
+        formats = {'JPEG' if f.upper().lstrip('.') in ('JPG', 'JPEG') else f.upper().lstrip('.') for f in formats}
+    matches = []
+    for record in records:
+        if record['error']:
+            continue
+        if min_width is not None and record['width'] < min_width:
+            continue
+        if max_width is not None and record['width'] > max_width:
+            continue
+        if min_height is not None and record['height'] < min_height:
+            continue
+        if max_height is not None and record['height'] > max_height:
+            continue
+        if formats and record['format'] not in formats:
+            continue
+        if modes and record['mode'] not in modes:
+            continue
+        if rotated is not None and (record['orientation'] != 1) != rotated:
+            continue
+        matches.append(record)
+    return matches
+
+def query_index(index_path, as_json=False, **conditions):
+    """
+    Print the paths (or JSON records) of indexed images matching the conditions.
+
+    Paths go to stdout one per line, ready for batch_process.py @LIST; the
+    summary goes to stderr. See filter_records() for the conditions.
+    """
+    try:
+        records = read_index(index_path)
+        matches = filter_records(records, **conditions)
+        for record in matches:
+            print(json.dumps(record) if as_json else record['path'])
+        print(f"✓ {len(matches)} of {len(records)} indexed files match", file=sys.stderr)
+        return True
+
+    except Exception as e:
+        print(f"✗ Error querying index: {e}", file=sys.stderr)
+        return False
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Index image headers (size, mode, format, orientation) without decoding pixels, or query an index")
+    parser.add_argument("input", nargs="?", help="Input directory or glob pattern (quote globs, e.g. 'photos/*.jpg')")
+    parser.add_argument("--index", help="Index file to write: .csv, .jsonl, or .db for SQLite")
+    parser.add_argument("--recursive", action="store_true", help="Include subdirectories of an input directory")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                       help=f"Files inspected concurrently (default: {DEFAULT_WORKERS})")
+    parser.add_argument("--refresh", action="store_true", help="Re-inspect files even if unchanged since the last scan")
+
+    query = parser.add_argument_group("querying an index")
+    query.add_argument("--query", metavar="INDEX", help="Print the paths of indexed images matching the filters")
+    query.add_argument("--min-width", type=int, help="Keep images at least this wide")
+    query.add_argument("--max-width", type=int, help="Keep images at most this wide")
+    query.add_argument("--min-height", type=int, help="Keep images at least this tall")
+    query.add_argument("--max-height", type=int, help="Keep images at most this tall")
+    query.add_argument("--format", dest="formats", nargs="+", help="Keep these formats (e.g. jpeg png)")
+    query.add_argument("--mode", dest="modes", nargs="+", help="Keep these modes (e.g. RGB RGBA)")
+    query.add_argument("--rotated", action="store_true", help="Keep only images with a non-default EXIF orientation")
+    query.add_argument("--json", action="store_true", help="Print full records as JSON lines instead of paths")
+
+    args = parser.parse_args()
+
+    if args.query:
+        success = query_index(args.query, as_json=args.json, min_width=args.min_width, max_width=args.max_width,
+                              min_height=args.min_height, max_height=args.max_height, formats=args.formats,
+                              modes=args.modes, rotated=True if args.rotated else None)
+    elif args.input and args.index:
+        success = index_images(args.input, args.index, recursive=args.recursive, workers=args.workers,
+                               refresh=args.refresh)
+    else:
+        parser.error("give an input and --index to build an index, or --query INDEX to query one")
+
+    sys.exit(0 if success else 1)
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Lossless JPEG transforms (right-angle rotations, flips, MCU-aligned crops).
+
+The transforms are done in the DCT domain by the jpegtran tool from libjpeg /
+libjpeg-turbo, so pixels are never decoded and there is no generation loss.
+Every function returns False when the lossless path does not apply (input is
+not a JPEG, output is not a .jpg, jpegtran is not installed, or the geometry
+does not line up with the MCU grid) so callers can fall back to Pillow.
+"""
+from PIL import Image
+import os
+import shutil
+import subprocess
+import tempfile
+
+# jpegtran rotates clockwise; Pillow's ROTATE_* constants are counter-clockwise
+TRANSPOSE_ARGS = {
+    Image.Transpose.FLIP_LEFT_RIGHT: ['-flip', 'horizontal'],
+    Image.Transpose.FLIP_TOP_BOTTOM: ['-flip', 'vertical'],
+    Image.Transpose.ROTATE_90: ['-rotate', '270'],
+    Image.Transpose.ROTATE_180: ['-rotate', '180'],
+    Image.Transpose.ROTATE_270: ['-rotate', '90'],
+    Image.Transpose.TRANSPOSE: ['-transpose'],
+    Image.Transpose.TRANSVERSE: ['-transverse'],
+}
+
+def find_jpegtran():
+    """Return the jpegtran executable ($IMAGE_EDITOR_JPEGTRAN or PATH), or None."""
+    return os.environ.get('IMAGE_EDITOR_JPEGTRAN') or shutil.which('jpegtran')
+
+def mcu_size(img):
+    """
+    Size of a JPEG's minimum coded unit in pixels, from its sampling factors.
+
+    Returns:
+        (width, height) tuple, e.g. (16, 16) for 4:2:0 and (8, 8) for 4:4:4
+    """
+    layers = getattr(img, 'layer', None) or [('', 1, 1, 0)]
+    return 8 * max(layer[1] for layer in layers), 8 * max(layer[2] for layer in layers)
+
+def _is_jpeg_to_jpeg(img, output_path):
+    return img.format == 'JPEG' and os.path.splitext(output_path)[1].lower() in ('.jpg', '.jpeg')
+
+def _run_jpegtran(args, input_path, output_path):
+    """Run jpegtran into a temporary file next to output_path and move it into place."""
+    jpegtran = find_jpegtran()
+    if not jpegtran:
+        return False
+
+    fd, tmp_path = tempfile.mkstemp(suffix='.jpg', dir=os.path.dirname(os.path.abspath(output_path)))
+    os.close(fd)
+    try:
+        # Pillow's re-encode drops EXIF and ICC data too, so keep the two paths consistent
+        result = subprocess.run([jpegtran, '-copy', 'none', *args, '-outfile', tmp_path, input_path],
+                                capture_output=True)
+        if result.returncode != 0:
+            return False
+        os.replace(tmp_path, output_path)
+        return True
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def lossless_transpose(input_path, output_path, method):
+    """
+    Rotate or flip a JPEG without re-encoding it.
+
+    Args:
+        input_path: Path to input image
+        output_path: Path to save the result (.jpg/.jpeg)
+        method: Image.Transpose member, or None for a lossless copy
+
+    Returns:
+        True if the file was written, False if the lossless path does not apply
+    """
+    with Image.open(input_path) as img:
+        if not _is_jpeg_to_jpeg(img, output_path):
+            return False
+
+    args = TRANSPOSE_ARGS[method] if method is not None else []
+    # -perfect makes jpegtran refuse instead of dropping partial edge MCUs
+    return _run_jpegtran(['-perfect', *args], input_path, output_path)
+
+def lossless_crop(input_path, output_path, box):
+    """
+    Crop a JPEG without re-encoding it.
+
+    The left and top edges must lie on the MCU grid (multiples of 8 or 16
+    pixels depending on chroma subsampling) and the box must lie inside the
+    image; the right and bottom edges can be anywhere.
+
+    Args:
+        input_path: Path to input image
+        output_path: Path to save the result (.jpg/.jpeg)
+        box: (left, top, right, bottom) tuple
+
+    Returns:
+        True if the file was written, False if the lossless path does not apply
+    """
+    left, top, right, bottom = box
+    with Image.open(input_path) as img:
+        if not _is_jpeg_to_jpeg(img, output_path):
+            return False
+        mcu_width, mcu_height = mcu_size(img)
+        width, height = img.size
+
+    if left % mcu_width or top % mcu_height:
+        return False
+    if left < 0 or top < 0 or right > width or bottom > height or left >= right or top >= bottom:
+        return False
+
+    return _run_jpegtran(['-crop', f"{right - left}x{bottom - top}+{left}+{top}"], input_path, output_path)
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+Generate several sizes and formats of an image from a single decode.
+"""
+from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import contextvars
+import json
+import os
+import sys
+
+try:
+    from resize_image import SPEED_MODES, compute_size
+    from convert_format import save_image
+    from profiling import add_profile_argument, enable_from_args, profiled, stage
+except ImportError as e:
+    print(f"Error: sibling script not found ({e}). Run make_renditions.py from the scripts/ directory.",
+          file=sys.stderr)
+    sys.exit(1)
+
+DEFAULT_NAME = "{stem}-{width}x{height}.{ext}"
+
+def parse_size(text):
+    """
+    Parse a rendition size: '800' (width), 'x600' (height) or '800x600' (both).
+
+    Returns:
+        (width, height) tuple; either may be None
+    """
+    width, _, height = text.lower().partition('x')
+    try:
+        size = (int(width) if width else None, int(height) if height else None)
+    except ValueError:
+        raise ValueError(f"Invalid size: '{text}'. Use WIDTH, xHEIGHT or WIDTHxHEIGHT")
+    if size == (None, None) or any(v is not None and v <= 0 for v in size):
+        raise ValueError(f"Invalid size: '{text}'. Use WIDTH, xHEIGHT or WIDTHxHEIGHT")
+    return size
+
+def _pick_source(sources, size, gap):
+    """Smallest available image at least gap times the target size in both dimensions."""
+    if gap is None:
+        return sources[0]
+    candidates = [s for s in sources if s.width >= size[0] * gap and s.height >= size[1] * gap]
+    return min(candidates, key=lambda s: s.width * s.height) if candidates else sources[0]
+
+def render_sizes(img, sizes, speed='balanced'):
+    """
+    Resize an image to several target sizes, largest first.
+
+    Each size is derived from the smallest rendition already produced that is
+    still at least the speed mode's reducing gap larger than the target (the
+    same margin resize() keeps between its reduce and LANCZOS steps), and from
+    the original otherwise. 'exact' always resizes from the original.
+
+    Args:
+        img: PIL Image, ideally not loaded yet so JPEG draft decoding can apply
+        sizes: List of (width, height) requests, either of which may be None
+        speed: Downscaling strategy, as for resize_image.py
+
+    Yields:
+        ((width, height) request, resized PIL Image) pairs, largest first; requests
+        that resolve to the same size (e.g. 800 and 800x600 for a 4:3 image)
+        yield it once, for the first of them
+    """
+    if speed not in SPEED_MODES:
+        raise ValueError(f"Unknown speed: {speed}. Available: {', '.join(SPEED_MODES.keys())}")
+    mode = SPEED_MODES[speed]
+
+    # Target sizes always come from the original dimensions so rounding does not accumulate
+    targets = {}
+    for request in sizes:
+        targets.setdefault(compute_size(img.size, width=request[0], height=request[1]), request)
+    targets = [(request, size) for size, request in targets.items()]
+    targets.sort(key=lambda t: t[1][0] * t[1][1], reverse=True)
+
+    largest = targets[0][1]
+    if mode['draft'] and largest[0] < img.width and largest[1] < img.height:
+        img.draft(img.mode, (int(largest[0] * mode['draft']), int(largest[1] * mode['draft'])))
+    with stage('decode'):
+        img.load()
+
+    sources = [img]
+    for request, size in targets:
+        source = _pick_source(sources, size, mode['reducing_gap'])
+        with stage('resize'):
+            resized = source.resize(size, Image.Resampling.LANCZOS, reducing_gap=mode['reducing_gap'])
+        sources.append(resized)
+        yield request, resized
+
+@profiled
+def process_renditions(input_path, output_dir, sizes, formats=None, quality=95, name_template=DEFAULT_NAME,
+                       speed='balanced', workers=None):
+    """
+    Decode an image once and write every size in every format.
+
+    Resizing happens on the calling thread; encoding runs in a thread pool
+    (Pillow releases the GIL while encoding) so outputs are written while the
+    next size is computed. Raises on failure; see make_renditions() for the
+    printing wrapper.
+
+    Returns:
+        Manifest dict describing the source and every file written
+    """
+    if not sizes:
+        raise ValueError("No sizes given")
+
+    stem, input_ext = os.path.splitext(os.path.basename(input_path))
+    formats = [f.lower().lstrip('.') for f in formats] if formats else [input_ext.lower().lstrip('.')]
+    os.makedirs(output_dir, exist_ok=True)
+
+    with stage('open'):
+        img = Image.open(input_path)
+    manifest = {'source': input_path, 'width': img.width, 'height': img.height, 'renditions': []}
+
+    def encode(resized, output_path):
+        with stage('save'):
+            save_image(resized, output_path, quality=quality)
+        return os.path.getsize(output_path)
+
+    jobs = []
+    written = set()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for request, resized in render_sizes(img, sizes, speed=speed):
+            for ext in formats:
+                name = name_template.format(stem=stem, width=resized.width, height=resized.height, ext=ext)
+                output_path = os.path.join(output_dir, name)
+                if output_path in written:
+                    raise ValueError(f"Two renditions would both be written to {output_path}; "
+                                     f"include {{width}}/{{height}} in the name template or drop a size or format")
+                written.add(output_path)
+                entry = {
+                    'path': output_path,
+                    'width': resized.width,
+                    'height': resized.height,
+                    'format': ext,
+                    'requested': {'width': request[0], 'height': request[1]},
+                }
+                # Copy the context so profiling stages on the encoder threads nest under this job
+                jobs.append((entry, executor.submit(contextvars.copy_context().run, encode, resized, output_path)))
+
+        for entry, future in jobs:
+            entry['bytes'] = future.result()
+            manifest['renditions'].append(entry)
+
+    return manifest
+
+def make_renditions(input_path, output_dir, sizes, formats=None, quality=95, name_template=DEFAULT_NAME,
+                    speed='balanced', workers=None, manifest_path=None):
+    """
+    Generate responsive renditions of an image.
+
+    Args:
+        input_path: Path to input image
+        output_dir: Directory to write the renditions to
+        sizes: List of (width, height) requests; give one of the two to keep
+               the aspect ratio, or both for an exact size
+        formats: Output extensions (e.g. ['jpg', 'webp']); defaults to the input's
+        quality: Quality for JPEG/WebP (1-100)
+        name_template: Output file name, with {stem}, {width}, {height} and {ext} fields
+        speed: Downscaling strategy, as for resize_image.py
+        workers: Encoder threads (default: Python's ThreadPoolExecutor default)
+        manifest_path: Where to write the JSON manifest (default: <output_dir>/<stem>.json)
+    """
+    try:
+        manifest = process_renditions(input_path, output_dir, sizes, formats=formats, quality=quality,
+                                      name_template=name_template, speed=speed, workers=workers)
+
+        if manifest_path is None:
+            stem = os.path.splitext(os.path.basename(input_path))[0]
+            manifest_path = os.path.join(output_dir, f"{stem}.json")
+        with open(manifest_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+
+        print(f"✓ Decoded {input_path} once ({manifest['width']}x{manifest['height']})")
+        for entry in manifest['renditions']:
+            print(f"✓ {entry['width']}x{entry['height']} {entry['format']}: {entry['path']} ({entry['bytes']} bytes)")
+        print(f"✓ Manifest: {manifest_path}")
+        return True
+
+    except Exception as e:
+        print(f"✗ Error generating renditions: {e}", file=sys.stderr)
+        return False
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Generate several sizes and formats of an image from a single decode",
+        epilog="Example: make_renditions.py photo.jpg out/ --sizes 1920 1280 960 640 320 160 --formats jpg webp")
+    parser.add_argument("input", help="Input image path")
+    parser.add_argument("output_dir", help="Output directory")
+    parser.add_argument("--sizes", nargs="+", required=True, metavar="SIZE",
+                       help="Target sizes: WIDTH, xHEIGHT or WIDTHxHEIGHT")
+    parser.add_argument("--formats", nargs="+", metavar="EXT",
+                       help="Output formats (e.g. jpg webp; default: the input's format)")
+    parser.add_argument("--quality", type=int, default=95, help="Quality for JPEG/WebP (1-100)")
+    parser.add_argument("--name", default=DEFAULT_NAME,
+                       help=f"Output file name template (default: {DEFAULT_NAME})")
+    parser.add_argument("--speed", choices=list(SPEED_MODES.keys()), default="balanced",
+                       help="Downscaling quality/speed trade-off (default: balanced)")
+    parser.add_argument("--workers", type=int, help="Encoder threads")
+    parser.add_argument("--manifest", help="Manifest path (default: <output_dir>/<input stem>.json)")
+
+    add_profile_argument(parser)
+    args = parser.parse_args()
+    enable_from_args(args)
+
+    try:
+        sizes = [parse_size(s) for s in args.sizes]
+    except ValueError as e:
+        parser.error(str(e))
+
+    success = make_renditions(args.input, args.output_dir, sizes, formats=args.formats, quality=args.quality,
+                              name_template=args.name, speed=args.speed, workers=args.workers,
+                              manifest_path=args.manifest)
+
+    sys.exit(0 if success else 1)
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Multi-threaded filtering of one large image in overlapping horizontal bands.
+
+A neighbourhood filter (blur, convolution kernel, unsharp mask, sharpness)
+computes each output row from input rows at most a fixed distance away: its
+halo. Cutting the image into bands, extending each band by the halo above
+and below, filtering the bands in parallel threads and keeping only each
+band's own rows gives exactly the single-threaded result. Pillow's C
+filters release the GIL, so the bands run on separate cores.
+
+Used by apply_effects.py and adjust_image.py (--threads).
+"""
+from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+import os
+
+# Bands shorter than this are not worth a thread
+MIN_BAND_ROWS = 64
+
+def band_bounds(height, bands, halo):
+    """
+    Split rows [0, height) into bands extended by a halo.
+
+    Returns:
+        List of (top, bottom, y, y_end): rows [top, bottom) are filtered and rows
+        [y, y_end) of the result are kept
+    """
+    step = -(-height // bands)
+    bounds = []
+    for y in range(0, height, step):
+        y_end = min(y + step, height)
+        bounds.append((max(y - halo, 0), min(y_end + halo, height), y, y_end))
+    return bounds
+
+def filter_bands(img, apply, halo, threads=None):
+    """
+    Apply a filter to horizontal bands of an image in parallel threads.
+
+    Args:
+        img: PIL Image
+        apply: Function taking an image and returning the filtered image of the
+               same size, whose rows depend only on input rows within halo rows
+        halo: Rows of overlap the filter needs above and below each band
+        threads: Worker threads and bands (default: available CPUs)
+
+    Returns:
+        The filtered PIL Image, identical to apply(img)
+    """
+    threads = threads or os.cpu_count() or 1
+    bands = min(threads, img.height // MIN_BAND_ROWS)
+    if bands <= 1:
+        return apply(img)
+
+    img.load()
+    width = img.width
+
+    def run(top, bottom, y, y_end):
+        filtered = apply(img.crop((0, top, width, bottom)))
+        return filtered.crop((0, y - top, width, y_end - top))
+
+    result = None
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        # Each band runs in a copy of this context, so profiling stages nest under the caller's
+        futures = [(bounds[2], executor.submit(contextvars.copy_context().run, run, *bounds))
+                   for bounds in band_bounds(img.height, bands, halo)]
+        for y, future in futures:
+            band = future.result()
+            if result is None:
+                result = Image.new(band.mode, img.size)
+                # Keep metadata (e.g. an ICC profile) as filtering the whole image would
+                result.info = dict(band.info)
+                if band.mode in ('P', 'PA'):
+                    result.putpalette(band.getpalette())
+            result.paste(band, (0, y))
+    return result
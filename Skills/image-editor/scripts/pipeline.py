@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+Multi-operation image pipeline: decode once, apply operations in order, encode once.
+"""
+from PIL import Image
+import argparse
+import inspect
+import json
+import sys
+
+try:
+    from resize_image import resize
+    from rotate_image import rotate
+    from crop_image import crop
+    from adjust_image import adjust
+    from apply_effects import add_effects
+    from add_watermark import watermark
+    from quantize import inline_palettes, quantize
+    from convert_format import save_image
+    from image_io import transcode
+    from profiling import add_profile_argument, enable_from_args, profiled, stage
+except ImportError as e:
+    print(f"Error: sibling script not found ({e}). Run pipeline.py from the scripts/ directory.", file=sys.stderr)
+    sys.exit(1)
+
+OPERATIONS = {
+    'resize': resize,
+    'rotate': rotate,
+    'crop': crop,
+    'adjust': adjust,
+    'effects': add_effects,
+    'watermark': watermark,
+    'quantize': quantize,
+}
+
+# Parameters that are always taken verbatim from the command line
+STRING_PARAMS = {'text', 'position', 'filter_type', 'fit', 'gravity', 'background', 'method', 'palette'}
+
+def parse_value(key, value):
+    """Parse a KEY=VALUE command-line value into a JSON scalar where possible."""
+    if key in STRING_PARAMS:
+        return value
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+def parse_operation(tokens):
+    """
+    Parse a command-line operation such as ['resize', 'width=400'].
+
+    Returns:
+        Operation dict, e.g. {'op': 'resize', 'width': 400}
+    """
+    operation = {'op': tokens[0]}
+    for token in tokens[1:]:
+        if '=' not in token:
+            raise ValueError(f"Expected KEY=VALUE for '{tokens[0]}', got '{token}'")
+        key, value = token.split('=', 1)
+        key = key.replace('-', '_')
+        operation[key] = parse_value(key, value)
+    return operation
+
+def load_spec(spec_path):
+    """
+    Load a JSON pipeline spec.
+
+    The spec is either a list of operation dicts or an object of the form
+    {"operations": [...], "quality": 85}.
+
+    Returns:
+        (operations, quality) tuple; quality is None when not given
+    """
+    with open(spec_path, 'r', encoding='utf-8') as f:
+        spec = json.load(f)
+
+    if isinstance(spec, list):
+        return spec, None
+    if isinstance(spec, dict) and isinstance(spec.get('operations'), list):
+        return spec['operations'], spec.get('quality')
+    raise ValueError("Spec must be a list of operations or an object with an 'operations' list")
+
+def add_operation_arguments(parser):
+    """Add the shared --op/--spec/--quality options to an argument parser."""
+    parser.add_argument("--op", action="append", nargs="+", default=[], metavar="NAME [KEY=VALUE]",
+                       help=f"Operation to apply, repeatable and applied in order: {', '.join(OPERATIONS.keys())}")
+    parser.add_argument("--spec", help="JSON file with the list of operations")
+    parser.add_argument("--quality", type=int, help="Quality for JPEG/WebP (1-100, default: 95)")
+
+def operations_from_args(args):
+    """
+    Build the operation list from parsed --op/--spec/--quality options.
+
+    Returns:
+        (operations, quality) tuple
+    """
+    operations, spec_quality = load_spec(args.spec) if args.spec else ([], None)
+    operations = operations + [parse_operation(tokens) for tokens in args.op]
+    validate_operations(operations)
+    return operations, args.quality or spec_quality or 95
+
+def validate_operations(operations):
+    """Check operation names and parameters before any image is decoded."""
+    for operation in operations:
+        if not isinstance(operation, dict):
+            raise ValueError(f"Each operation must be an object with an 'op' name, got {operation!r}")
+        name = operation.get('op')
+        if not isinstance(name, str) or name not in OPERATIONS:
+            raise ValueError(f"Unknown operation: {name}. Available: {', '.join(OPERATIONS.keys())}")
+        params = {k: v for k, v in operation.items() if k != 'op'}
+        try:
+            inspect.signature(OPERATIONS[name]).bind(None, **params)
+        except TypeError as e:
+            raise ValueError(f"Invalid parameters for '{name}': {e}")
+
+def apply_operations(img, operations):
+    """
+    Apply a list of operations to an in-memory image.
+
+    Args:
+        img: PIL Image
+        operations: List of operation dicts ({'op': name, **params})
+
+    Returns:
+        The processed PIL Image
+    """
+    validate_operations(operations)
+    for operation in operations:
+        params = {k: v for k, v in operation.items() if k != 'op'}
+        with stage(operation['op']):
+            img = OPERATIONS[operation['op']](img, **params)
+    return img
+
+@profiled
+def process_image(input_path, output_path, operations, quality=95):
+    """
+    Decode an image once, apply all operations and encode it once.
+
+    Animated GIF/WebP/APNG inputs written to one of those formats keep all
+    their frames (see animation.py).
+
+    Raises on failure; see run_pipeline() for the printing wrapper.
+
+    Returns:
+        (original_size, final_size) tuple
+    """
+    with stage('open'):
+        img = Image.open(input_path)
+    original_size = img.size
+
+    from animation import animated_output, process_animation
+    if animated_output(img, output_path):
+        with stage('animation'):
+            _, final_size = process_animation(img, output_path, lambda frame: apply_operations(frame, operations),
+                                              quality=quality)
+        return original_size, final_size
+
+    if not operations or operations[0]['op'] != 'resize':
+        # resize() decodes for itself, possibly at a reduced size
+        with stage('decode'):
+            img.load()
+    img = apply_operations(img, operations)
+    with stage('save'):
+        save_image(img, output_path, quality=quality)
+    return original_size, img.size
+
+def process_bytes(data, output_format, operations, quality=95):
+    """
+    Like process_image(), but from encoded bytes to encoded bytes.
+
+    Args:
+        data: Encoded input image (bytes, memoryview or another buffer)
+        output_format: Format for the result (e.g. 'JPEG', 'webp')
+        operations: List of operation dicts ({'op': name, **params})
+        quality: Quality for JPEG/WebP output (1-100)
+
+    Returns:
+        (encoded_bytes, original_size, final_size) tuple
+    """
+    return transcode(data, output_format, operations, quality=quality)
+
+def run_pipeline(input_path, output_path, operations, quality=95, cache_dir=None):
+    """
+    Run a multi-operation pipeline on an image.
+
+    Args:
+        input_path: Path to input image
+        output_path: Path to save the result (format determined by extension)
+        operations: Ordered list of operation dicts, e.g.
+                    [{'op': 'crop', 'left': 0, 'top': 0, 'right': 800, 'bottom': 600},
+                     {'op': 'resize', 'width': 400}]
+        quality: Quality for JPEG/WebP output (1-100)
+        cache_dir: Result cache directory (see result_cache.py); a repeat run on the same
+                   input bytes with the same parameters reuses the stored output
+    """
+    try:
+        resolved = inline_palettes(operations)
+        if cache_dir:
+            from result_cache import ResultCache
+            cache = ResultCache(cache_dir)
+            cache_key = cache.key(input_path, output_path, 'pipeline', {
+                'operations': resolved, 'quality': quality,
+            })
+            if cache.fetch(cache_key, output_path):
+                print("✓ Cache hit: reused a stored result")
+                print(f"✓ Saved to: {output_path}")
+                return True
+
+        original_size, final_size = process_image(input_path, output_path, resolved, quality=quality)
+
+        for operation in operations:
+            params = ', '.join(f"{k}={v}" for k, v in operation.items() if k != 'op')
+            print(f"✓ {operation['op']}({params})")
+        print(f"✓ Image processed from {original_size[0]}x{original_size[1]} to {final_size[0]}x{final_size[1]}")
+        if cache_dir:
+            cache.store(cache_key, output_path)
+        print(f"✓ Saved to: {output_path}")
+        return True
+
+    except Exception as e:
+        print(f"✗ Error running pipeline: {e}", file=sys.stderr)
+        return False
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Apply several operations to an image with a single decode and a single encode",
+        epilog="Example: pipeline.py in.jpg out.webp --op crop left=0 top=0 right=800 bottom=600 "
+               "--op resize width=400 --op effects filter_type=SHARPEN --quality 85")
+    parser.add_argument("input", help="Input image path")
+    parser.add_argument("output", help="Output image path (format determined by extension)")
+    add_operation_arguments(parser)
+    parser.add_argument("--cache-dir", help="Reuse results from this cache directory (see result_cache.py)")
+
+    add_profile_argument(parser)
+    args = parser.parse_args()
+    enable_from_args(args)
+
+    try:
+        operations, quality = operations_from_args(args)
+    except (OSError, ValueError) as e:
+        print(f"✗ Error reading operations: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    if not operations:
+        parser.error("No operations given; use --op or --spec")
+
+    success = run_pipeline(args.input, args.output, operations, quality=quality, cache_dir=args.cache_dir)
+
+    sys.exit(0 if success else 1)
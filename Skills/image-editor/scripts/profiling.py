@@ -0,0 +1,406 @@
+#!/usr/bin/env python3
+"""
+Per-stage timing and memory instrumentation for the image-editor scripts.
+
+The scripts wrap each stage of a job (open, decode, every transform, save)
+in stage(). With profiling off this costs one list check; with it on, every
+finished stage produces a record such as:
+
+    {"time": 1760690000.12, "pid": 4242, "script": "resize_image",
+     "stage": "resize_image/resize", "input": "photo.jpg", "ok": true,
+     "wall_seconds": 0.0412, "cpu_seconds": 0.0409, "peak_bytes": 18743296}
+
+- stage: the path of enclosing stages; a parent's times include its children's.
+  Work handed to a thread pool nests under its caller when it is submitted
+  with contextvars.copy_context().run
+- cpu_seconds: process CPU time, so work on helper threads is counted
+- peak_bytes: the highest process memory (RSS) reached during the stage, above
+  its level when the stage began, sampled every few milliseconds (on systems
+  without /proc: the growth of the process's memory high-water mark)
+
+Turn profiling on with --profile FILE on any script, or by setting the
+IMAGE_EDITOR_PROFILE environment variable (batch and worker processes
+inherit it). A FILE ending in .prom receives Prometheus text-format totals per
+script and stage, merged across processes and runs (suitable for
+node_exporter's textfile collector); any other FILE receives JSON lines, and
+'-' writes JSON lines to stderr.
+
+From Python, add_hook(callable) receives every record as a dict:
+
+    import profiling
+    profiling.add_hook(lambda record: metrics.observe(record['stage'], record['wall_seconds']))
+
+Summarize a JSON-lines file per stage, or turn it into Prometheus text:
+
+    python profiling.py profile.jsonl
+    python profiling.py profile.jsonl --prometheus > image_editor.prom
+"""
+from contextlib import contextmanager
+import argparse
+import contextvars
+import functools
+import json
+import multiprocessing.util
+import os
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+PROFILE_ENV = 'IMAGE_EDITOR_PROFILE'
+
+# Seconds between memory samples while a stage runs
+SAMPLE_INTERVAL = 0.002
+
+# Seconds between merges of a process's Prometheus totals into the .prom file
+PROMETHEUS_FLUSH_INTERVAL = 1.0
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+# Prometheus metric name, type, help text and the record field it aggregates
+PROMETHEUS_METRICS = [
+    ('image_editor_stage_runs_total', 'counter', 'Completed runs of each stage', None),
+    ('image_editor_stage_wall_seconds_total', 'counter', 'Wall time spent in each stage', 'wall_seconds'),
+    ('image_editor_stage_cpu_seconds_total', 'counter', 'Process CPU time spent in each stage', 'cpu_seconds'),
+    ('image_editor_stage_peak_bytes', 'gauge', 'Largest memory growth seen within each stage', 'peak_bytes'),
+]
+
+GAUGE_METRICS = {metric for metric, kind, _, _ in PROMETHEUS_METRICS if kind == 'gauge'}
+
+_hooks = []
+_target = None
+_script = None
+_stack = contextvars.ContextVar('profiling_stack', default=())
+
+# Highest memory sampled so far for each running stage, by stage token
+_active = {}
+_active_lock = threading.Lock()
+_busy = threading.Event()
+_sampler_pid = None
+
+def current_rss():
+    """Resident memory of this process in bytes, or None where it cannot be measured."""
+    try:
+        with open('/proc/self/statm', 'rb') as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        pass
+    if resource is not None:
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return max_rss if sys.platform == 'darwin' else max_rss * 1024
+    return None
+
+def _sample():
+    while True:
+        _busy.wait()
+        time.sleep(SAMPLE_INTERVAL)
+        rss = current_rss()
+        if rss is None:
+            continue
+        with _active_lock:
+            for key, peak in _active.items():
+                _active[key] = max(peak, rss)
+
+def _start_sampler():
+    """Start the memory sampler thread (again, in a forked child that lost it)."""
+    global _sampler_pid
+    if _sampler_pid != os.getpid():
+        _sampler_pid = os.getpid()
+        threading.Thread(target=_sample, name='profiling-sampler', daemon=True).start()
+
+def _after_fork():
+    """Give a forked child its own sampler state; the parent's running stages are not its own."""
+    global _active_lock, _busy
+    _active_lock = threading.Lock()
+    _busy = threading.Event()
+    _active.clear()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
+
+def add_hook(hook):
+    """Call hook(record) for every finished stage from now on."""
+    _hooks.append(hook)
+
+def remove_hook(hook):
+    _hooks.remove(hook)
+
+def enabled():
+    return bool(_hooks)
+
+def _emit(record):
+    for hook in list(_hooks):
+        hook(record)
+
+@contextmanager
+def stage(name, **fields):
+    """
+    Measure a block of work as one stage.
+
+    Args:
+        name: Stage name; nested stages are recorded as 'outer/inner'
+        fields: Extra record fields (e.g. input=path), inherited by nested stages
+    """
+    if not _hooks:
+        yield
+        return
+
+    _start_sampler()
+    parents = _stack.get()
+    if parents:
+        path, inherited = parents[-1]
+        path = f"{path}/{name}"
+        fields = {**inherited, **fields}
+    else:
+        path = name
+    token = _stack.set(parents + ((path, fields),))
+
+    start_rss = current_rss()
+    key = object()
+    with _active_lock:
+        _active[key] = start_rss or 0
+        _busy.set()
+
+    ok = False
+    start_wall = time.perf_counter()
+    start_cpu = time.process_time()
+    try:
+        yield
+        ok = True
+    finally:
+        wall = time.perf_counter() - start_wall
+        cpu = time.process_time() - start_cpu
+        _stack.reset(token)
+        end_rss = current_rss()
+        with _active_lock:
+            peak = _active.pop(key)
+            if not _active:
+                _busy.clear()
+
+        record = {'time': round(time.time(), 3), 'pid': os.getpid(), 'script': _script, 'stage': path}
+        record.update((k, v) for k, v in fields.items() if v is not None)
+        record.update({
+            'ok': ok,
+            'wall_seconds': round(wall, 6),
+            'cpu_seconds': round(cpu, 6),
+            'peak_bytes': None if start_rss is None else max(peak, end_rss) - start_rss,
+        })
+        _emit(record)
+
+def profiled(func):
+    """Profile a path function as one stage named after it, tagging its records with the input path."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _hooks:
+            return func(*args, **kwargs)
+        input_path = args[0] if args else kwargs.get('input_path')
+        with stage(func.__name__, input=input_path if isinstance(input_path, str) else None):
+            return func(*args, **kwargs)
+    return wrapper
+
+class JsonLinesSink:
+    """Append each record as one JSON line to a file, or to stderr for '-'."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def __call__(self, record):
+        line = json.dumps(record) + '\n'
+        if self.path == '-':
+            sys.stderr.write(line)
+            return
+        # One O_APPEND write per record keeps lines whole when several processes share the file
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line.encode('utf-8'))
+        finally:
+            os.close(fd)
+
+def _labels(script, stage_path):
+    escape = lambda value: str(value).replace('\\', '\\\\').replace('"', '\\"')
+    return f'script="{escape(script)}",stage="{escape(stage_path)}"'
+
+def accumulate(totals, record):
+    """Add one record to per-(script, stage) totals keyed like Prometheus samples."""
+    labels = _labels(record['script'], record['stage'])
+    for metric, kind, _, field in PROMETHEUS_METRICS:
+        key = (metric, labels)
+        value = 1 if field is None else record.get(field)
+        if value is None:
+            continue
+        if kind == 'gauge':
+            totals[key] = max(totals.get(key, value), value)
+        else:
+            totals[key] = totals.get(key, 0) + value
+
+def parse_prometheus(text):
+    """Read samples written by prometheus_text() back into totals."""
+    totals = {}
+    for line in text.splitlines():
+        if not line or line.startswith('#'):
+            continue
+        sample, value = line.rsplit(' ', 1)
+        metric, labels = sample.split('{', 1)
+        totals[(metric, labels.rstrip('}'))] = float(value)
+    return totals
+
+def prometheus_text(totals):
+    """Format totals in the Prometheus text exposition format."""
+    lines = []
+    for metric, kind, help_text, _ in PROMETHEUS_METRICS:
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} {kind}")
+        for (name, labels), value in sorted(totals.items()):
+            if name == metric:
+                lines.append(f"{metric}{{{labels}}} {value:.6f}".rstrip('0').rstrip('.'))
+    return '\n'.join(lines) + '\n'
+
+class PrometheusSink:
+    """
+    Keep per-stage totals in memory and merge them into a Prometheus text-format file.
+
+    Records are added to this process's totals; the file is rewritten (under a
+    lock shared by all processes) when a job's outermost stage finishes and at
+    least PROMETHEUS_FLUSH_INTERVAL seconds have passed since the last merge,
+    and when the process exits, pool workers included. A forked child starts
+    with empty totals of its own.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._start()
+
+    def _start(self):
+        self.pid = os.getpid()
+        self.totals = {}
+        self.flushed = time.monotonic()
+        # Run at interpreter exit and when a multiprocessing worker exits, which skips atexit
+        multiprocessing.util.Finalize(self, self.flush, exitpriority=10)
+
+    def __call__(self, record):
+        with self._lock:
+            if self.pid != os.getpid():
+                self._start()
+            accumulate(self.totals, record)
+            outermost = '/' not in record['stage']
+        if outermost and time.monotonic() - self.flushed >= PROMETHEUS_FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        """Merge this process's totals into the file and start new ones."""
+        with self._lock:
+            if self.pid != os.getpid() or not self.totals:
+                return
+            pending, self.totals = self.totals, {}
+            self.flushed = time.monotonic()
+        with open(self.path + '.lock', 'a') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            totals = {}
+            if os.path.exists(self.path):
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    totals = parse_prometheus(f.read())
+            for key, value in pending.items():
+                if key[0] in GAUGE_METRICS:
+                    totals[key] = max(totals.get(key, value), value)
+                else:
+                    totals[key] = totals.get(key, 0) + value
+            # Replace atomically so a scraper never reads a half-written file
+            fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(os.path.abspath(self.path)))
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(prometheus_text(totals))
+            os.replace(tmp_path, self.path)
+
+def enable(target, script=None):
+    """
+    Send stage records to a file: Prometheus totals for .prom, JSON lines otherwise, '-' for stderr.
+
+    Processes started afterwards inherit the setting through IMAGE_EDITOR_PROFILE.
+    """
+    global _target, _script
+    if _target == target:
+        return
+    _target = target
+    _script = script or os.path.splitext(os.path.basename(sys.argv[0]))[0] or 'python'
+    add_hook(PrometheusSink(target) if target.endswith('.prom') else JsonLinesSink(target))
+    os.environ[PROFILE_ENV] = target
+
+def enable_from_env():
+    """Enable profiling if IMAGE_EDITOR_PROFILE is set (e.g. in a worker process)."""
+    target = os.environ.get(PROFILE_ENV)
+    if target:
+        enable(target)
+
+def add_profile_argument(parser):
+    """Add the --profile option to a script's argument parser."""
+    parser.add_argument("--profile", metavar="FILE",
+                       help="Record wall time, CPU time and peak memory of every stage: FILE.prom for Prometheus "
+                            f"totals, another FILE for JSON lines, '-' for stderr (or set {PROFILE_ENV})")
+
+def enable_from_args(args):
+    """Enable profiling from a parsed --profile option, falling back to IMAGE_EDITOR_PROFILE."""
+    if getattr(args, 'profile', None):
+        enable(args.profile)
+    else:
+        enable_from_env()
+
+def summarize(records):
+    """
+    Per-stage totals of profiling records.
+
+    Returns:
+        List of dicts (script, stage, runs, wall_seconds, cpu_seconds, peak_bytes), slowest first
+    """
+    rows = {}
+    for record in records:
+        row = rows.setdefault((record['script'], record['stage']), {
+            'script': record['script'], 'stage': record['stage'], 'runs': 0,
+            'wall_seconds': 0.0, 'cpu_seconds': 0.0, 'peak_bytes': None,
+        })
+        row['runs'] += 1
+        row['wall_seconds'] += record['wall_seconds']
+        row['cpu_seconds'] += record['cpu_seconds']
+        if record.get('peak_bytes') is not None:
+            row['peak_bytes'] = max(row['peak_bytes'] or 0, record['peak_bytes'])
+    return sorted(rows.values(), key=lambda row: row['wall_seconds'], reverse=True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize a JSON-lines profile written with --profile")
+    parser.add_argument("profile", help="JSON-lines profile file")
+    parser.add_argument("--prometheus", action="store_true", help="Print Prometheus text-format totals instead")
+
+    args = parser.parse_args()
+
+    try:
+        with open(args.profile, 'r', encoding='utf-8') as f:
+            records = [json.loads(line) for line in f if line.strip()]
+
+        if args.prometheus:
+            totals = {}
+            for record in records:
+                accumulate(totals, record)
+            sys.stdout.write(prometheus_text(totals))
+        else:
+            print(f"{'stage':<50} {'runs':>6} {'wall s':>9} {'cpu s':>9} {'peak MB':>8}")
+            for row in summarize(records):
+                peak = '-' if row['peak_bytes'] is None else f"{row['peak_bytes'] / 1e6:.1f}"
+                stage_name = f"{row['script']}:{row['stage']}"
+                print(f"{stage_name:<50} {row['runs']:>6} {row['wall_seconds']:>9.3f} "
+                      f"{row['cpu_seconds']:>9.3f} {peak:>8}")
+        success = True
+    except Exception as e:
+        print(f"✗ Error reading profile: {e}", file=sys.stderr)
+        success = False
+
+    sys.exit(0 if success else 1)
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""
+Palette quantization for GIF and 8-bit PNG output.
+
+An image is reduced to at most 256 colors with a selectable algorithm
+(median cut, octree, or libimagequant when Pillow is built with it), with or
+without Floyd-Steinberg dithering. Transparent pixels (alpha < 128) get one
+extra palette entry marked transparent, which GIF and PNG both store.
+
+For a batch of similar images (icons, sprites, UI assets) the palette can be
+computed once from a sample of the batch and saved as a palette file: a
+small PNG whose pixels are the colors, in order. Mapping an image onto a
+known palette skips the adaptive quantization of every file, and the
+outputs share their colors:
+
+    python quantize.py 'icons/*.png' icons-palette.png --colors 64
+    python batch_process.py 'icons/*.png' out/ --op quantize palette=icons-palette.png
+
+Palette files are read once per process and kept in memory.
+"""
+from PIL import Image, features
+import argparse
+import os
+import sys
+
+try:
+    from convert_format import has_alpha
+except ImportError:
+    print("Error: 'convert_format.py' not found.", file=sys.stderr)
+    sys.exit(1)
+
+METHODS = {
+    'mediancut': Image.Quantize.MEDIANCUT,
+    'octree': Image.Quantize.FASTOCTREE,
+    'libimagequant': Image.Quantize.LIBIMAGEQUANT,
+}
+
+# Formats that store palette images
+PALETTE_FORMATS = ('GIF', 'PNG')
+
+# Pixels with less alpha than this become the transparent palette entry
+TRANSPARENT_ALPHA = 128
+
+# Images sampled, and the size each is reduced to, when building a shared palette
+PALETTE_SAMPLE_IMAGES = 64
+PALETTE_SAMPLE_SIZE = (64, 64)
+
+# Size a single transparent image is reduced to when choosing its palette
+IMAGE_SAMPLE_SIZE = (512, 512)
+
+# Palette files already read, by (path, mtime, size)
+_palettes = {}
+
+def resolve_method(method='auto'):
+    """
+    Pick the quantization algorithm: 'auto' is libimagequant when available, else median cut.
+
+    Returns:
+        A key of METHODS
+    """
+    available = features.check('libimagequant')
+    if method == 'auto':
+        return 'libimagequant' if available else 'mediancut'
+    if method not in METHODS:
+        raise ValueError(f"Unknown quantization method: {method}. Available: auto, {', '.join(METHODS.keys())}")
+    if method == 'libimagequant' and not available:
+        raise ValueError("This Pillow build has no libimagequant; use mediancut or octree")
+    return method
+
+def check_colors(colors):
+    if not 2 <= colors <= 256:
+        raise ValueError(f"Palette size must be between 2 and 256 colors, got {colors}")
+
+def opaque_sample(img, size):
+    """
+    Raw RGB bytes of the opaque pixels of an image reduced to fit size.
+
+    Nearest-neighbour reduction keeps the exact colors of flat artwork.
+    """
+    sample = img.convert('RGBA')
+    sample.thumbnail(size, Image.Resampling.NEAREST)
+    data = sample.tobytes()
+    return b''.join(data[i:i + 3] for i in range(0, len(data), 4) if data[i + 3] >= TRANSPARENT_ALPHA)
+
+def palette_from_pixels(pixels, colors, method):
+    """
+    Choose up to `colors` colors for raw RGB pixel bytes.
+
+    Returns:
+        List of (r, g, b) tuples; the exact colors if there are few enough
+    """
+    if not pixels:
+        return [(0, 0, 0)]
+    strip = Image.frombytes('RGB', (len(pixels) // 3, 1), pixels)
+    exact = strip.getcolors(colors)
+    if exact is not None:
+        return sorted(color for _, color in exact)
+    palette = strip.quantize(colors=colors, method=METHODS[resolve_method(method)]).getpalette()
+    return [tuple(palette[i:i + 3]) for i in range(0, len(palette), 3)][:colors]
+
+def build_palette(images, colors=256, method='auto'):
+    """
+    Choose one palette for several images from a sample of their opaque pixels.
+
+    Args:
+        images: PIL Images or paths; at most PALETTE_SAMPLE_IMAGES, spread over
+                the list, are sampled
+        colors: Palette size (2-256); use 255 or fewer if the images are
+                transparent, to leave room for the transparent entry
+        method: 'auto', 'mediancut', 'octree' or 'libimagequant'
+
+    Returns:
+        List of (r, g, b) tuples
+    """
+    check_colors(colors)
+    step = max(1, len(images) // PALETTE_SAMPLE_IMAGES)
+    pixels = []
+    for image in images[::step][:PALETTE_SAMPLE_IMAGES]:
+        if isinstance(image, str):
+            with Image.open(image) as img:
+                pixels.append(opaque_sample(img, PALETTE_SAMPLE_SIZE))
+        else:
+            pixels.append(opaque_sample(image, PALETTE_SAMPLE_SIZE))
+    return palette_from_pixels(b''.join(pixels), colors, method)
+
+def save_palette(palette, path):
+    """Write a palette as a PNG with one pixel per color, in order."""
+    swatch = Image.new('RGB', (len(palette), 1))
+    swatch.putdata(palette)
+    swatch.save(path)
+
+def load_palette(path):
+    """
+    Read a palette file (any image of at most 256 pixels, read row by row),
+    once per process.
+
+    Returns:
+        List of (r, g, b) tuples
+    """
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    if key not in _palettes:
+        with Image.open(path) as img:
+            if img.width * img.height > 256:
+                raise ValueError(f"Palette file {path} has {img.width * img.height} pixels; at most 256 colors fit")
+            data = img.convert('RGB').tobytes()
+        _palettes[key] = [tuple(data[i:i + 3]) for i in range(0, len(data), 3)]
+    return _palettes[key]
+
+def inline_palettes(operations):
+    """
+    Replace palette file paths in quantize operations with the palettes' colors.
+
+    Done once before a batch, so worker processes receive the colors instead of
+    each reading the file, and result cache keys follow the palette's contents
+    rather than its path.
+
+    Returns:
+        New list of operation dicts
+    """
+    return [dict(operation, palette=[list(color) for color in load_palette(operation['palette'])])
+            if operation.get('op') == 'quantize' and isinstance(operation.get('palette'), str) else operation
+            for operation in operations]
+
+def palette_image(palette):
+    """P mode image carrying a palette, for Image.quantize(palette=...)."""
+    img = Image.new('P', (1, 1))
+    img.putpalette([value for color in palette for value in color])
+    return img
+
+def quantize(img, colors=256, method='auto', dither=False, palette=None):
+    """
+    Reduce an in-memory image to a palette image.
+
+    Args:
+        img: PIL Image
+        colors: Palette size (2-256) when no palette is given; one entry goes to
+                transparency in transparent images
+        method: 'auto' (libimagequant if available, else median cut),
+                'mediancut', 'octree' or 'libimagequant'
+        dither: Floyd-Steinberg dithering when mapping pixels to the palette
+        palette: Shared palette to map onto instead of choosing one per image:
+                 a palette file path (see save_palette) or a list of (r, g, b);
+                 transparent images use its first 255 colors
+
+    Returns:
+        P mode PIL Image; pixels with alpha below TRANSPARENT_ALPHA use an extra
+        palette entry set as info['transparency']
+    """
+    check_colors(colors)
+    if isinstance(palette, str):
+        palette = load_palette(palette)
+    transparent = has_alpha(img)
+    rgb = img if img.mode == 'RGB' else img.convert('RGB')
+
+    if palette is None:
+        if not transparent:
+            quantized = rgb.quantize(colors=colors, method=METHODS[resolve_method(method)])
+            if not dither:
+                return quantized
+            palette = quantized.getpalette()
+            palette = [tuple(palette[i:i + 3]) for i in range(0, len(palette), 3)]
+        else:
+            palette = palette_from_pixels(opaque_sample(img, IMAGE_SAMPLE_SIZE), colors - 1, method)
+    elif transparent:
+        palette = palette[:255]
+
+    indexed = rgb.quantize(palette=palette_image(palette),
+                           dither=Image.Dither.FLOYDSTEINBERG if dither else Image.Dither.NONE)
+    if transparent:
+        index = len(palette)
+        indexed.putpalette([value for color in palette for value in color] + [0, 0, 0])
+        mask = img.convert('RGBA').getchannel('A').point(lambda a: 255 if a < TRANSPARENT_ALPHA else 0)
+        indexed.paste(index, mask=mask)
+        indexed.info['transparency'] = index
+    return indexed
+
+def build_palette_file(source, palette_path, colors=256, method='auto', recursive=False):
+    """
+    Build a shared palette from a sample of the images matched by a directory or glob.
+
+    Args:
+        source: Input directory, glob pattern or @LIST file
+        palette_path: PNG file to write the palette to
+        colors: Palette size (2-256)
+        method: Quantization method for choosing the colors
+        recursive: Descend into subdirectories when source is a directory
+    """
+    try:
+        from batch_process import collect_inputs
+
+        _, paths = collect_inputs(source, recursive=recursive)
+        if not paths:
+            raise ValueError(f"No images found for: {source}")
+
+        palette = build_palette(paths, colors=colors, method=method)
+        save_palette(palette, palette_path)
+
+        sampled = min(len(paths), PALETTE_SAMPLE_IMAGES)
+        print(f"✓ Built a {len(palette)}-color palette ({resolve_method(method)}) from {sampled} of {len(paths)} images")
+        print(f"✓ Saved to: {palette_path}")
+        return True
+
+    except Exception as e:
+        print(f"✗ Error building palette: {e}", file=sys.stderr)
+        return False
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Build a shared palette for a batch of similar images (use with --palette / quantize palette=)")
+    parser.add_argument("input", help="Input directory, glob pattern or @LIST file")
+    parser.add_argument("palette", help="Palette file to write (PNG)")
+    parser.add_argument("--colors", type=int, default=256,
+                        help="Palette size, 2-256; 255 or fewer leaves room for transparency (default: 256)")
+    parser.add_argument("--method", default="auto", choices=['auto'] + list(METHODS.keys()),
+                        help="Quantization algorithm (default: libimagequant if available, else mediancut)")
+    parser.add_argument("--recursive", action="store_true", help="Include subdirectories of an input directory")
+
+    args = parser.parse_args()
+
+    success = build_palette_file(args.input, args.palette, colors=args.colors, method=args.method,
+                                 recursive=args.recursive)
+
+    sys.exit(0 if success else 1)
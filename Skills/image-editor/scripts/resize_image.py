@@ -1,12 +1,214 @@
 #!/usr/bin/env python3
 """
 Image resizing script with multiple scaling options.
+
+With both a width and a height, --fit cover/contain/fit computes the source
+region from the gravity or focal point and resamples it once, instead of
+cropping to a full-resolution intermediate and resizing that.
 """
-from PIL import Image
+from PIL import Image, ImageColor
 import argparse
 import sys
 
-def resize_image(input_path, output_path, width=None, height=None, scale=None, maintain_aspect=True):
+try:
+    from profiling import add_profile_argument, enable_from_args, profiled, stage
+except ImportError:
+    print("Error: 'profiling.py' not found.", file=sys.stderr)
+    sys.exit(1)
+
+# Quality/speed trade-offs for downscaling, from most exact to fastest.
+# draft: minimum decode size as a multiple of the target size (None disables
+# JPEG DCT scaling); reducing_gap: see Image.resize (None = single LANCZOS pass).
+SPEED_MODES = {
+    'exact': {'draft': None, 'reducing_gap': None},
+    'balanced': {'draft': 2.0, 'reducing_gap': 3.0},
+    'fast': {'draft': 1.0, 'reducing_gap': 2.0},
+}
+
+# How an image is fitted into a width x height box:
+# fill - stretch to exactly the box (may distort)
+# cover - fill the box and cut off what overflows, per the gravity
+# contain - fit inside the box and pad the rest with the background
+# fit - fit inside the box; the result is smaller than the box on one side
+FIT_MODES = ('fill', 'cover', 'contain', 'fit')
+
+# Named gravities as (x, y) fractions of the image
+GRAVITIES = {
+    'center': (0.5, 0.5),
+    'north': (0.5, 0.0),
+    'south': (0.5, 1.0),
+    'east': (1.0, 0.5),
+    'west': (0.0, 0.5),
+    'northeast': (1.0, 0.0),
+    'northwest': (0.0, 0.0),
+    'southeast': (1.0, 1.0),
+    'southwest': (0.0, 1.0),
+}
+
+def parse_gravity(gravity):
+    """
+    Parse a gravity name or an 'X,Y' focal point given as fractions of the image.
+
+    Returns:
+        (x, y) tuple of fractions between 0 and 1
+    """
+    if isinstance(gravity, (list, tuple)):
+        x, y = gravity
+    elif gravity in GRAVITIES:
+        return GRAVITIES[gravity]
+    else:
+        try:
+            x, y = (float(value) for value in str(gravity).split(','))
+        except ValueError:
+            raise ValueError(f"Unknown gravity: {gravity}. Use X,Y fractions or one of: {', '.join(GRAVITIES.keys())}")
+    if not (0 <= x <= 1 and 0 <= y <= 1):
+        raise ValueError(f"Focal point {x},{y} is outside the image; use fractions between 0 and 1")
+    return x, y
+
+def fit_geometry(box, target_size, fit, gravity='center'):
+    """
+    Compute the source region and sizes for fitting part of an image into a box.
+
+    For cover, the region has the target's aspect ratio and is placed so the
+    focal point is as close to its centre as the image edges allow; a named
+    gravity keeps that edge or corner. Coordinates may be fractional.
+
+    Args:
+        box: (left, top, right, bottom) source region to fit
+        target_size: (width, height) of the box
+        fit: One of FIT_MODES
+        gravity: Gravity name or focal point (see parse_gravity)
+
+    Returns:
+        (source region, resized size, (canvas size, offset) or None) tuple; the
+        canvas is only used by contain, which pads the resized image to the box
+    """
+    if fit not in FIT_MODES:
+        raise ValueError(f"Unknown fit: {fit}. Available: {', '.join(FIT_MODES)}")
+    left, top, right, bottom = box
+    source_width, source_height = right - left, bottom - top
+    target_width, target_height = target_size
+    focus_x, focus_y = parse_gravity(gravity)
+
+    if fit == 'fill':
+        return box, target_size, None
+
+    if fit == 'cover':
+        factor = max(target_width / source_width, target_height / source_height)
+        region_width, region_height = target_width / factor, target_height / factor
+        x = min(max(left + focus_x * source_width - region_width / 2, left), right - region_width)
+        y = min(max(top + focus_y * source_height - region_height / 2, top), bottom - region_height)
+        return (x, y, x + region_width, y + region_height), target_size, None
+
+    factor = min(target_width / source_width, target_height / source_height)
+    size = (max(1, min(round(source_width * factor), target_width)),
+            max(1, min(round(source_height * factor), target_height)))
+    if fit == 'fit':
+        return box, size, None
+    offset = (round((target_width - size[0]) * focus_x), round((target_height - size[1]) * focus_y))
+    return box, size, (target_size, offset)
+
+def pad_to_canvas(img, canvas_size, offset, background=None):
+    """Paste an image onto a canvas filled with background (default: transparent or black)."""
+    if img.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+        img = img.convert('RGBA')
+    if background is None:
+        fill = 0
+    else:
+        fill = ImageColor.getcolor(background, img.mode)
+        if img.mode in ('RGB', 'L') and ImageColor.getcolor(background, 'RGBA')[3] < 255:
+            img = img.convert('RGBA' if img.mode == 'RGB' else 'LA')
+            fill = ImageColor.getcolor(background, img.mode)
+    canvas = Image.new(img.mode, canvas_size, fill)
+    canvas.paste(img, offset)
+    return canvas
+
+def compute_size(original_size, width=None, height=None, scale=None, maintain_aspect=True):
+    """
+    Compute the target size for a resize.
+
+    Args:
+        original_size: (width, height) of the source image
+        width: Target width in pixels
+        height: Target height in pixels
+        scale: Scale factor (e.g., 0.5 for 50%, 2.0 for 200%)
+        maintain_aspect: Whether to maintain aspect ratio
+
+    Returns:
+        (new_width, new_height) tuple
+    """
+    original_width, original_height = original_size
+
+    if scale:
+        new_width = int(original_width * scale)
+        new_height = int(original_height * scale)
+    elif width and height:
+        new_width = width
+        new_height = height
+    elif width:
+        new_width = width
+        new_height = int(original_height * (width / original_width)) if maintain_aspect else original_height
+    elif height:
+        new_height = height
+        new_width = int(original_width * (height / original_height)) if maintain_aspect else original_width
+    else:
+        raise ValueError("Must specify width, height, or scale")
+
+    return new_width, new_height
+
+def resize(img, width=None, height=None, scale=None, maintain_aspect=True, speed='balanced', fit=None,
+           gravity='center', background=None, box=None):
+    """
+    Resize an in-memory image. See resize_image() for the arguments.
+
+    When downscaling an image that has not been loaded yet, the JPEG decoder
+    is asked for a reduced-resolution draft, so only the DCT coefficients
+    needed for the smaller size are decoded. A source region (from box or a
+    cover fit) is resampled directly, without an intermediate crop.
+
+    Returns:
+        The resized PIL Image
+    """
+    if speed not in SPEED_MODES:
+        raise ValueError(f"Unknown speed: {speed}. Available: {', '.join(SPEED_MODES.keys())}")
+    mode = SPEED_MODES[speed]
+
+    full_size = img.size
+    source = tuple(box) if box else (0, 0) + full_size
+    if not (0 <= source[0] < source[2] <= full_size[0] and 0 <= source[1] < source[3] <= full_size[1]):
+        raise ValueError(f"Box {source} is outside the {full_size[0]}x{full_size[1]} image")
+
+    canvas = None
+    if fit:
+        if not (width and height):
+            raise ValueError("fit needs both a width and a height")
+        region, new_size, canvas = fit_geometry(source, (width, height), fit, gravity=gravity)
+    else:
+        region = source
+        new_size = compute_size((source[2] - source[0], source[3] - source[1]), width=width, height=height,
+                                scale=scale, maintain_aspect=maintain_aspect)
+
+    region_width, region_height = region[2] - region[0], region[3] - region[1]
+    if mode['draft'] and new_size[0] < region_width and new_size[1] < region_height:
+        # No-op for already loaded images and for formats without draft support
+        img.draft(img.mode, (int(new_size[0] * mode['draft'] * full_size[0] / region_width),
+                             int(new_size[1] * mode['draft'] * full_size[1] / region_height)))
+        if img.size != full_size:
+            x_scale, y_scale = img.width / full_size[0], img.height / full_size[1]
+            region = (region[0] * x_scale, region[1] * y_scale, region[2] * x_scale, region[3] * y_scale)
+
+    # Decode here (at the draft size, if any) so a profile separates decoding from resampling
+    with stage('decode'):
+        img.load()
+
+    resized = img.resize(new_size, Image.Resampling.LANCZOS, box=region, reducing_gap=mode['reducing_gap'])
+    if canvas:
+        resized = pad_to_canvas(resized, *canvas, background=background)
+    return resized
+
+@profiled
+def resize_image(input_path, output_path, width=None, height=None, scale=None, maintain_aspect=True,
+                 speed='balanced', fit=None, gravity='center', background=None, box=None, cache_dir=None):
     """
     Resize an image with various options.
 
@@ -17,30 +219,55 @@ def resize_image(input_path, output_path, width=None, height=None, scale=None, m
         height: Target height in pixels
         scale: Scale factor (e.g., 0.5 for 50%, 2.0 for 200%)
         maintain_aspect: Whether to maintain aspect ratio
+        speed: Downscaling strategy: 'exact' (full decode, single LANCZOS pass),
+               'balanced' (reduced-resolution decode kept at >=2x the target,
+               then reduce + LANCZOS) or 'fast' (decode close to the target size)
+        fit: With width and height, how to fit the image into them: 'fill' (stretch),
+             'cover' (fill and crop), 'contain' (fit inside and pad) or 'fit' (fit inside)
+        gravity: Part of the image kept by cover, and placement for contain: 'center',
+                 'north', 'southeast' etc., or an 'X,Y' focal point as fractions (e.g. '0.3,0.4')
+        background: Padding color for contain (default: transparent, or black without alpha)
+        box: (left, top, right, bottom) source region to resize, instead of the whole image
+        cache_dir: Result cache directory (see result_cache.py); a repeat run on the same
+                   input bytes with the same parameters reuses the stored output
     """
     try:
-        img = Image.open(input_path)
+        if cache_dir:
+            from result_cache import ResultCache
+            cache = ResultCache(cache_dir)
+            cache_key = cache.key(input_path, output_path, 'resize', {
+                'width': width, 'height': height, 'scale': scale,
+                'maintain_aspect': maintain_aspect, 'speed': speed,
+                'fit': fit, 'gravity': gravity, 'background': background, 'box': list(box) if box else None,
+            })
+            if cache.fetch(cache_key, output_path):
+                print("✓ Cache hit: reused a stored result")
+                print(f"✓ Saved to: {output_path}")
+                return True
+
+        with stage('open'):
+            img = Image.open(input_path)
         original_width, original_height = img.size
 
-        if scale:
-            new_width = int(original_width * scale)
-            new_height = int(original_height * scale)
-        elif width and height:
-            new_width = width
-            new_height = height
-        elif width:
-            new_width = width
-            new_height = int(original_height * (width / original_width)) if maintain_aspect else original_height
-        elif height:
-            new_height = height
-            new_width = int(original_width * (height / original_height)) if maintain_aspect else original_width
-        else:
-            raise ValueError("Must specify width, height, or scale")
+        options = dict(width=width, height=height, scale=scale, maintain_aspect=maintain_aspect, speed=speed,
+                       fit=fit, gravity=gravity, background=background, box=box)
 
-        resized_img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-        resized_img.save(output_path)
+        from animation import animated_output, process_animation
+        if animated_output(img, output_path):
+            with stage('animation'):
+                frame_count, (new_width, new_height) = process_animation(
+                    img, output_path, lambda frame: resize(frame, **options))
+            print(f"✓ Processed {frame_count} animation frames")
+        else:
+            with stage('resize'):
+                resized_img = resize(img, **options)
+            with stage('save'):
+                resized_img.save(output_path)
+            new_width, new_height = resized_img.size
 
         print(f"✓ Image resized from {original_width}x{original_height} to {new_width}x{new_height}")
+        if cache_dir:
+            cache.store(cache_key, output_path)
         print(f"✓ Saved to: {output_path}")
         return True
 
@@ -56,8 +283,22 @@ if __name__ == "__main__":
     parser.add_argument("--height", type=int, help="Target height in pixels")
     parser.add_argument("--scale", type=float, help="Scale factor (e.g., 0.5 or 2.0)")
     parser.add_argument("--no-aspect", action="store_true", help="Don't maintain aspect ratio")
+    parser.add_argument("--speed", choices=list(SPEED_MODES.keys()), default="balanced",
+                       help="Downscaling quality/speed trade-off (default: balanced)")
+    parser.add_argument("--fit", choices=FIT_MODES,
+                       help="With --width and --height: fill (stretch), cover (fill and crop), "
+                            "contain (fit and pad) or fit (fit inside)")
+    parser.add_argument("--gravity", default="center",
+                       help="Part kept by cover / placement for contain: center, north, southeast etc., "
+                            "or an X,Y focal point as fractions (default: center)")
+    parser.add_argument("--background", help="Padding color for --fit contain (default: transparent or black)")
+    parser.add_argument("--box", type=int, nargs=4, metavar=("LEFT", "TOP", "RIGHT", "BOTTOM"),
+                       help="Resize only this region of the source, without an intermediate crop")
+    parser.add_argument("--cache-dir", help="Reuse results from this cache directory (see result_cache.py)")
 
+    add_profile_argument(parser)
     args = parser.parse_args()
+    enable_from_args(args)
 
     success = resize_image(
         args.input,
@@ -65,7 +306,13 @@ if __name__ == "__main__":
         width=args.width,
         height=args.height,
         scale=args.scale,
-        maintain_aspect=not args.no_aspect
+        maintain_aspect=not args.no_aspect,
+        speed=args.speed,
+        fit=args.fit,
+        gravity=args.gravity,
+        background=args.background,
+        box=args.box,
+        cache_dir=args.cache_dir
     )
 
     sys.exit(0 if success else 1)
@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+"""
+Content-addressed on-disk cache of image-editor results.
+
+A result is keyed by a hash of the input file's bytes, the operation name,
+its normalized parameters, the output format and the Pillow version, so a
+repeated run (retry, re-deploy, duplicate upload) turns into a file copy or
+hardlink instead of a decode, transform and encode.
+
+Layout of a cache directory:
+    objects/ab/abcdef....<ext>   cached output files
+    stats.json                   persistent hit/miss/store/eviction counters
+    stats.lock                   lock file guarding stats.json
+
+Entries are evicted least-recently-used first (by mtime, which is bumped on
+every hit) once the directory grows past its size limit.
+"""
+from PIL import __version__ as PILLOW_VERSION
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: stats updates are best-effort without a lock
+    fcntl = None
+
+# Bump when a change to the scripts alters their output for the same parameters
+CACHE_VERSION = 2
+
+DEFAULT_MAX_MB = 1024
+
+# Eviction trims the cache to this fraction of the limit so it does not run on every store
+EVICT_TO = 0.9
+
+COUNTERS = ('hits', 'misses', 'stores', 'evictions')
+
+def file_digest(path, chunk_size=1 << 20):
+    """SHA-256 of a file's contents, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def normalize(value):
+    """Normalize parameters so equivalent calls hash the same (e.g. 400 and 400.0)."""
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, dict):
+        return {str(k): normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [normalize(v) for v in value]
+    return value
+
+def output_extension(output_path):
+    """Lower-case output extension, with .jpeg folded into .jpg."""
+    ext = os.path.splitext(output_path)[1].lower()
+    return '.jpg' if ext == '.jpeg' else ext
+
+class ResultCache:
+    """
+    Size-bounded LRU cache of output files keyed by input content and parameters.
+
+    Args:
+        cache_dir: Directory holding the cache (created if missing)
+        max_mb: Size limit in MB (default: $IMAGE_EDITOR_CACHE_MB or 1024)
+        link: Hardlink hits into place instead of copying them (default: on when
+              $IMAGE_EDITOR_CACHE_LINK=1). Faster, but the output then shares its
+              inode with the cache entry, so it must not be modified in place.
+    """
+
+    def __init__(self, cache_dir, max_mb=None, link=None):
+        self.cache_dir = cache_dir
+        self.objects_dir = os.path.join(cache_dir, 'objects')
+        if max_mb is None:
+            max_mb = float(os.environ.get('IMAGE_EDITOR_CACHE_MB', DEFAULT_MAX_MB))
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        if link is None:
+            link = os.environ.get('IMAGE_EDITOR_CACHE_LINK') == '1'
+        self.link = link
+        # Counters for this process; the persistent totals live in stats.json
+        self.counts = dict.fromkeys(COUNTERS, 0)
+        self._total_bytes = None
+        os.makedirs(self.objects_dir, exist_ok=True)
+
+    def key(self, input_path, output_path, operation, params):
+        """
+        Cache key for running operation with params on input_path.
+
+        Args:
+            input_path: Path to the input image (its bytes are hashed, not its name)
+            output_path: Output path; only its extension (the format) is used
+            operation: Operation name, e.g. 'resize'
+            params: Dict of every parameter that affects the output
+
+        Returns:
+            Hex digest string
+        """
+        description = json.dumps({
+            'version': CACHE_VERSION,
+            'pillow': PILLOW_VERSION,
+            'input': file_digest(input_path),
+            'operation': operation,
+            'params': normalize(params),
+            'format': output_extension(output_path),
+        }, sort_keys=True)
+        return hashlib.sha256(description.encode('utf-8')).hexdigest()
+
+    def _entry_path(self, key, output_path):
+        return os.path.join(self.objects_dir, key[:2], key + output_extension(output_path))
+
+    def fetch(self, key, output_path):
+        """
+        Write the cached result for key to output_path, if there is one.
+
+        Returns:
+            True on a hit, False on a miss
+        """
+        entry = self._entry_path(key, output_path)
+        if not os.path.exists(entry):
+            self._count('misses')
+            return False
+
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(os.path.abspath(output_path)))
+        os.close(fd)
+        try:
+            if self.link:
+                os.remove(tmp_path)
+                try:
+                    os.link(entry, tmp_path)
+                except OSError:
+                    # Different filesystem or no hardlink support
+                    shutil.copyfile(entry, tmp_path)
+            else:
+                shutil.copyfile(entry, tmp_path)
+            os.replace(tmp_path, output_path)
+        except FileNotFoundError:
+            # Evicted by another process between the check and the copy
+            self._count('misses')
+            return False
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        try:
+            os.utime(entry)
+        except OSError:
+            pass
+        self._count('hits')
+        return True
+
+    def store(self, key, output_path):
+        """Copy a freshly written output into the cache under key."""
+        size = os.path.getsize(output_path)
+        if size > self.max_bytes:
+            return
+
+        entry = self._entry_path(key, output_path)
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(entry))
+        os.close(fd)
+        try:
+            shutil.copyfile(output_path, tmp_path)
+            os.replace(tmp_path, entry)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        self._count('stores')
+        if self._total_bytes is None:
+            self._total_bytes = sum(size for _, size, _ in self._entries())
+        else:
+            self._total_bytes += size
+        if self._total_bytes > self.max_bytes:
+            self.prune()
+
+    def _entries(self):
+        """(path, size, mtime) for every cached file."""
+        entries = []
+        for root, _, files in os.walk(self.objects_dir):
+            for name in files:
+                if name.endswith('.tmp'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((path, st.st_size, st.st_mtime))
+        return entries
+
+    def prune(self, max_bytes=None):
+        """
+        Evict least-recently-used entries until the cache fits max_bytes.
+
+        When called for the configured limit, the cache is trimmed a little
+        further (to EVICT_TO of the limit) so the next few stores do not
+        trigger another scan.
+
+        Returns:
+            Number of entries evicted
+        """
+        target = max_bytes if max_bytes is not None else int(self.max_bytes * EVICT_TO)
+        entries = sorted(self._entries(), key=lambda e: e[2])
+        total = sum(size for _, size, _ in entries)
+
+        evicted = 0
+        for path, size, _ in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            evicted += 1
+
+        self._total_bytes = total
+        if evicted:
+            self._count('evictions', evicted)
+        return evicted
+
+    def clear(self):
+        """Remove every entry and reset the persistent counters."""
+        shutil.rmtree(self.objects_dir, ignore_errors=True)
+        os.makedirs(self.objects_dir, exist_ok=True)
+        self._total_bytes = 0
+        with self._locked():
+            self._write_stats(dict.fromkeys(COUNTERS, 0))
+
+    def stats(self):
+        """
+        Persistent counters plus the current number of entries and their size.
+
+        Returns:
+            Dict with hits, misses, stores, evictions, hit_rate, entries, bytes
+        """
+        with self._locked():
+            totals = self._read_stats()
+        entries = self._entries()
+        lookups = totals['hits'] + totals['misses']
+        return {
+            **totals,
+            'hit_rate': round(totals['hits'] / lookups, 4) if lookups else None,
+            'entries': len(entries),
+            'bytes': sum(size for _, size, _ in entries),
+            'max_bytes': self.max_bytes,
+        }
+
+    def _count(self, counter, amount=1):
+        self.counts[counter] += amount
+        with self._locked():
+            totals = self._read_stats()
+            totals[counter] += amount
+            self._write_stats(totals)
+
+    def _locked(self):
+        return _StatsLock(os.path.join(self.cache_dir, 'stats.lock'))
+
+    def _read_stats(self):
+        try:
+            with open(os.path.join(self.cache_dir, 'stats.json'), 'r', encoding='utf-8') as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            stored = {}
+        return {c: int(stored.get(c, 0)) for c in COUNTERS}
+
+    def _write_stats(self, totals):
+        path = os.path.join(self.cache_dir, 'stats.json')
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=self.cache_dir)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(totals, f)
+        os.replace(tmp_path, path)
+
+class _StatsLock:
+    """Exclusive lock on the stats file, so concurrent batch workers don't lose counts."""
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = None
+
+    def __enter__(self):
+        if fcntl is not None:
+            self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if self.fd is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+            os.close(self.fd)
+            self.fd = None
+
+def show_cache(cache_dir, prune_mb=None, clear=False):
+    """
+    Print cache statistics, optionally pruning or clearing it first.
+
+    Args:
+        cache_dir: Cache directory
+        prune_mb: Evict least-recently-used entries until the cache fits this many MB
+        clear: Remove every entry and reset the counters
+    """
+    try:
+        cache = ResultCache(cache_dir)
+
+        if clear:
+            cache.clear()
+            print(f"✓ Cleared cache: {cache_dir}")
+        elif prune_mb is not None:
+            evicted = cache.prune(int(prune_mb * 1024 * 1024))
+            print(f"✓ Evicted {evicted} entries")
+
+        stats = cache.stats()
+        hit_rate = f"{stats['hit_rate']:.1%}" if stats['hit_rate'] is not None else "n/a"
+        print(f"✓ Entries: {stats['entries']} ({stats['bytes'] / (1024 * 1024):.1f}MB "
+              f"of {stats['max_bytes'] / (1024 * 1024):.1f}MB)")
+        print(f"✓ Hits: {stats['hits']}, misses: {stats['misses']} (hit rate {hit_rate})")
+        print(f"✓ Stores: {stats['stores']}, evictions: {stats['evictions']}")
+        return True
+
+    except Exception as e:
+        print(f"✗ Error reading cache: {e}", file=sys.stderr)
+        return False
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show, prune or clear an image-editor result cache")
+    parser.add_argument("cache_dir", help="Cache directory (as passed to --cache-dir)")
+    parser.add_argument("--prune", type=float, metavar="MB", help="Evict least-recently-used entries down to MB")
+    parser.add_argument("--clear", action="store_true", help="Remove every entry and reset the counters")
+
+    args = parser.parse_args()
+
+    success = show_cache(args.cache_dir, prune_mb=args.prune, clear=args.clear)
+
+    sys.exit(0 if success else 1)
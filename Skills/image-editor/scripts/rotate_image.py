@@ -6,7 +6,67 @@ from PIL import Image
 import argparse
 import sys
 
-def rotate_image(input_path, output_path, angle=0, flip_horizontal=False, flip_vertical=False, expand=True):
+try:
+    from profiling import add_profile_argument, enable_from_args, profiled, stage
+except ImportError:
+    print("Error: 'profiling.py' not found.", file=sys.stderr)
+    sys.exit(1)
+
+def rotate(img, angle=0, flip_horizontal=False, flip_vertical=False, expand=True):
+    """
+    Rotate and/or flip an in-memory image. See rotate_image() for the arguments.
+
+    Returns:
+        The transformed PIL Image
+    """
+    # Apply flips first
+    if flip_horizontal:
+        img = img.transpose(Image.Transpose.FLIP_LEFT_RIGHT)
+
+    if flip_vertical:
+        img = img.transpose(Image.Transpose.FLIP_TOP_BOTTOM)
+
+    # Apply rotation
+    if angle != 0:
+        img = img.rotate(angle, expand=expand, resample=Image.Resampling.BICUBIC)
+
+    return img
+
+def as_transpose(angle=0, flip_horizontal=False, flip_vertical=False, expand=True):
+    """
+    Express a rotate() call as a single lossless Image.transpose method.
+
+    Only right-angle rotations (with expand, unless the angle is 0 or 180)
+    and flips qualify.
+
+    Returns:
+        An Image.Transpose member, or None if the transform is the identity
+
+    Raises:
+        ValueError: If the transform needs resampling
+    """
+    if angle % 90 != 0:
+        raise ValueError(f"Rotation by {angle}° is not a right angle")
+    if angle % 180 != 0 and not expand:
+        raise ValueError("Right-angle rotation without expand changes the canvas")
+
+    # Apply the transform to a small asymmetric probe and find the matching transpose
+    probe = Image.new('L', (2, 3))
+    probe.putdata(range(6))
+    result = rotate(probe, angle=angle, flip_horizontal=flip_horizontal,
+                    flip_vertical=flip_vertical, expand=expand)
+
+    if result.size == probe.size and result.tobytes() == probe.tobytes():
+        return None
+    for method in Image.Transpose:
+        candidate = probe.transpose(method)
+        if candidate.size == result.size and candidate.tobytes() == result.tobytes():
+            return method
+    raise ValueError("Transform is not a transpose")
+
+@profiled
+def rotate_image(input_path, output_path, angle=0, flip_horizontal=False, flip_vertical=False, expand=True,
+                 tiled=False, memory_budget_mb=None, lossless=True, cache_dir=None):
     """
     Rotate and/or flip an image.
 
@@ -17,25 +77,82 @@ def rotate_image(input_path, output_path, angle=0, flip_horizontal=False, flip_v
         flip_horizontal: Whether to flip horizontally
         flip_vertical: Whether to flip vertically
         expand: Whether to expand image to fit rotated content
+        tiled: Process the image in strips and stream a TIFF to disk, keeping
+               memory within memory_budget_mb (right angles and flips only)
+        memory_budget_mb: Peak memory budget for tiled mode in MB (default: 256)
+        lossless: For JPEG to JPEG right-angle rotations and flips, transform
+                  the DCT data with jpegtran instead of re-encoding (falls back
+                  to the pixel path when jpegtran is missing or the image size
+                  is not a multiple of the MCU size)
+        cache_dir: Result cache directory (see result_cache.py); a repeat run on the same
+                   input bytes with the same parameters reuses the stored output
     """
     try:
-        img = Image.open(input_path)
+        if cache_dir:
+            from result_cache import ResultCache
+            cache = ResultCache(cache_dir)
+            cache_key = cache.key(input_path, output_path, 'rotate', {
+                'angle': angle, 'flip_horizontal': flip_horizontal, 'flip_vertical': flip_vertical,
+                'expand': expand, 'tiled': tiled, 'lossless': lossless,
+            })
+            if cache.fetch(cache_key, output_path):
+                print("✓ Cache hit: reused a stored result")
+                print(f"✓ Saved to: {output_path}")
+                return True
+
+        lossless_done = False
+        img = None
+        if tiled:
+            from tiling import tiled_transpose
+            method = as_transpose(angle, flip_horizontal, flip_vertical, expand)
+            if method is None:
+                raise ValueError("Nothing to do: the transform is the identity")
+            with stage('tiled'):
+                tiled_transpose(input_path, output_path, method, memory_budget_mb=memory_budget_mb)
+        else:
+            if lossless:
+                from lossless_jpeg import lossless_transpose
+                try:
+                    method = as_transpose(angle, flip_horizontal, flip_vertical, expand)
+                    with stage('lossless'):
+                        lossless_done = lossless_transpose(input_path, output_path, method)
+                except ValueError:
+                    pass  # Needs resampling
+
+            if not lossless_done:
+                with stage('open'):
+                    img = Image.open(input_path)
+                from animation import animated_output, process_animation
+                if animated_output(img, output_path):
+                    with stage('animation'):
+                        frame_count, _ = process_animation(
+                            img, output_path, lambda frame: rotate(frame, angle=angle, flip_horizontal=flip_horizontal,
+                                                                   flip_vertical=flip_vertical, expand=expand))
+                    print(f"✓ Processed {frame_count} animation frames")
+                    img = None
+                else:
+                    with stage('decode'):
+                        img.load()
+                    with stage('rotate'):
+                        img = rotate(img, angle=angle, flip_horizontal=flip_horizontal,
+                                     flip_vertical=flip_vertical, expand=expand)
 
-        # Apply flips first
         if flip_horizontal:
-            img = img.transpose(Image.Transpose.FLIP_LEFT_RIGHT)
             print("✓ Flipped horizontally")
 
         if flip_vertical:
-            img = img.transpose(Image.Transpose.FLIP_TOP_BOTTOM)
             print("✓ Flipped vertically")
 
-        # Apply rotation
         if angle != 0:
-            img = img.rotate(angle, expand=expand, resample=Image.Resampling.BICUBIC)
             print(f"✓ Rotated {angle}°")
 
-        img.save(output_path)
+        if lossless_done:
+            print("✓ Lossless JPEG transform (no re-encode)")
+        elif img is not None:
+            with stage('save'):
+                img.save(output_path)
+        if cache_dir:
+            cache.store(cache_key, output_path)
         print(f"✓ Saved to: {output_path}")
         return True
 
@@ -51,8 +168,16 @@ if __name__ == "__main__":
     parser.add_argument("--flip-h", action="store_true", help="Flip horizontally")
     parser.add_argument("--flip-v", action="store_true", help="Flip vertically")
     parser.add_argument("--no-expand", action="store_true", help="Don't expand canvas to fit rotation")
+    parser.add_argument("--tiled", action="store_true",
+                       help="Process in strips with bounded memory (right angles and flips only; writes TIFF)")
+    parser.add_argument("--memory-budget", type=float, help="Peak memory budget for --tiled in MB (default: 256)")
+    parser.add_argument("--no-lossless", action="store_true",
+                       help="Always re-encode, even when a lossless JPEG transform is possible")
+    parser.add_argument("--cache-dir", help="Reuse results from this cache directory (see result_cache.py)")
 
+    add_profile_argument(parser)
     args = parser.parse_args()
+    enable_from_args(args)
 
     success = rotate_image(
         args.input,
@@ -60,7 +185,11 @@ if __name__ == "__main__":
         angle=args.angle,
         flip_horizontal=args.flip_h,
         flip_vertical=args.flip_v,
-        expand=not args.no_expand
+        expand=not args.no_expand,
+        tiled=args.tiled,
+        memory_budget_mb=args.memory_budget,
+        lossless=not args.no_lossless,
+        cache_dir=args.cache_dir
     )
 
     sys.exit(0 if success else 1)
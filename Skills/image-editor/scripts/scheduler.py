@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""
+Memory-budget-aware admission of batch jobs.
+
+A job's decoded size (width x height x bytes per pixel) is known from its
+header before any pixel data is read, and each pipeline operation's working
+set follows from it: a resize holds the decoded source and the result, a
+rotation with expand=True allocates the bounding box of the rotated image,
+and so on. estimate_peak() walks a job's operations to find the largest
+amount of image data it holds at once.
+
+MemoryScheduler starts jobs only while the estimates of the jobs running
+stay under a RAM budget. The largest waiting job goes first; while it waits
+for memory to free up, smaller jobs that fit are started around it to keep
+the workers busy, up to one round per worker so it is not starved.
+
+Used by batch_process.py (--memory-budget).
+"""
+from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
+import bisect
+import math
+import sys
+
+try:
+    from animation import ANIMATED_FORMATS
+    from convert_format import ENCODER_MODES, format_from_path
+    from resize_image import SPEED_MODES, compute_size, fit_geometry
+    from tiling import bytes_per_pixel
+except ImportError as e:
+    print(f"Error: sibling script not found ({e}).", file=sys.stderr)
+    sys.exit(1)
+
+# Decoder and encoder buffers, font and palette tables etc. of one job
+JOB_OVERHEAD_BYTES = 16 * 2**20
+
+# float32 copies of the image the numpy effects engine holds at once
+NUMPY_COPIES = 3
+
+# Modes Pillow premultiplies into a temporary copy before resampling
+PREMULTIPLIED_MODES = ('RGBA', 'LA')
+
+# JPEG DCT scaling factors available to Image.draft()
+DRAFT_SCALES = (1, 2, 4, 8)
+
+# Threads used to read headers
+HEADER_WORKERS = 16
+
+def image_bytes(size, mode):
+    """Decoded size in bytes of an image of the given size and mode."""
+    return size[0] * size[1] * bytes_per_pixel(mode)
+
+def draft_size(size, target, factor):
+    """Size a JPEG is decoded at when resize() asks for a draft of at least factor x target."""
+    wanted = (int(target[0] * factor), int(target[1] * factor))
+    scale = 1
+    for candidate in DRAFT_SCALES:
+        if math.ceil(size[0] / candidate) >= wanted[0] and math.ceil(size[1] / candidate) >= wanted[1]:
+            scale = candidate
+    return math.ceil(size[0] / scale), math.ceil(size[1] / scale)
+
+def rotated_size(size, angle, expand=True):
+    """Size of an image after Image.rotate()."""
+    if not expand or angle % 180 == 0:
+        return size
+    if angle % 90 == 0:
+        return size[1], size[0]
+    radians = math.radians(angle)
+    cos, sin = abs(math.cos(radians)), abs(math.sin(radians))
+    return math.ceil(size[0] * cos + size[1] * sin), math.ceil(size[0] * sin + size[1] * cos)
+
+def operation_peak(size, mode, operation, loaded=True, image_format=None):
+    """
+    Estimate the image data one pipeline operation holds at once.
+
+    Args:
+        size: (width, height) of the operation's input
+        mode: Mode of the operation's input
+        operation: Operation dict ({'op': name, **params}, see pipeline.py)
+        loaded: Whether the input is already decoded (a first resize decodes it itself)
+        image_format: Format of the source file, for JPEG draft decoding
+
+    Returns:
+        (peak bytes, output size, output mode) tuple
+    """
+    name = operation['op']
+    params = {k: v for k, v in operation.items() if k != 'op'}
+    before = image_bytes(size, mode)
+
+    if name == 'resize':
+        region = tuple(params.get('box') or (0, 0) + tuple(size))
+        canvas = None
+        if params.get('fit'):
+            region, new_size, canvas = fit_geometry(region, (params['width'], params['height']), params['fit'],
+                                                    gravity=params.get('gravity', 'center'))
+        else:
+            new_size = compute_size((region[2] - region[0], region[3] - region[1]), width=params.get('width'),
+                                    height=params.get('height'), scale=params.get('scale'),
+                                    maintain_aspect=params.get('maintain_aspect', True))
+        region_width, region_height = region[2] - region[0], region[3] - region[1]
+        factor = SPEED_MODES.get(params.get('speed', 'balanced'), {}).get('draft')
+        if (not loaded and factor and image_format == 'JPEG'
+                and new_size[0] < region_width and new_size[1] < region_height):
+            # The whole image is decoded at the scale that keeps the region large enough
+            wanted = (new_size[0] * size[0] / region_width, new_size[1] * size[1] / region_height)
+            before = image_bytes(draft_size(size, wanted, factor), mode)
+        # Source, result, and reduce()'s intermediate of at most a quarter of the source
+        after = image_bytes(new_size, mode)
+        premultiplied = before if mode in PREMULTIPLIED_MODES else 0
+        if canvas:
+            # contain pads the result onto a canvas of the full target size
+            new_size = canvas[0]
+            after += image_bytes(new_size, mode)
+        return before + after + (before // 4) + premultiplied, new_size, mode
+
+    if name == 'rotate':
+        new_size = rotated_size(size, params.get('angle', 0), params.get('expand', True))
+        # The source stays referenced by the pipeline while flips and the rotation each make a copy
+        flips = bool(params.get('flip_horizontal')) + bool(params.get('flip_vertical'))
+        after = image_bytes(new_size, mode)
+        premultiplied = before + after if mode in PREMULTIPLIED_MODES and params.get('angle', 0) % 90 else 0
+        return before * (1 + flips) + after + premultiplied, new_size, mode
+
+    if name == 'crop':
+        new_size = (max(params['right'] - params['left'], 0), max(params['bottom'] - params['top'], 0))
+        return before + image_bytes(new_size, mode), new_size, mode
+
+    if name == 'watermark':
+        # A full-size copy; modes other than RGB and RGBA are converted to RGBA
+        new_mode = mode if mode in ('RGB', 'RGBA') else 'RGBA'
+        return before + image_bytes(size, new_mode), size, new_mode
+
+    if name == 'adjust':
+        # Fused into one pass over a copy, or enhanced one factor at a time
+        return before * 2, size, mode
+
+    if name == 'effects':
+        peak = before * 2
+        if params.get('engine') == 'numpy':
+            peak += NUMPY_COPIES * size[0] * size[1] * Image.getmodebands(mode) * 4
+        if params.get('threads', 1) != 1:
+            # Bands with their halos, filtered before being pasted into the result
+            peak += before
+        return peak, size, mode
+
+    if name == 'quantize':
+        # An RGB copy of other modes, and the 8-bit indexed result
+        rgb = image_bytes(size, 'RGB') if mode != 'RGB' else 0
+        return before + rgb + image_bytes(size, 'P'), size, 'P'
+
+    return before * 2, size, mode
+
+def estimate_peak(path, operations, output_path=None):
+    """
+    Estimate the peak image memory of running a pipeline on one file, from its header.
+
+    Args:
+        path: Input image path
+        operations: Operation dicts (see pipeline.py)
+        output_path: Output path; an animated input written to GIF, WebP or PNG
+                     has every frame processed (see animation.py)
+
+    Returns:
+        Estimated peak bytes, including JOB_OVERHEAD_BYTES
+    """
+    with Image.open(path) as img:
+        size, mode, image_format = img.size, img.mode, img.format
+        frames = 1
+        if getattr(img, 'is_animated', False) and output_path and format_from_path(output_path) in ANIMATED_FORMATS:
+            frames = img.n_frames
+
+    if frames > 1:
+        mode = 'RGBA'
+
+    frame_bytes = resident = image_bytes(size, mode)
+    loaded = not operations or operations[0]['op'] != 'resize'
+    # A first resize decodes the image itself, possibly at a reduced size
+    peak = resident if loaded else 0
+    for operation in operations:
+        transient, size, mode = operation_peak(size, mode, operation, loaded=loaded, image_format=image_format)
+        loaded = True
+        peak = max(peak, transient)
+        resident = image_bytes(size, mode)
+
+    # Encoding converts modes the format cannot store (e.g. RGBA for JPEG)
+    output_format = format_from_path(output_path) if output_path else None
+    if output_format in ENCODER_MODES and mode not in ENCODER_MODES[output_format]:
+        peak = max(peak, 2 * resident)
+    if frames > 1:
+        # Every frame is decoded to RGBA and kept until the processed frames are encoded together
+        peak += frames * (frame_bytes + resident)
+    return peak + JOB_OVERHEAD_BYTES
+
+def estimate_jobs(tasks, operations, workers=HEADER_WORKERS):
+    """
+    Estimate the peak memory of many jobs, reading headers in parallel threads.
+
+    Unreadable files get an estimate of JOB_OVERHEAD_BYTES; they fail quickly
+    when processed.
+
+    Args:
+        tasks: List of (input_path, output_path) pairs
+        operations: Operation dicts applied to every image
+
+    Returns:
+        List of estimates in bytes, in the order of tasks
+    """
+    def estimate(task):
+        try:
+            return estimate_peak(task[0], operations, output_path=task[1])
+        except Exception:
+            return JOB_OVERHEAD_BYTES
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(estimate, tasks))
+
+class MemoryScheduler:
+    """
+    Decide which waiting jobs may start without exceeding a memory budget.
+
+    Jobs are identified by any hashable key and carry an estimated cost in
+    bytes. take() returns the next job to start, or None when nothing fits
+    right now; release() returns a finished job's memory.
+
+    The largest waiting job is started first. When it does not fit, smaller
+    jobs that do fit are started instead, but only up to `slots` of them in
+    a row; after that nothing new starts until the large job fits, so it
+    cannot be starved by a stream of small ones. A job larger than the whole
+    budget runs on its own once everything else has finished.
+    """
+
+    def __init__(self, budget, slots):
+        """
+        Args:
+            budget: Memory budget in bytes
+            slots: Maximum number of jobs running at once (e.g. worker processes)
+        """
+        self.budget = budget
+        self.slots = slots
+        self.used = 0
+        self.running = {}
+        # Smallest first, so the largest job is popped off the end; among equal
+        # costs, jobs queued earlier sit nearer the end
+        self.waiting = []
+        self.skipped = 0
+
+    def add(self, key, cost):
+        """Queue a job."""
+        bisect.insort_left(self.waiting, (cost, key), key=lambda job: job[0])
+
+    def add_all(self, jobs):
+        """Queue many (key, cost) jobs, sorting once instead of once per job."""
+        queue = list(reversed(self.waiting)) + [(cost, key) for key, cost in jobs]
+        queue.sort(key=lambda job: job[0], reverse=True)
+        queue.reverse()
+        self.waiting = queue
+
+    def fits(self, cost):
+        if not self.running:
+            # Always start something, even a job over budget, when nothing else is running
+            return True
+        return len(self.running) < self.slots and self.used + cost <= self.budget
+
+    def take(self):
+        """
+        Start the next job that fits.
+
+        Returns:
+            The job's key, or None if no waiting job can start now
+        """
+        if not self.waiting or len(self.running) >= self.slots:
+            return None
+
+        for index in range(len(self.waiting)):
+            if index > 0 and self.skipped >= self.slots:
+                # The largest job has waited a full round; let memory free up for it
+                return None
+            cost, key = self.waiting[-1 - index]
+            if self.fits(cost):
+                self.skipped = self.skipped + 1 if index > 0 else 0
+                del self.waiting[-1 - index]
+                self.running[key] = cost
+                self.used += cost
+                return key
+        return None
+
+    def release(self, key):
+        """Mark a running job as finished."""
+        self.used -= self.running.pop(key)
+
+    def __len__(self):
+        """Number of jobs waiting or running."""
+        return len(self.waiting) + len(self.running)
@@ -0,0 +1,454 @@
+#!/usr/bin/env python3
+"""
+Tiled, bounded-memory execution of crop, rotate/flip and effects for very large images.
+
+The input is decoded a strip at a time by narrowing Pillow's tile descriptors
+to the rows that are needed, and the output is streamed strip by strip into an
+uncompressed TIFF, so peak memory follows the configured budget rather than
+the image size.
+"""
+from PIL import Image
+from contextlib import contextmanager
+import math
+import os
+import struct
+import sys
+
+try:
+    from PIL.ImageFile import _Tile as Tile
+except ImportError:
+    # Pillow < 11 describes tiles with plain tuples
+    def Tile(*fields):
+        return fields
+
+try:
+    from apply_effects import add_effects, filter_names, filter_size, kernel_size, parse_kernel, parse_unsharp
+except ImportError:
+    print("Error: 'apply_effects.py' not found.", file=sys.stderr)
+    sys.exit(1)
+
+DEFAULT_MEMORY_BUDGET_MB = 256
+
+# Bits per pixel of the raw (uncompressed) layouts that can be addressed by row
+RAWMODE_BITS = {
+    '1': 1, 'L': 8, 'P': 8, 'LA': 16, 'RGB': 24, 'BGR': 24,
+    'RGBA': 32, 'RGBX': 32, 'BGRA': 32, 'BGRX': 32, 'CMYK': 32,
+    'I;16': 16, 'I;16L': 16, 'I;16B': 16, 'I;16N': 16,
+    'I;32': 32, 'F;32F': 32, 'F;32BF': 32,
+}
+
+# Modes the TIFF writer stores directly: (photometric interpretation, extra samples)
+TIFF_LAYOUTS = {
+    'L': (1, []),
+    'LA': (1, [2]),
+    'RGB': (2, []),
+    'RGBA': (2, [2]),
+}
+
+@contextmanager
+def bomb_check_disabled():
+    """Suspend Pillow's decompression-bomb check; memory is bounded by the strip size instead."""
+    limit = Image.MAX_IMAGE_PIXELS
+    Image.MAX_IMAGE_PIXELS = None
+    try:
+        yield
+    finally:
+        Image.MAX_IMAGE_PIXELS = limit
+
+def open_unbounded(path):
+    """Open an image lazily without Pillow's decompression-bomb check."""
+    with bomb_check_disabled():
+        return Image.open(path)
+
+def bytes_per_pixel(mode):
+    """Decoded size of one pixel in bytes (Pillow stores 3-band modes as 4 bytes)."""
+    if mode in ('I', 'F'):
+        return 4
+    if mode.startswith('I;16'):
+        return 2
+    bands = Image.getmodebands(mode)
+    return 4 if bands == 3 else bands
+
+def output_mode(mode):
+    """Pick the TIFF-writable mode a strip of the given mode is converted to."""
+    if mode in TIFF_LAYOUTS:
+        return mode
+    if mode in ('1', 'I;16', 'I;16L', 'I;16B', 'I', 'F'):
+        return 'L'
+    if mode in ('PA', 'P'):
+        return 'RGBA'
+    return 'RGB'
+
+def gaussian_halo(radius):
+    """
+    Number of rows beyond a strip that GaussianBlur(radius) reads.
+
+    Mirrors Pillow's approximation of a Gaussian by three box blurs.
+    """
+    if not radius:
+        return 0
+    passes = 3
+    sigma2 = radius * radius / passes
+    box = math.floor((math.sqrt(12.0 * sigma2 + 1.0) - 1.0) / 2.0)
+    return passes * (box + 2)
+
+def filter_halo(blur=None, filter_type=None, kernel=None, unsharp=None):
+    """Rows of overlap a strip needs so that the chained effects match the full-image result."""
+    halo = gaussian_halo(blur)
+    # Chained filters each read their own neighbourhood of the previous result
+    for name in filter_names(filter_type):
+        halo += filter_size(name) // 2
+    if kernel:
+        halo += kernel_size(parse_kernel(kernel)[0]) // 2
+    if unsharp:
+        halo += gaussian_halo(parse_unsharp(unsharp)[0])
+    return halo
+
+class RegionReader:
+    """
+    Decode horizontal bands of an image without decoding the rest of it.
+
+    Works for uncompressed images (TIFF, BMP, PPM, ...) and for TIFFs stored in
+    several strips or tiles. Other inputs are decoded in full once, which is
+    only allowed if the decoded image fits in the memory budget.
+    """
+
+    def __init__(self, path, memory_budget):
+        self.path = path
+        img = open_unbounded(path)
+        self.size = img.size
+        self.width, self.height = img.size
+        self.mode = img.mode
+        self.tiles = list(img.tile)
+
+        orientation = img.getexif().get(0x0112, 1) if img.format == 'TIFF' else 1
+        self.region_decodable = bool(self.tiles) and orientation == 1 and (
+            len(self.tiles) > 1 or self.tiles[0][0] == 'raw')
+        self._full = None
+
+        if not self.region_decodable:
+            decoded = self.width * self.height * bytes_per_pixel(self.mode)
+            if decoded > memory_budget:
+                raise ValueError(
+                    f"{img.format} input of {self.width}x{self.height} cannot be decoded in strips and needs "
+                    f"{decoded / 2**20:.1f}MB, over the {memory_budget / 2**20:.1f}MB budget. "
+                    "Convert it to an uncompressed or tiled TIFF first, or raise the budget.")
+        img.close()
+
+    def _slice_tile(self, tile, y0, y1):
+        """Narrow one tile descriptor to rows [y0, y1); returns (tile, first row, last row)."""
+        codec, (tx0, ty0, tx1, ty1), offset, args = tile
+        if isinstance(args, str):
+            args = (args, 0, 1)
+
+        if codec != 'raw' or args[0] not in RAWMODE_BITS:
+            # Compressed strips have to be decoded whole
+            return tile, ty0, ty1
+
+        rawmode, stride = args[0], args[1]
+        orientation = args[2] if len(args) > 2 else 1
+        if not stride:
+            stride = ((tx1 - tx0) * RAWMODE_BITS[rawmode] + 7) // 8
+
+        ny0, ny1 = max(ty0, y0), min(ty1, y1)
+        first_row = ny0 - ty0 if orientation >= 0 else ty1 - ny1
+        sliced = Tile(codec, (tx0, ny0, tx1, ny1), offset + first_row * stride, (rawmode, stride, orientation))
+        return sliced, ny0, ny1
+
+    def read_rows(self, y0, y1):
+        """Decode full-width rows [y0, y1) as a new image."""
+        if not self.region_decodable:
+            if self._full is None:
+                self._full = open_unbounded(self.path)
+                with bomb_check_disabled():
+                    self._full.load()
+            return self._full.crop((0, y0, self.width, y1))
+
+        selected = []
+        window_top, window_bottom = y0, y1
+        for tile in self.tiles:
+            ty0, ty1 = tile[1][1], tile[1][3]
+            if ty1 <= y0 or ty0 >= y1:
+                continue
+            sliced, sy0, sy1 = self._slice_tile(tile, y0, y1)
+            window_top, window_bottom = min(window_top, sy0), max(window_bottom, sy1)
+            selected.append(sliced)
+
+        # Point a fresh lazily opened image at just the selected rows and decode it
+        img = open_unbounded(self.path)
+        img._size = (self.width, window_bottom - window_top)
+        if hasattr(img, '_tile_size'):
+            # TIFF allocates its decode buffer from _tile_size
+            img._tile_size = img._size
+        img.tile = [Tile(codec, (x0, ty0 - window_top, x1, ty1 - window_top), offset, args)
+                    for codec, (x0, ty0, x1, ty1), offset, args in selected]
+        with bomb_check_disabled():
+            img.load()
+
+        strip = img.crop((0, y0 - window_top, self.width, y1 - window_top))
+        img.close()
+        return strip
+
+    def read(self, box, window_rows):
+        """
+        Decode an arbitrary box, window_rows full-width rows at a time.
+
+        Parts of the box outside the image are filled with zeros, like Image.crop.
+        """
+        left, top, right, bottom = box
+        region = Image.new(self.mode, (right - left, bottom - top))
+        y = max(top, 0)
+        end = min(bottom, self.height)
+        while y < end:
+            y_next = min(y + window_rows, end)
+            strip = self.read_rows(y, y_next)
+            if strip.mode == 'P' and y == max(top, 0):
+                region.putpalette(strip.getpalette())
+            region.paste(strip.crop((left, 0, right, y_next - y)), (0, y - top))
+            y = y_next
+        return region
+
+    def close(self):
+        if self._full is not None:
+            self._full.close()
+            self._full = None
+
+class TiffStripWriter:
+    """
+    Stream rows into an uncompressed, strip-organised TIFF.
+
+    Pixel data is written as it arrives and the directory is appended at the
+    end, so nothing but the current strip is held in memory. BigTIFF is used
+    automatically when the data does not fit in a classic 4GB TIFF.
+    """
+
+    ROWS_PER_STRIP = 64
+
+    def __init__(self, path, size, mode):
+        if mode not in TIFF_LAYOUTS:
+            raise ValueError(f"Unsupported mode for TIFF output: {mode}")
+        self.path = path
+        self.width, self.height = size
+        self.mode = mode
+        self.samples = len(mode)
+        self.row_bytes = self.width * self.samples
+        self.rows_written = 0
+        self.bigtiff = self.row_bytes * self.height > 2**32 - 2**20
+
+        self.fp = open(path, 'wb')
+        if self.bigtiff:
+            self.fp.write(b'II' + struct.pack('<HHHQ', 43, 8, 0, 0))
+        else:
+            self.fp.write(b'II' + struct.pack('<HI', 42, 0))
+        self.data_offset = self.fp.tell()
+
+    def write(self, strip):
+        """Append a full-width strip of rows."""
+        if strip.width != self.width:
+            raise ValueError(f"Strip width {strip.width} does not match image width {self.width}")
+        if strip.mode != self.mode:
+            strip = strip.convert(self.mode)
+        self.fp.write(strip.tobytes())
+        self.rows_written += strip.height
+
+    def close(self):
+        """Write the image directory and close the file."""
+        if self.fp is None:
+            return
+        try:
+            if self.rows_written != self.height:
+                raise ValueError(f"Wrote {self.rows_written} of {self.height} rows")
+            self._write_directory()
+        finally:
+            self.fp.close()
+            self.fp = None
+
+    def abort(self):
+        """Close and delete an incomplete output file."""
+        if self.fp is not None:
+            self.fp.close()
+            self.fp = None
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def _write_directory(self):
+        rows = self.ROWS_PER_STRIP
+        strip_count = (self.height + rows - 1) // rows
+        offsets = [self.data_offset + i * rows * self.row_bytes for i in range(strip_count)]
+        counts = [min(rows, self.height - i * rows) * self.row_bytes for i in range(strip_count)]
+        photometric, extra_samples = TIFF_LAYOUTS[self.mode]
+
+        # (tag, type, values); types: 3 = SHORT, 4 = LONG, 16 = LONG8
+        long_type = 16 if self.bigtiff else 4
+        entries = [
+            (256, 4, [self.width]),
+            (257, 4, [self.height]),
+            (258, 3, [8] * self.samples),
+            (259, 3, [1]),
+            (262, 3, [photometric]),
+            (273, long_type, offsets),
+            (277, 3, [self.samples]),
+            (278, 4, [rows]),
+            (279, long_type, counts),
+            (284, 3, [1]),
+        ]
+        if extra_samples:
+            entries.append((338, 3, extra_samples))
+
+        formats = {3: 'H', 4: 'I', 16: 'Q'}
+        inline_bytes = 8 if self.bigtiff else 4
+        count_format = '<Q' if self.bigtiff else '<H'
+        entry_format = '<HHQ' if self.bigtiff else '<HHI'
+        entry_size = 20 if self.bigtiff else 12
+
+        self.fp.seek(0, os.SEEK_END)
+        if self.fp.tell() % 2:
+            self.fp.write(b'\0')
+        ifd_offset = self.fp.tell()
+        external_offset = ifd_offset + struct.calcsize(count_format) + len(entries) * entry_size + inline_bytes
+
+        directory = [struct.pack(count_format, len(entries))]
+        external = []
+        for tag, value_type, values in entries:
+            data = struct.pack(f"<{len(values)}{formats[value_type]}", *values)
+            directory.append(struct.pack(entry_format, tag, value_type, len(values)))
+            if len(data) <= inline_bytes:
+                directory.append(data.ljust(inline_bytes, b'\0'))
+            else:
+                directory.append(struct.pack('<Q' if self.bigtiff else '<I', external_offset))
+                external.append(data)
+                external_offset += len(data)
+        directory.append(b'\0' * inline_bytes)
+
+        self.fp.write(b''.join(directory) + b''.join(external))
+        self.fp.seek(8 if self.bigtiff else 4)
+        self.fp.write(struct.pack('<Q' if self.bigtiff else '<I', ifd_offset))
+
+def budget_bytes(memory_budget_mb=None):
+    """Convert a budget in megabytes (default DEFAULT_MEMORY_BUDGET_MB) to bytes."""
+    return int((memory_budget_mb or DEFAULT_MEMORY_BUDGET_MB) * 2**20)
+
+def budget_rows(memory_budget, row_bytes, copies, halo=0):
+    """Largest strip height whose working set (copies x rows, plus halo) fits the budget."""
+    rows = memory_budget // (copies * max(row_bytes, 1)) - 2 * halo
+    if rows < 1:
+        raise ValueError(f"Memory budget of {memory_budget / 2**20:.1f}MB is too small for rows of {row_bytes} bytes"
+                         + (f" with a {halo}-row overlap" if halo else ""))
+    return rows
+
+def check_tiff_output(output_path):
+    if os.path.splitext(output_path)[1].lower() not in ('.tif', '.tiff'):
+        raise ValueError("Tiled mode writes TIFF output; use a .tif or .tiff output path")
+
+def tiled_crop(input_path, output_path, box, memory_budget_mb=None):
+    """
+    Crop a large image strip by strip.
+
+    Returns:
+        (input size, output size) tuple
+    """
+    check_tiff_output(output_path)
+    memory_budget = budget_bytes(memory_budget_mb)
+    left, top, right, bottom = box
+    if left >= right or top >= bottom:
+        raise ValueError("Invalid crop coordinates: left must be < right and top must be < bottom")
+
+    reader = RegionReader(input_path, memory_budget)
+    mode = output_mode(reader.mode)
+    try:
+        # Working set: decoded window, its cropped copy, the output strip and its raw bytes
+        rows = budget_rows(memory_budget, reader.width * bytes_per_pixel(reader.mode), 4)
+        with TiffStripWriter(output_path, (right - left, bottom - top), mode) as writer:
+            for y in range(top, bottom, rows):
+                writer.write(reader.read((left, y, right, min(y + rows, bottom)), rows))
+    finally:
+        reader.close()
+    return reader.size, (right - left, bottom - top)
+
+def tiled_transpose(input_path, output_path, method, memory_budget_mb=None):
+    """
+    Apply a right-angle rotation or flip (an Image.Transpose member) strip by strip.
+
+    Output strips of 90°/270° rotations and transposes are input column bands,
+    so the input is re-read once per band instead of being held in memory.
+
+    Returns:
+        (input size, output size) tuple
+    """
+    check_tiff_output(output_path)
+    memory_budget = budget_bytes(memory_budget_mb)
+    reader = RegionReader(input_path, memory_budget)
+    width, height = reader.size
+    mode = output_mode(reader.mode)
+    pixel_bytes = bytes_per_pixel(reader.mode)
+    T = Image.Transpose
+
+    swaps_axes = method in (T.ROTATE_90, T.ROTATE_270, T.TRANSPOSE, T.TRANSVERSE)
+    out_size = (height, width) if swaps_axes else (width, height)
+
+    try:
+        if swaps_axes:
+            # A quarter of the budget for the read window and its cropped copy; the rest
+            # for the column band, its transpose and the raw bytes written out
+            window_rows = budget_rows(memory_budget // 4, width * pixel_bytes, 2)
+            rows = budget_rows(memory_budget * 3 // 4, height * pixel_bytes, 3)
+        else:
+            # Decoded window, cropped copy, output strip, its transpose and raw bytes
+            window_rows = rows = budget_rows(memory_budget, width * pixel_bytes, 5)
+
+        with TiffStripWriter(output_path, out_size, mode) as writer:
+            for a in range(0, out_size[1], rows):
+                b = min(a + rows, out_size[1])
+                if method in (T.ROTATE_270, T.TRANSPOSE):
+                    box = (a, 0, b, height)
+                elif method in (T.ROTATE_90, T.TRANSVERSE):
+                    box = (width - b, 0, width - a, height)
+                elif method in (T.FLIP_TOP_BOTTOM, T.ROTATE_180):
+                    box = (0, height - b, width, height - a)
+                else:
+                    box = (0, a, width, b)
+                writer.write(reader.read(box, window_rows).transpose(method))
+    finally:
+        reader.close()
+    return reader.size, out_size
+
+def tiled_effects(input_path, output_path, blur=None, filter_type=None, kernel=None, kernel_scale=None,
+                  kernel_offset=0, unsharp=None, threads=1, fuse=False, memory_budget_mb=None):
+    """
+    Apply blur, filters and/or unsharp masking strip by strip, with enough overlap between
+    strips that the result matches filtering the whole image.
+
+    Returns:
+        (input size, output size) tuple
+    """
+    check_tiff_output(output_path)
+    memory_budget = budget_bytes(memory_budget_mb)
+    halo = filter_halo(blur, filter_type, kernel, unsharp)
+    reader = RegionReader(input_path, memory_budget)
+    width, height = reader.size
+    mode = output_mode(reader.mode)
+
+    try:
+        # Working set: input strip with halo, the blur's scratch buffer, blurred and
+        # filtered copies, the cropped output strip and its raw bytes
+        rows = budget_rows(memory_budget, width * bytes_per_pixel(reader.mode), 6, halo)
+        with TiffStripWriter(output_path, reader.size, mode) as writer:
+            for y in range(0, height, rows):
+                y_end = min(y + rows, height)
+                top, bottom = max(y - halo, 0), min(y_end + halo, height)
+                strip = add_effects(reader.read_rows(top, bottom), blur=blur, filter_type=filter_type, kernel=kernel,
+                                    kernel_scale=kernel_scale, kernel_offset=kernel_offset, unsharp=unsharp,
+                                    threads=threads, fuse=fuse)
+                writer.write(strip.crop((0, y - top, width, y_end - top)))
+    finally:
+        reader.close()
+    return reader.size, reader.size